@@ -24,13 +24,67 @@ from obozrenie.global_strings import *
 from . import rigsofrods
 from . import qstat
 from . import minetest
+from . import a2s
+from . import quake3
 
 adapter_table = {}
 
-adapter_list = ('rigsofrods', 'qstat', 'minetest')
+adapter_list = ('rigsofrods', 'qstat', 'minetest', 'a2s', 'quake3')
 
 for adapter in adapter_list:
     adapter_table[adapter] = globals()[adapter]
 
 helpers.debug_msg([CORE_MSG, i18n._("%(adapter_num)i adapters loaded successfully") % {
                   'adapter_num': len(adapter_list)}])
+
+
+def stat_master_iter(adapter: str, game: str, game_info: dict, master_list: list, token=None):
+    """
+    Yields lists of servers as the adapter receives them.
+    Adapters may provide stat_master_iter with this contract; for the ones that only provide stat_master the whole list is yielded at once.
+    The optional token (helpers.CancelToken) tells the adapter when to stop; what was received until then is still yielded.
+    """
+    adapter_module = adapter_table[adapter]
+    try:
+        stat_master_iter_cmd = adapter_module.stat_master_iter
+    except AttributeError:
+        yield adapter_module.stat_master(game, game_info, master_list)
+    else:
+        yield from stat_master_iter_cmd(game, game_info, master_list, token)
+
+
+def get_batch_adapters() -> list:
+    """Returns the adapters that can query several games at once, see stat_master_batch_iter."""
+    return [adapter for adapter, adapter_module in adapter_table.items() if hasattr(adapter_module, 'stat_master_batch_iter')]
+
+
+def stat_master_batch_iter(adapter: str, games: dict, token=None, server_lists=None):
+    """
+    Yields (game, servers) as the adapter receives the servers of several games in one go.
+    games maps game IDs to (game_info, master_list); all of them must use the adapter.
+    Games listed in server_lists have the specified servers queried instead of their master servers, see stat_servers_iter.
+    """
+    yield from adapter_table[adapter].stat_master_batch_iter(games, token, server_lists)
+
+
+def can_stat_server_details(adapter: str) -> bool:
+    """Tells whether the adapter can query a single server for the details server list queries leave out, see stat_server_details."""
+    return hasattr(adapter_table[adapter], 'stat_server_details')
+
+
+def stat_server_details(adapter: str, game: str, game_info: dict, host: str, token=None):
+    """Returns the entry of a single server with its rules and player list, or None if the server did not respond."""
+    return adapter_table[adapter].stat_server_details(game, game_info, host, token)
+
+
+def can_stat_servers(adapter: str) -> bool:
+    """Tells whether the adapter can query known servers without asking the master servers, see stat_servers_iter."""
+    return hasattr(adapter_table[adapter], 'stat_servers_iter')
+
+
+def stat_servers_iter(adapter: str, game: str, game_info: dict, server_list: list, token=None):
+    """
+    Yields lists of servers as the adapter requeries the specified "host:port" servers, skipping the master servers.
+    Servers that did not respond are left out. Only for adapters that can_stat_servers.
+    """
+    yield from adapter_table[adapter].stat_servers_iter(game, game_info, server_list, token)
@@ -0,0 +1,373 @@
+#!/usr/bin/env python3
+# This source file is part of Obozrenie
+# Copyright 2015 Artem Vorotnikov
+
+# For more information, see https://github.com/obozrenie/obozrenie
+
+# Obozrenie is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License version 3, as
+# published by the Free Software Foundation.
+
+# Obozrenie is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+
+# You should have received a copy of the GNU General Public License
+# along with Obozrenie.  If not, see <http://www.gnu.org/licenses/>.
+
+"""
+Native Source engine server query adapter.
+
+Servers are queried with A2S_INFO over a single asyncio UDP socket, so no qstat process, XML or separate ping pass is involved: the response time of the query is the ping.
+Game settings are shared with the qstat adapter (qstat.toml), which makes this adapter a drop-in alternative for games with the A2S server type.
+"""
+
+import asyncio
+import functools
+import os
+import socket
+import struct
+
+from obozrenie.global_settings import *
+from obozrenie.global_strings import *
+
+import obozrenie.i18n as i18n
+import obozrenie.helpers as helpers
+import obozrenie.records as records
+import obozrenie.proxies.asyncio_udp as asyncio_udp
+
+from . import udp
+
+BACKEND_CONFIG = os.path.join(SETTINGS_INTERNAL_BACKENDS_DIR, "qstat.toml")
+A2S_MSG = BACKENDCAT_MSG + i18n._("A2S:")
+
+A2S_TIMEOUT = 1.0  # Seconds to wait for a single response
+A2S_RETRIES = 2  # Extra attempts for servers that did not respond
+A2S_MAX_IN_FLIGHT = 64  # Queries waiting for a response at the same time
+A2S_BATCH_INTERVAL = 0.5  # Seconds between batches of queried servers
+
+PACKET_HEADER = b'\xff\xff\xff\xff'
+A2S_INFO_REQUEST = PACKET_HEADER + b'TSource Engine Query\x00'
+A2S_PLAYER_REQUEST = PACKET_HEADER + b'U'
+A2S_NO_CHALLENGE = b'\xff\xff\xff\xff'  # Asks the server for a challenge number
+S2A_INFO = 0x49
+S2A_PLAYER = 0x44
+S2C_CHALLENGE = 0x41
+
+# Extra data flags of the A2S_INFO response
+EDF_PORT = 0x80
+EDF_STEAM_ID = 0x10
+EDF_SPECTATOR = 0x40
+EDF_KEYWORDS = 0x20
+EDF_GAME_ID = 0x01
+
+STM_REQUEST = 0x31
+STM_RESPONSE_HEADER = PACKET_HEADER + b'\x66\x0a'
+STM_REGION_ALL = 0xFF
+STM_SEED = '0.0.0.0:0'
+STM_TIMEOUT = 5.0  # Seconds to wait for a page of the master server listing
+
+
+def debug_msg(game_name, msg=None):
+    if msg is not None:
+        helpers.debug_msg([A2S_MSG, game_name, msg])
+
+
+class PacketReader:
+    """Reads little endian values and null terminated strings from a packet."""
+
+    def __init__(self, data: bytes, offset: int = 0):
+        self.data = data
+        self.offset = offset
+
+    def remaining(self) -> int:
+        return len(self.data) - self.offset
+
+    def read(self, fmt: str):
+        value, = struct.unpack_from('<' + fmt, self.data, self.offset)
+        self.offset += struct.calcsize('<' + fmt)
+        return value
+
+    def read_byte(self) -> int:
+        return self.read('B')
+
+    def read_short(self) -> int:
+        return self.read('H')
+
+    def read_long_long(self) -> int:
+        return self.read('Q')
+
+    def read_string(self) -> str:
+        end = self.data.index(b'\x00', self.offset)
+        value = self.data[self.offset:end].decode('utf-8', 'replace')
+        self.offset = end + 1
+        return value
+
+
+def parse_info(data: bytes) -> dict:
+    """Parses the payload of an A2S_INFO response, the part after the header and the response type."""
+    reader = PacketReader(data)
+    info = {}
+    info['protocol'] = reader.read_byte()
+    info['name'] = reader.read_string()
+    info['map'] = reader.read_string()
+    info['folder'] = reader.read_string()
+    info['game'] = reader.read_string()
+    info['app_id'] = reader.read_short()
+    info['players'] = reader.read_byte()
+    info['max_players'] = reader.read_byte()
+    info['bots'] = reader.read_byte()
+    info['server_type'] = chr(reader.read_byte())
+    info['environment'] = chr(reader.read_byte())
+    info['visibility'] = reader.read_byte()
+    info['vac'] = reader.read_byte()
+    info['version'] = reader.read_string()
+
+    if reader.remaining() > 0:
+        edf = reader.read_byte()
+        if edf & EDF_PORT:
+            info['port'] = reader.read_short()
+        if edf & EDF_STEAM_ID:
+            info['steam_id'] = reader.read_long_long()
+        if edf & EDF_SPECTATOR:
+            info['spectator_port'] = reader.read_short()
+            info['spectator_name'] = reader.read_string()
+        if edf & EDF_KEYWORDS:
+            info['keywords'] = reader.read_string()
+        if edf & EDF_GAME_ID:
+            info['game_id'] = reader.read_long_long()
+
+    return info
+
+
+def parse_players(data: bytes) -> list:
+    """Parses the payload of an A2S_PLAYER response. Source servers do not tell player pings, they are reported as 9999 like unknown pings elsewhere."""
+    reader = PacketReader(data)
+    players = []
+    for i in range(reader.read_byte()):
+        reader.read_byte()  # Index
+        name = reader.read_string()
+        score = reader.read('l')
+        reader.read('f')  # Time connected
+        players.append({'name': name, 'score': score, 'ping': 9999})
+    return players
+
+
+def adapt_server_entry(host: str, info: dict, rtt: float, game: str):
+    """Builds the same server entry the qstat adapter does for the A2S server type."""
+    server_dict = records.ServerRecord()
+    server_dict['host'] = host
+    server_dict['name'] = info['name']
+    server_dict['game_id'] = game
+    server_dict['game_mod'] = ""
+    server_dict['game_name'] = info['game']
+    server_dict['game_type'] = info['folder']
+    server_dict['terrain'] = info['map']
+    server_dict['player_count'] = info['players']
+    server_dict['player_limit'] = info['max_players']
+    server_dict['password'] = bool(info['visibility'])
+    server_dict['secure'] = bool(info['vac'])
+    server_dict['ping'] = round(rtt * 1000)
+    server_dict['players'] = []
+
+    rules = {'protocol': str(info['protocol']),
+             'gamedir': info['folder'],
+             'gamename': info['game'],
+             'appid': str(info['app_id']),
+             'bots': str(info['bots']),
+             'dedicated': info['server_type'],
+             'os': info['environment'],
+             'password': str(info['visibility']),
+             'secure': str(info['vac']),
+             'version': info['version']}
+    if 'keywords' in info:
+        rules['keywords'] = info['keywords']
+    if 'game_id' in info:
+        rules['game_id'] = str(info['game_id'])
+    server_dict['rules'] = rules
+
+    return server_dict
+
+
+def build_master_request(seed: str, region: int, filter_string: str) -> bytes:
+    return bytes((STM_REQUEST, region)) + seed.encode() + b'\x00' + filter_string.encode() + b'\x00'
+
+
+def parse_master_response(data: bytes) -> list:
+    """Parses a page of the master server listing into "ip:port" strings. The listing ends with 0.0.0.0:0."""
+    if not data.startswith(STM_RESPONSE_HEADER):
+        raise ValueError(i18n._("Invalid master server response."))
+
+    addresses = []
+    for offset in range(len(STM_RESPONSE_HEADER), len(data) - 5, 6):
+        ip = socket.inet_ntoa(data[offset:offset + 4])
+        port, = struct.unpack_from('>H', data, offset + 4)
+        addresses.append("%s:%i" % (ip, port))
+    return addresses
+
+
+class A2SClient(asyncio_udp.UDPClient):
+    """Queries Source engine servers and Steam master servers over a single UDP socket."""
+
+    def __init__(self, timeout: float = A2S_TIMEOUT, retries: int = A2S_RETRIES, max_in_flight: int = A2S_MAX_IN_FLIGHT, token=None):
+        super().__init__(timeout, retries, max_in_flight, token)
+
+    async def query_info(self, address: tuple):
+        """Returns the parsed A2S_INFO response and its round trip time, or None if the server did not answer."""
+        for attempt in range(self.retries + 1):
+            if self.token.stopped:
+                return None
+
+            packet = A2S_INFO_REQUEST
+            for handshake in range(2):
+                response = await self.request(address, packet, self.timeout)
+                if response is None:
+                    break
+                data, rtt = response
+                if len(data) < 5 or not data.startswith(PACKET_HEADER):
+                    break
+
+                if data[4] == S2C_CHALLENGE and len(data) >= 9:
+                    # The server wants its challenge number back before it answers
+                    packet = A2S_INFO_REQUEST + data[5:9]
+                elif data[4] == S2A_INFO:
+                    try:
+                        return parse_info(data[5:]), rtt
+                    except (struct.error, ValueError):
+                        return None
+                else:
+                    break
+        return None
+
+    async def query_players(self, address: tuple):
+        """Returns the player list of a server, or None if the server did not answer."""
+        for attempt in range(self.retries + 1):
+            if self.token.stopped:
+                return None
+
+            packet = A2S_PLAYER_REQUEST + A2S_NO_CHALLENGE
+            for handshake in range(2):
+                response = await self.request(address, packet, self.timeout)
+                if response is None:
+                    break
+                data, rtt = response
+                if len(data) < 5 or not data.startswith(PACKET_HEADER):
+                    break
+
+                if data[4] == S2C_CHALLENGE and len(data) >= 9:
+                    packet = A2S_PLAYER_REQUEST + data[5:9]
+                elif data[4] == S2A_PLAYER:
+                    try:
+                        return parse_players(data[5:])
+                    except (struct.error, ValueError):
+                        return None
+                else:
+                    break
+        return None
+
+    async def query_many(self, addresses):
+        """
+        Queries the servers at the specified "ip:port" addresses, which may be an iterable or an async iterable.
+        Yields (address, info, rtt) as responses arrive; servers that never answered are left out. Duplicate addresses are queried once.
+        """
+        async for address, (info, rtt) in super().query_many(addresses, self.query_info):
+            yield address, info, rtt
+
+    async def iter_master_pages(self, master: str, filter_string: str = '', region: int = STM_REGION_ALL):
+        """
+        Yields the server listing of a Steam master server page by page, as "ip:port" strings.
+        Every page is requested from the last address of the previous one, so the servers of a page can be queried while the next one is on its way.
+        """
+        master_address = await self.resolve(master)
+
+        seed = STM_SEED
+        while not self.token.stopped:
+            request = build_master_request(seed, region, filter_string)
+            for attempt in range(self.retries + 1):
+                response = await self.request(master_address, request, STM_TIMEOUT)
+                if response is not None:
+                    break
+            else:
+                raise ConnectionError(i18n._("Master server %(master)s did not respond.") % {'master': master})
+
+            page = parse_master_response(response[0])
+            last_page = not page or page[-1] == STM_SEED
+            if page and page[-1] == STM_SEED:
+                page = page[:-1]
+            if page:
+                yield page
+            if last_page:
+                break
+            seed = page[-1]
+
+
+def get_master_settings(game: str) -> tuple:
+    """
+    Returns the Steam master server filter and region for a game, based on its qstat settings.
+    The filter selects the game directory given as server_gametype; master_filter is appended to it and master_region narrows the listing down to a region.
+    """
+    game_config = helpers.load_table(BACKEND_CONFIG)['game'][game]
+    filter_string = ''
+    if 'server_gametype' in game_config:
+        filter_string = '\\gamedir\\' + game_config['server_gametype']
+    filter_string += game_config.get('master_filter', '')
+    return filter_string, game_config.get('master_region', STM_REGION_ALL)
+
+
+def iter_servers(game: str, game_info: dict, get_addresses, token):
+    """Queries the servers whose addresses get_addresses(client) gives, yielding them in batches as they respond. See udp.iter_servers."""
+    return udp.iter_servers(A2SClient, get_addresses,
+                            lambda address, info, rtt: adapt_server_entry(address, info, rtt, game),
+                            token, A2S_BATCH_INTERVAL, functools.partial(debug_msg, game_info["name"]))
+
+
+def stat_master_iter(game: str, game_info: dict, master_list: list, token=None):
+    """
+    Stats the master servers, yielding the queried servers in batches as they respond.
+    Servers are queried as soon as their page of the master listing arrives, without waiting for the rest of the listing.
+    """
+    filter_string, region = get_master_settings(game)
+    masters = [master.split('://', 1)[-1] for master in master_list]
+
+    def get_addresses(client):
+        return udp.iter_master_addresses(masters, lambda master: client.iter_master_pages(master, filter_string, region),
+                                         functools.partial(debug_msg, game_info["name"]))
+
+    yield from iter_servers(game, game_info, get_addresses, token)
+
+
+def stat_servers_iter(game: str, game_info: dict, server_list: list, token=None):
+    """Queries the specified servers directly, skipping the master servers. Yields the servers that responded in batches."""
+    yield from iter_servers(game, game_info, lambda client: server_list, token)
+
+
+def stat_server_details(game: str, game_info: dict, host: str, token=None):
+    """Queries a single server for its player list, which server list queries leave out. Returns None if the server did not respond."""
+    if token is None:
+        token = helpers.CancelToken()
+
+    async def query():
+        client = A2SClient(A2S_TIMEOUT, A2S_RETRIES, A2S_MAX_IN_FLIGHT, token)
+        await client.open()
+        try:
+            address = asyncio_udp.parse_address(host)
+            response = await client.query_info(address)
+            if response is None:
+                return None
+            info, rtt = response
+            players = await client.query_players(address)
+        finally:
+            client.close()
+
+        server_dict = adapt_server_entry(host, info, rtt, game)
+        if players is not None:
+            server_dict['players'] = players
+        return server_dict
+
+    return asyncio.run(query())
+
+
+def stat_master(game: str, game_info: dict, master_list: list, token=None):
+    """Stats the master server"""
+    return helpers.flatten_list(list(stat_master_iter(game, game_info, master_list, token)))
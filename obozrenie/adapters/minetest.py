@@ -27,14 +27,21 @@ from obozrenie.global_strings import *
 import obozrenie.i18n as i18n
 import obozrenie.helpers as helpers
 import obozrenie.ping as ping
+import obozrenie.records as records
 
 BACKEND_CONFIG = os.path.join(SETTINGS_INTERNAL_BACKENDS_DIR, "minetest.toml")
 MINETEST_MSG = BACKENDCAT_MSG + i18n._("Minetest:")
+HTTP_TIMEOUT = 10
 
+MINETEST_PROTOCOL_ID = b'\x4f\x45\x74\x03'
+# An original packet of peer 0 on channel 0, the server answers it by assigning a peer id
+MINETEST_HELLO = MINETEST_PROTOCOL_ID + b'\x00\x00\x00\x01'
+MINETEST_RESPONSE_SIZE = 14
 
-def get_json(master_page_uri):
+
+def get_json(master_page_uri, timeout=HTTP_TIMEOUT):
     try:
-        master_page_object = requests.get(master_page_uri)
+        master_page_object = requests.get(master_page_uri, timeout=timeout)
         master_page = master_page_object.text
     except Exception as e:
         raise ConnectionError(i18n._("Accessing URI %(uri)s failed with error %(msg)s.") % {
@@ -51,7 +58,7 @@ def get_json(master_page_uri):
 
 
 def parse_json_entry(entry):
-    entry_dict = {'rules': {}, 'players': []}
+    entry_dict = records.ServerRecord(rules={}, players=[])
     try:
         entry_dict['password'] = bool(entry['password'])
     except KeyError:
@@ -85,30 +92,43 @@ def parse_json_entry(entry):
     return entry_dict
 
 
-def stat_master(game: str, game_info: dict, master_list: list):
-    """Stats the master server"""
-    try:
-        backend_config_object = helpers.load_table(BACKEND_CONFIG)
+def build_disconnect(response: bytes) -> bytes:
+    """Builds the packet that drops the peer a server assigned in its response to the hello."""
+    return MINETEST_PROTOCOL_ID + response[12:14] + b'\x00\x00\x03'
+
+
+async def probe_server(address: tuple, timeout: float):
+    """Measures the response time of a server with the Minetest protocol handshake, for servers whose host does not answer pings."""
+    return await ping.udp_probe(address, MINETEST_HELLO, timeout,
+                                lambda data: data.startswith(MINETEST_PROTOCOL_ID) and len(data) >= MINETEST_RESPONSE_SIZE,
+                                build_disconnect)
 
-        server_json_table = []
-        server_table = []
 
+def stat_master_iter(game: str, game_info: dict, master_list: list, token=None):
+    """Stats the master servers, yielding the servers of every master as soon as they are pinged"""
+    if token is None:
+        token = helpers.CancelToken()
+    try:
         for master_uri in master_list:
-            server_json_table += get_json(master_uri)
+            if token.stopped:
+                return
 
-        for entry in server_json_table:
-            entry_dict = parse_json_entry(entry)
+            server_table = []
 
-            server_table.append(entry_dict)
+            for entry in get_json(master_uri, token.remaining(HTTP_TIMEOUT)):
+                entry_dict = parse_json_entry(entry)
+                entry_dict["game_id"] = game
 
-        ping.add_rtt_info(server_table)
+                server_table.append(entry_dict)
 
-        for i in range(len(server_table)):
-            entry = server_table[i]
-            entry["game_id"] = game
-            server_table[i] = entry
+            ping.add_rtt_info(server_table, token, probe_server)
 
-        return server_table
+            yield server_table
     except Exception as e:
         raise Exception(helpers.debug_msg_str(
             [BACKENDCAT_MSG + MINETEST_MSG, e.args[0]]))
+
+
+def stat_master(game: str, game_info: dict, master_list: list, token=None):
+    """Stats the master server"""
+    return helpers.flatten_list(list(stat_master_iter(game, game_info, master_list, token)))
@@ -20,19 +20,61 @@
 import os
 import re
 
-import json
-import subprocess
+import threading
 import time
-import xmltodict
+import xml.etree.ElementTree as ElementTree
 
 from obozrenie.global_settings import *
 from obozrenie.global_strings import *
 
 import obozrenie.i18n as i18n
 import obozrenie.helpers as helpers
+import obozrenie.records as records
+import obozrenie.proxies.qstat_process as qstat_process
 
 BACKEND_CONFIG = os.path.join(SETTINGS_INTERNAL_BACKENDS_DIR, "qstat.toml")
 QSTAT_MSG = BACKENDCAT_MSG + i18n._("QStat")
+QSTAT_KILL_DELAY = 5  # Seconds past the deadline after which a qstat process that did not stop by itself is killed
+QSTAT_BATCH_INTERVAL = 0.5  # Seconds between batches of parsed servers
+QSTAT_RAW_DELIMITER = "\x1f"  # Field separator of -raw output, a control character no server name should contain
+QSTAT_PARSERS = ('xml', 'raw')
+QSTAT_MAXSIM = 1024  # Servers all running qstat processes together may query at once
+QSTAT_MAXSIM_PER_GAME = 128  # Share of QSTAT_MAXSIM asked for by a qstat run per game it queries
+
+
+class SimBudget:
+    """
+    Shares the -maxsim budget among the qstat processes that run at the same time, so that a refresh of many games does not flood the network.
+    A run waits until at least QSTAT_MAXSIM_PER_GAME of the budget is free and takes as much of what it asked for as there is.
+    """
+
+    def __init__(self, total: int):
+        self.total = total
+        self.free = total
+        self.__condition = threading.Condition()
+
+    def __repr__(self):
+        return "<QStat -maxsim budget - free: %(free)i / %(total)i>" % {'free': self.free, 'total': self.total}
+
+    def acquire(self, amount: int, token=None) -> int:
+        """Takes up to amount from the budget and returns how much was taken, or 0 if the token stopped while waiting."""
+        amount = max(1, min(amount, self.total))
+        with self.__condition:
+            while self.free < min(amount, QSTAT_MAXSIM_PER_GAME):
+                if token is not None and token.stopped:
+                    return 0
+                self.__condition.wait(0.1)
+            granted = min(amount, self.free)
+            self.free -= granted
+            return granted
+
+    def release(self, amount: int) -> None:
+        with self.__condition:
+            self.free += amount
+            self.__condition.notify_all()
+
+
+sim_budget = SimBudget(QSTAT_MAXSIM)
 
 
 def debug_msg(game_name, msg=None):
@@ -71,6 +113,22 @@ def parse_player_entry(player, color_code_pattern):
     return player_entry
 
 
+def apply_rules(server_dict, rules: dict) -> None:
+    """Sets the server fields that are derived from server rules: game name, mod, password and anti-cheat flags."""
+    for rule_name, rule_text in rules.items():
+        if rule_name in ('gamename',):
+            server_dict['game_name'] = str(rule_text)
+        elif rule_name in ('punkbuster', 'sv_punkbuster', 'secure'):
+            server_dict['secure'] = bool(int(rule_text))
+        elif rule_name in ('game',):
+            server_dict['game_mod'] = str(rule_text)
+        elif rule_name in ('g_needpass', 'needpass', 'si_usepass', 'pswrd', 'password'):
+            try:
+                server_dict['password'] = bool(int(rule_text))
+            except TypeError:
+                server_dict['password'] = False
+
+
 def adapt_server_entry(qstat_entry, game):
     """Parses server entry returned by QStat"""
     color_code_pattern = '[\\^](.)'
@@ -80,7 +138,7 @@ def adapt_server_entry(qstat_entry, game):
 
     server_status = qstat_entry['@status']
     if server_status == 'UP':
-        server_dict = {}
+        server_dict = records.ServerRecord()
         server_dict['host'] = qstat_entry['hostname']
         server_dict['password'] = False
         server_dict['secure'] = False
@@ -118,19 +176,7 @@ def adapt_server_entry(qstat_entry, game):
                 else:
                     server_dict['rules'][rule_name] = None
 
-                rule_text = server_dict['rules'][rule_name]
-
-                if rule_name in ('gamename'):
-                    server_dict['game_name'] = str(rule_text)
-                elif rule_name in ('punkbuster', 'sv_punkbuster', 'secure'):
-                    server_dict['secure'] = bool(int(rule_text))
-                elif rule_name in ('game'):
-                    server_dict['game_mod'] = str(rule_text)
-                elif rule_name in ('g_needpass', 'needpass', 'si_usepass', 'pswrd', 'password'):
-                    try:
-                        server_dict['password'] = bool(int(rule_text))
-                    except TypeError:
-                        server_dict['password'] = False
+            apply_rules(server_dict, server_dict['rules'])
 
         if qstat_entry['players'] is not None:
             player_list = helpers.enforce_array(qstat_entry['players']['player'])
@@ -155,44 +201,163 @@ def adapt_qstat_entry(qstat_entry, game, master_type, server_type):
     return {'server_dict': server_dict, 'debug_msg': debug_message}
 
 
-def adapt_server_list(qstat_string, game, game_name, qstat_master_type, qstat_server_type, server_game_name, server_game_type):
-    server_table = []
+def element_to_dict(element):
+    """Converts an XML element to the structure xmltodict would give for it: attributes as '@name', repeated children as lists, empty elements as None."""
+    text = element.text.strip() if element.text is not None else ''
+    if not element.attrib and not len(element):
+        return text or None
+
+    entry = {'@' + name: value for name, value in element.attrib.items()}
+    for child in element:
+        child_entry = element_to_dict(child)
+        try:
+            siblings = entry[child.tag]
+        except KeyError:
+            entry[child.tag] = child_entry
+        else:
+            if isinstance(siblings, list):
+                siblings.append(child_entry)
+            else:
+                entry[child.tag] = [siblings, child_entry]
+
+    if text:
+        entry['#text'] = text
+    return entry or None
 
-    server_table_dict = json.loads(json.dumps(xmltodict.parse(qstat_string)))
-    server_table_dict['qstat']['server'] = helpers.enforce_array(server_table_dict['qstat']['server'])  # Enforce server array even if n=1
 
-    for qstat_entry in server_table_dict['qstat']['server']:  # For every server...
+def iter_qstat_entries(chunks):
+    """
+    Parses QStat XML output fed in chunks of bytes, e.g. straight from the qstat pipe.
+    Every <server> element is yielded as a dict (see element_to_dict) as soon as it is complete, and then discarded.
+    """
+    parser = ElementTree.XMLPullParser(events=('start', 'end'))
+    root = None
+
+    for chunk in chunks:
+        parser.feed(chunk)
+        for event, element in parser.read_events():
+            if event == 'start':
+                if root is None:
+                    root = element
+            elif element.tag == 'server':
+                yield element_to_dict(element)
+                # Detached from the root, so the parsed tree does not grow with the output
+                root.remove(element)
+    parser.close()
+
+
+def server_matches(server_dict, server_game_name, server_game_type) -> bool:
+    """Tells whether a server has the game name and type configured for a game, if any."""
+    for filter_rule in ((server_game_name, "game_name"), (server_game_type, "game_type")):
+        if filter_rule[0] is not None:
+            if filter_rule[1] not in server_dict.keys():
+                return False
+            if server_dict[filter_rule[1]] != filter_rule[0]:
+                return False
+    return True
+
+
+def iter_lines(chunks):
+    """Splits a stream fed in chunks of bytes into lines of text as they are complete."""
+    rest = b''
+    for chunk in chunks:
+        lines = (rest + chunk).split(b'\n')
+        rest = lines.pop()
+        for line in lines:
+            yield line.decode('utf-8', 'replace').rstrip('\r')
+    if rest:
+        yield rest.decode('utf-8', 'replace').rstrip('\r')
+
+
+def raw_to_entry(fields: list, server_types) -> dict:
+    """
+    Converts the fields of a -raw server or master line to the entry iter_qstat_entries would give for its XML counterpart.
+    Server lines are type, address, name, map, player limit, player count, ping, retries and, with qstat versions that print it, game type.
+    Master lines are type, address and server count. Servers that did not respond only have their status after the address.
+    """
+    entry = {'@type': fields[0], '@address': fields[1]}
+    if fields[0] not in server_types:
+        if fields[2].isdigit():
+            entry['@status'] = 'UP'
+            entry['@servers'] = fields[2]
+        else:
+            entry['@status'] = fields[2]
+    elif len(fields) == 3:
+        entry['@status'] = fields[2]
+    else:
+        fields = fields + [''] * (9 - len(fields))
+        entry['@status'] = 'UP'
+        entry['hostname'] = fields[1]
+        entry['name'] = fields[2] or None
+        entry['map'] = fields[3]
+        entry['maxplayers'] = fields[4]
+        entry['numplayers'] = fields[5]
+        entry['ping'] = fields[6]
+        entry['gametype'] = fields[8]
+        entry['rules'] = None
+        entry['players'] = None
+    return entry
+
+
+def iter_qstat_raw_entries(chunks, server_types, master_types, rules: bool = True, players: bool = False, delimiter: str = QSTAT_RAW_DELIMITER):
+    """
+    Parses QStat -raw output fed in chunks of bytes, yielding the same entries as iter_qstat_entries does for XML output.
+    A line that starts with one of the queried types opens a new entry. With rules, the next line of a server holds its rules as name=value fields; with players, every following line is a player of name, score and ping.
+    """
+    entry_types = set(server_types) | set(master_types)
+    entry = None
+    rules_pending = False
+    for line in iter_lines(chunks):
+        fields = line.split(delimiter)
+        if len(fields) >= 3 and fields[0] in entry_types:
+            if entry is not None:
+                yield entry
+            entry = raw_to_entry(fields, server_types)
+            rules_pending = rules and 'rules' in entry
+        elif entry is None or 'rules' not in entry:
+            continue
+        elif rules_pending:
+            rule_list = []
+            for rule in fields:
+                if rule:
+                    rule_name, separator, rule_text = rule.partition('=')
+                    rule_entry = {'@name': rule_name}
+                    if rule_text:
+                        rule_entry['#text'] = rule_text
+                    rule_list.append(rule_entry)
+            entry['rules'] = {'rule': rule_list} if rule_list else None
+            rules_pending = False
+        elif players and line:
+            player_entry = {'name': fields[0],
+                            'score': fields[1] if len(fields) > 1 else None,
+                            'ping': fields[2] if len(fields) > 2 else None}
+            if entry['players'] is None:
+                entry['players'] = {'player': []}
+            entry['players']['player'].append(player_entry)
+    if entry is not None:
+        yield entry
+
+
+def adapt_qstat_entries(qstat_entries, game, game_name, qstat_master_type, qstat_server_type, server_game_name, server_game_type):
+    """Turns QStat entries into server dicts, leaving out the ones that do not match the configured game name and type."""
+    for qstat_entry in qstat_entries:
         try:
-            if server_table_dict['qstat']['server']['@type'] == qstat_master_type:
-                debug_msg(game_name, i18n._("No valid masters specified. Please check your master server settings."))
-                break
+            response = adapt_qstat_entry(qstat_entry, game, qstat_master_type, qstat_server_type)
 
-        except TypeError:
-            try:
-                response = adapt_qstat_entry(qstat_entry, game, qstat_master_type, qstat_server_type)
+            server_dict = response['server_dict']
+            msg = response['debug_msg']
+            debug_msg(game_name, msg)
 
-                server_dict = response['server_dict']
-                msg = response['debug_msg']
-                debug_msg(game_name, msg)
+            if server_dict is not None and server_matches(server_dict, server_game_name, server_game_type):
+                yield server_dict
 
-                if server_dict is not None:
-                    appendable = True
-                    for filter_rule in ((server_game_name, "game_name"), (server_game_type, "game_type")):
-                        if filter_rule[0] is not None:
-                            if filter_rule[1] not in server_dict.keys():
-                                appendable = False
-                                break
-                            else:
-                                if server_dict[filter_rule[1]] != filter_rule[0]:
-                                    appendable = False
-                                    break
-                    if appendable:
-                        server_table.append(server_dict)
+        except Exception as e:
+            debug_msg(game_name, str(e.args[0]))
 
-            except Exception as e:
-                debug_msg(game_name, str(e.args[0]))
 
-    return server_table
+def adapt_server_list(qstat_string, game, game_name, qstat_master_type, qstat_server_type, server_game_name, server_game_type):
+    qstat_entries = iter_qstat_entries([qstat_string.encode()])
+    return list(adapt_qstat_entries(qstat_entries, game, game_name, qstat_master_type, qstat_server_type, server_game_name, server_game_type))
 
 
 def build_host_list(master_list: list):
@@ -212,57 +377,262 @@ def build_host_list(master_list: list):
     return list(dict.fromkeys(hosts))
 
 
-def stat_master(game: str, game_info: dict, master_list: list):
-    qstat_stdin_object = ""
+def get_game_config(game: str, backend_config_object=None) -> dict:
+    """Returns the qstat types, server filters and output parser of a game."""
+    if backend_config_object is None:
+        backend_config_object = helpers.load_table(BACKEND_CONFIG)
+    game_config = backend_config_object['game'][game]
+    parser = game_config.get('parser', 'xml')
+    if parser not in QSTAT_PARSERS:
+        raise ValueError(i18n._("Invalid QStat parser %(parser)s specified for %(game)s.") % {'parser': parser, 'game': game})
+    return {'master_type': game_config['master_type'],
+            'server_type': game_config['server_type'],
+            'server_game_name': game_config.get('server_gamename'),
+            'server_game_type': game_config.get('server_gametype'),
+            'parser': parser}
 
-    master_server_uri = None
-    stat_start_time = None
-    stat_end_time = None
 
-    game_name = game_info["name"]
-    backend_config_object = helpers.load_table(BACKEND_CONFIG)
+def build_stdin(game_config: dict, master_list: list) -> str:
+    """Lists the master servers of a game in the qstat -f format, one type descriptor and address per line."""
+    qstat_stdin_descriptor = game_config['master_type']
+    if game_config['server_game_type'] is not None:
+        qstat_stdin_descriptor = qstat_stdin_descriptor + ",game=" + game_config['server_game_type']
 
-    qstat_master_type = backend_config_object['game'][game]['master_type']
-    qstat_server_type = backend_config_object['game'][game]['server_type']
+    qstat_stdin_object = ""
+    for entry in build_host_list(master_list):
+        qstat_stdin_object = qstat_stdin_object + qstat_stdin_descriptor + " " + entry + "\n"
+    return qstat_stdin_object
 
-    if "server_gamename" not in backend_config_object['game'][game].keys():
-        backend_config_object['game'][game]['server_gamename'] = None
 
-    server_game_name = backend_config_object['game'][game]['server_gamename']
-    if "server_gamename" in backend_config_object['game'][game].keys():
-        server_game_name = backend_config_object['game'][game]['server_gamename']
+def build_server_stdin(game_config: dict, server_list: list) -> str:
+    """Lists known servers of a game in the qstat -f format, so that they are queried without asking the master servers."""
+    return "".join(game_config['server_type'] + " " + host + "\n" for host in dict.fromkeys(server_list))
 
-    server_game_type = None
-    if "server_gametype" in backend_config_object['game'][game].keys():
-        server_game_type = backend_config_object['game'][game]['server_gametype']
 
-    hosts_array = build_host_list(master_list)
+def plan_batches(game_configs: dict) -> list:
+    """
+    Splits games into groups that a single qstat run can query.
+    Servers are told apart by their type, so games of the same server type only share a run when their game name or type filters differ. Games read with different parsers never share a run.
+    """
+    batches = []
+    for game, game_config in game_configs.items():
+        server_filter = (game_config['server_game_name'], game_config['server_game_type'])
+        for batch in batches:
+            if game_configs[batch[0]]['parser'] != game_config['parser']:
+                continue
+            if all(game_configs[other_game]['server_type'] != game_config['server_type'] or
+                   (server_filter != (None, None) and
+                    (game_configs[other_game]['server_game_name'], game_configs[other_game]['server_game_type']) not in ((None, None), server_filter))
+                   for other_game in batch):
+                batch.append(game)
+                break
+        else:
+            batches.append([game])
+    return batches
 
-    qstat_cmd = ["qstat", "-xml", "-utf8", "-maxsim", "9999", "-sendinterval", "1", "-R", "-P", "-f", "-"]
 
-    qstat_stdin_descriptor = backend_config_object['game'][game]['master_type']
-    if server_game_type is not None:
-        qstat_stdin_descriptor = qstat_stdin_descriptor + ",game=" + server_game_type
+def iter_qstat_run(qstat_stdin_object: str, game_name: str, token, maxsim: int, game_configs: list, players: bool = False):
+    """
+    Runs qstat over a list of master servers and yields its entries as they are parsed.
+    The run takes its -maxsim from the shared budget and gives up at the deadline of the token, or as soon as the token is cancelled.
+    Rules are always requested, as the password and anti-cheat flags come from them; player lists only with players.
+    Output is read with the parser of the games in game_configs, which must all use the same one.
+    """
+    parser = game_configs[0]['parser']
+    maxsim = sim_budget.acquire(maxsim, token)
+    if maxsim == 0:
+        return
 
-    for entry in hosts_array:
-        qstat_stdin_object = qstat_stdin_object + qstat_stdin_descriptor + " " + entry + "\n"
+    try:
+        if parser == 'raw':
+            qstat_args = ["-raw", QSTAT_RAW_DELIMITER]
+        else:
+            qstat_args = ["-xml"]
+        qstat_args += ["-utf8", "-maxsim", str(maxsim), "-sendinterval", "1", "-R", "-f", "-"]
+        if players:
+            qstat_args[-2:-2] = ["-P"]
+
+        # QStat gives up by itself at the deadline and prints what it has got so far; the process is killed if it does not
+        deadline = token.remaining()
+        timeout = None
+        if deadline is not None:
+            qstat_args[-2:-2] = ["-timeout", str(max(1, int(deadline)))]
+            timeout = deadline + QSTAT_KILL_DELAY
+
+        chunks = qstat_process.pool.run(qstat_args, qstat_stdin_object.strip().encode(), token, timeout)
+        try:
+            if parser == 'raw':
+                yield from iter_qstat_raw_entries(chunks,
+                                                  [game_config['server_type'] for game_config in game_configs],
+                                                  [game_config['master_type'] for game_config in game_configs],
+                                                  players=players)
+            else:
+                yield from iter_qstat_entries(chunks)
+        except OSError as e:
+            raise Exception(helpers.debug_msg_str([QSTAT_MSG, game_name, str(e)]))
+        except ElementTree.ParseError as e:
+            # Output of a killed qstat ends abruptly; the entries before that point have been yielded already
+            if not token.stopped:
+                raise Exception(helpers.debug_msg_str([QSTAT_MSG, game_name, str(e)]))
+        finally:
+            chunks.close()
+    finally:
+        sim_budget.release(maxsim)
+
+
+def iter_game_servers(game: str, game_info: dict, game_config: dict, qstat_stdin_object: str, token):
+    """Runs qstat over the stdin list of a single game, yielding its servers in batches while qstat output is parsed."""
+    game_name = game_info["name"]
 
     debug_msg(game_name, i18n._("Requesting server info."))
     stat_start_time = time.time()
-    try:
-        qstat_output_raw, _ = subprocess.Popen(qstat_cmd, stdin=subprocess.PIPE, stdout=subprocess.PIPE).communicate(input=qstat_stdin_object.strip().encode())
-        qstat_output = qstat_output_raw.decode()
-    except Exception as e:
-        raise Exception(helpers.debug_msg_str([QSTAT_MSG, game_name, e.args[0]]))
-    stat_end_time = time.time()
+    server_count = 0
+
+    # Servers are parsed while qstat is still running and handed out in batches
+    server_table = []
+    batch_time = time.time()
+    qstat_entries = iter_qstat_run(qstat_stdin_object, game_name, token, QSTAT_MAXSIM_PER_GAME, [game_config])
+    for server_dict in adapt_qstat_entries(qstat_entries, game, game_name, game_config['master_type'], game_config['server_type'], game_config['server_game_name'], game_config['server_game_type']):
+        server_table.append(server_dict)
+        if time.time() - batch_time >= QSTAT_BATCH_INTERVAL:
+            server_count += len(server_table)
+            yield server_table
+            server_table = []
+            batch_time = time.time()
 
-    stat_total_time = stat_end_time - stat_start_time
-    debug_msg(game_name, i18n._("Received server info. Elapsed time: %(stat_time)s s.") % {'stat_time': round(stat_total_time, 2)})
+    server_count += len(server_table)
+    if server_table:
+        yield server_table
 
-    parse_start_time = time.time()
-    server_table = adapt_server_list(qstat_output, game, game_name, qstat_master_type, qstat_server_type, server_game_name, server_game_type)
-    parse_end_time = time.time()
+    if token.cancelled:
+        debug_msg(game_name, i18n._("Query cancelled."))
 
-    debug_msg(game_name, i18n._("Parsed QStat response. Elapsed time: %(parse_time)s ms") % {'parse_time': round((parse_end_time - parse_start_time) * 1000, 2)})
+    debug_msg(game_name, i18n._("Received %(server_num)i servers. Elapsed time: %(stat_time)s s.") % {'server_num': server_count, 'stat_time': round(time.time() - stat_start_time, 2)})
+
+
+def stat_master_iter(game: str, game_info: dict, master_list: list, token=None):
+    """
+    Stats the master servers, yielding the servers in batches while qstat output is parsed.
+    Servers queried before the deadline are still returned.
+    """
+    if token is None:
+        token = helpers.CancelToken()
 
-    return server_table
+    game_config = get_game_config(game)
+    yield from iter_game_servers(game, game_info, game_config, build_stdin(game_config, master_list), token)
+
+
+def stat_servers_iter(game: str, game_info: dict, server_list: list, token=None):
+    """Queries the specified servers of a game directly, skipping the master servers. Yields the servers that responded in batches."""
+    if token is None:
+        token = helpers.CancelToken()
+
+    game_config = get_game_config(game)
+    yield from iter_game_servers(game, game_info, game_config, build_server_stdin(game_config, server_list), token)
+
+
+def stat_server_details(game: str, game_info: dict, host: str, token=None):
+    """Queries a single server for its rules and player list, which server list queries leave out. Returns None if the server did not respond."""
+    if token is None:
+        token = helpers.CancelToken()
+
+    game_name = game_info["name"]
+    game_config = get_game_config(game)
+    qstat_entries = iter_qstat_run(build_server_stdin(game_config, [host]), game_name, token, 1, [game_config], players=True)
+    server_list = list(adapt_qstat_entries(qstat_entries, game, game_name, game_config['master_type'], game_config['server_type'], None, None))
+    if not server_list:
+        return None
+    return server_list[0]
+
+
+def demux_qstat_entries(qstat_entries, game_configs: dict, game_names: dict):
+    """
+    Sorts the entries of a qstat run over several games back into the games, by their type and then by the server filters of the games.
+    Yields (game, server_dict) for every server.
+    """
+    master_routes = {}
+    server_routes = {}
+    for game, game_config in game_configs.items():
+        master_routes.setdefault(game_config['master_type'], []).append(game)
+        server_routes.setdefault(game_config['server_type'], []).append(game)
+    batch_name = ", ".join(game_names[game] for game in game_configs)
+
+    for qstat_entry in qstat_entries:
+        entry_type = qstat_entry.get('@type')
+        try:
+            if entry_type in master_routes:
+                game = master_routes[entry_type][0]
+                debug_msg(game_names[game], adapt_master_entry(qstat_entry, game)['debug_msg'])
+            elif entry_type in server_routes:
+                candidates = server_routes[entry_type]
+                server_dict = adapt_server_entry(qstat_entry, candidates[0])['server_dict']
+                if server_dict is None:
+                    continue
+                for game in candidates:
+                    game_config = game_configs[game]
+                    if server_matches(server_dict, game_config['server_game_name'], game_config['server_game_type']):
+                        server_dict['game_id'] = game
+                        yield game, server_dict
+                        break
+        except Exception as e:
+            debug_msg(batch_name, str(e.args[0]))
+
+
+def stat_master_batch_iter(games: dict, token=None, server_lists=None):
+    """
+    Stats the master servers of several games with as few qstat runs as possible, normally a single one.
+    games maps game IDs to (game_info, master_list). Yields (game, servers) batches while qstat output is parsed.
+    Games listed in server_lists have the specified servers queried instead of their master servers.
+    """
+    if token is None:
+        token = helpers.CancelToken()
+
+    if server_lists is None:
+        server_lists = {}
+
+    backend_config_object = helpers.load_table(BACKEND_CONFIG)
+    game_configs = {game: get_game_config(game, backend_config_object) for game in games}
+    game_names = {game: game_info["name"] for game, (game_info, master_list) in games.items()}
+
+    for batch in plan_batches(game_configs):
+        if token.stopped:
+            break
+
+        batch_configs = {game: game_configs[game] for game in batch}
+        batch_name = ", ".join(game_names[game] for game in batch)
+        qstat_stdin_object = ""
+        for game in batch:
+            if game in server_lists:
+                qstat_stdin_object += build_server_stdin(game_configs[game], server_lists[game])
+            else:
+                qstat_stdin_object += build_stdin(game_configs[game], games[game][1])
+
+        debug_msg(batch_name, i18n._("Requesting server info."))
+        stat_start_time = time.time()
+        server_counts = {game: 0 for game in batch}
+        server_tables = {}
+        batch_time = time.time()
+        qstat_entries = iter_qstat_run(qstat_stdin_object, batch_name, token, QSTAT_MAXSIM_PER_GAME * len(batch), list(batch_configs.values()))
+        for game, server_dict in demux_qstat_entries(qstat_entries, batch_configs, game_names):
+            server_tables.setdefault(game, []).append(server_dict)
+            if time.time() - batch_time >= QSTAT_BATCH_INTERVAL:
+                for game, server_table in server_tables.items():
+                    server_counts[game] += len(server_table)
+                    yield game, server_table
+                server_tables = {}
+                batch_time = time.time()
+
+        for game, server_table in server_tables.items():
+            server_counts[game] += len(server_table)
+            yield game, server_table
+
+        for game in batch:
+            debug_msg(game_names[game], i18n._("Received %(server_num)i servers. Elapsed time: %(stat_time)s s.") % {'server_num': server_counts[game], 'stat_time': round(time.time() - stat_start_time, 2)})
+
+    if token.cancelled:
+        debug_msg(", ".join(game_names.values()), i18n._("Query cancelled."))
+
+
+def stat_master(game: str, game_info: dict, master_list: list, token=None):
+    """Stats the master server"""
+    return helpers.flatten_list(list(stat_master_iter(game, game_info, master_list, token)))
@@ -0,0 +1,261 @@
+#!/usr/bin/env python3
+# This source file is part of Obozrenie
+# Copyright 2015 Artem Vorotnikov
+
+# For more information, see https://github.com/obozrenie/obozrenie
+
+# Obozrenie is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License version 3, as
+# published by the Free Software Foundation.
+
+# Obozrenie is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+
+# You should have received a copy of the GNU General Public License
+# along with Obozrenie.  If not, see <http://www.gnu.org/licenses/>.
+
+"""
+Native Quake III family query adapter.
+
+Covers the games whose masters speak the dpmaster protocol: the server listing is requested with getservers, or getserversExt for games that identify themselves by name, and every server is asked for getstatus.
+Everything runs over a single asyncio UDP socket; the response time of getstatus is the ping.
+
+Per-game protocol parameters are read from qstat.toml, next to the qstat types of the game:
+    master_protocol - protocol version sent to the master
+    master_gamename - game name for getserversExt; getservers is used without it
+    master_options  - filter keywords, "empty full" by default
+"""
+
+import functools
+import os
+import re
+import socket
+import struct
+
+from obozrenie.global_settings import *
+from obozrenie.global_strings import *
+
+import obozrenie.i18n as i18n
+import obozrenie.helpers as helpers
+import obozrenie.records as records
+import obozrenie.proxies.asyncio_udp as asyncio_udp
+
+from . import qstat
+from . import udp
+
+BACKEND_CONFIG = os.path.join(SETTINGS_INTERNAL_BACKENDS_DIR, "qstat.toml")
+QUAKE3_MSG = BACKENDCAT_MSG + i18n._("Quake III:")
+
+QUAKE3_TIMEOUT = 1.0  # Seconds to wait for a single response
+QUAKE3_RETRIES = 2  # Extra attempts for servers that did not respond
+QUAKE3_MAX_IN_FLIGHT = 64  # Queries waiting for a response at the same time
+QUAKE3_BATCH_INTERVAL = 0.5  # Seconds between batches of queried servers
+QUAKE3_MASTER_TIMEOUT = 3.0  # Seconds of silence after which the master listing is considered complete
+
+PACKET_HEADER = b'\xff\xff\xff\xff'
+GETSTATUS_REQUEST = PACKET_HEADER + b'getstatus\n'
+STATUS_RESPONSE = PACKET_HEADER + b'statusResponse'
+MASTER_RESPONSES = (PACKET_HEADER + b'getserversResponse', PACKET_HEADER + b'getserversExtResponse')
+MASTER_EOT = b'EOT\x00\x00\x00'
+DEFAULT_MASTER_OPTIONS = "empty full"
+
+# Plain ^N codes as well as ^xRGB ones of the DarkPlaces engine
+COLOR_CODE_PATTERN = re.compile(r'\^(?:x[0-9a-fA-F]{3}|.)')
+PLAYER_PATTERN = re.compile(r'^(-?\d+) (-?\d+)(?: -?\d+)* "(.*)"')
+
+
+def debug_msg(game_name, msg=None):
+    if msg is not None:
+        helpers.debug_msg([QUAKE3_MSG, game_name, msg])
+
+
+def strip_colors(text: str) -> str:
+    return COLOR_CODE_PATTERN.sub('', text)
+
+
+def build_master_request(protocol, gamename=None, options: str = DEFAULT_MASTER_OPTIONS) -> bytes:
+    if gamename is None:
+        request = "getservers %s %s" % (protocol, options)
+    else:
+        request = "getserversExt %s %s %s" % (gamename, protocol, options)
+    return PACKET_HEADER + request.strip().encode()
+
+
+def parse_master_response(data: bytes) -> tuple:
+    """
+    Parses a datagram of the master server listing. Returns the IPv4 addresses as "ip:port" strings and whether the listing is over.
+    IPv6 entries of getserversExt responses are skipped, the query socket is IPv4 only.
+    """
+    for response_type in MASTER_RESPONSES:
+        if data.startswith(response_type):
+            offset = len(response_type)
+            break
+    else:
+        raise ValueError(i18n._("Invalid master server response."))
+
+    addresses = []
+    while offset < len(data):
+        separator = data[offset:offset + 1]
+        offset += 1
+        if data.startswith(MASTER_EOT, offset):
+            return addresses, True
+        if separator == b'\\' and offset + 6 <= len(data):
+            ip = socket.inet_ntoa(data[offset:offset + 4])
+            port, = struct.unpack_from('>H', data, offset + 4)
+            if port != 0:
+                addresses.append("%s:%i" % (ip, port))
+            offset += 6
+        elif separator == b'/' and offset + 18 <= len(data):
+            offset += 18
+        else:
+            break
+    return addresses, False
+
+
+def parse_status(data: bytes) -> tuple:
+    """
+    Parses a statusResponse into the rules and the player list in one pass.
+    Color codes are stripped from player names; rules are left as they are, like qstat does.
+    """
+    if not data.startswith(STATUS_RESPONSE):
+        raise ValueError(i18n._("Invalid status response."))
+
+    lines = data[len(STATUS_RESPONSE):].decode('utf-8', 'replace').strip('\n').split('\n')
+    info_fields = lines[0].split('\\')[1:] if lines else []
+    rules = dict(zip(info_fields[0::2], info_fields[1::2]))
+
+    players = []
+    for line in lines[1:]:
+        match = PLAYER_PATTERN.match(line)
+        if match is not None:
+            players.append({'name': strip_colors(match.group(3)),
+                            'score': int(match.group(1)),
+                            'ping': int(match.group(2))})
+
+    return rules, players
+
+
+def adapt_server_entry(host: str, rules: dict, players: list, rtt: float, game: str):
+    """Builds the same server entry the qstat adapter does for the Quake III family server types."""
+    server_dict = records.ServerRecord()
+    server_dict['host'] = host
+    server_dict['password'] = False
+    server_dict['secure'] = False
+    server_dict['game_id'] = game
+    server_dict['game_mod'] = ""
+    server_dict['name'] = strip_colors(rules.get('sv_hostname', rules.get('hostname', "")))
+    server_dict['game_type'] = strip_colors(rules.get('gamename', ""))
+    server_dict['terrain'] = rules.get('mapname', "")
+    server_dict['player_count'] = len(players)
+    try:
+        server_dict['player_limit'] = int(rules['sv_maxclients'])
+    except (KeyError, ValueError):
+        server_dict['player_limit'] = 0
+    server_dict['ping'] = round(rtt * 1000)
+    server_dict['rules'] = rules
+    server_dict['players'] = players
+
+    qstat.apply_rules(server_dict, rules)
+
+    return server_dict
+
+
+class Quake3Client(asyncio_udp.UDPClient):
+    """Queries dpmaster compatible master servers and Quake III family servers over a single UDP socket."""
+
+    def __init__(self, timeout: float = QUAKE3_TIMEOUT, retries: int = QUAKE3_RETRIES, max_in_flight: int = QUAKE3_MAX_IN_FLIGHT, token=None):
+        super().__init__(timeout, retries, max_in_flight, token)
+
+    async def query_status(self, address: tuple):
+        """Returns the rules, the players and the round trip time of a server, or None if it did not answer."""
+        for attempt in range(self.retries + 1):
+            if self.token.stopped:
+                return None
+
+            response = await self.request(address, GETSTATUS_REQUEST, self.timeout)
+            if response is None:
+                continue
+            data, rtt = response
+            try:
+                rules, players = parse_status(data)
+            except ValueError:
+                return None
+            return rules, players, rtt
+        return None
+
+    async def query_many(self, addresses):
+        """
+        Queries the servers at the specified "ip:port" addresses, which may be an iterable or an async iterable.
+        Yields (address, rules, players, rtt) as responses arrive; servers that never answered are left out.
+        """
+        async for address, (rules, players, rtt) in super().query_many(addresses, self.query_status):
+            yield address, rules, players, rtt
+
+    async def iter_master_pages(self, master: str, request: bytes):
+        """
+        Yields the server listing of a master server datagram by datagram, as "ip:port" strings.
+        The listing ends with an EOT marker; masters that do not send it are read until they fall silent.
+        """
+        master_address = await self.resolve(master)
+        for attempt in range(self.retries + 1):
+            received = False
+            async for data in self.exchange(master_address, request, QUAKE3_MASTER_TIMEOUT):
+                received = True
+                addresses, last_page = parse_master_response(data)
+                if addresses:
+                    yield addresses
+                if last_page or self.token.stopped:
+                    return
+            if received or self.token.stopped:
+                return
+        raise ConnectionError(i18n._("Master server %(master)s did not respond.") % {'master': master})
+
+
+def get_master_request(game: str) -> bytes:
+    """Builds the master server request of a game from its settings in qstat.toml."""
+    game_config = helpers.load_table(BACKEND_CONFIG)['game'][game]
+    return build_master_request(game_config['master_protocol'],
+                                game_config.get('master_gamename'),
+                                game_config.get('master_options', DEFAULT_MASTER_OPTIONS))
+
+
+def iter_servers(game: str, game_info: dict, get_addresses, token):
+    """Queries the servers whose addresses get_addresses(client) gives, yielding them in batches as they respond. See udp.iter_servers."""
+    return udp.iter_servers(Quake3Client, get_addresses,
+                            lambda address, rules, players, rtt: adapt_server_entry(address, rules, players, rtt, game),
+                            token, QUAKE3_BATCH_INTERVAL, functools.partial(debug_msg, game_info["name"]))
+
+
+def stat_master_iter(game: str, game_info: dict, master_list: list, token=None):
+    """
+    Stats the master servers, yielding the queried servers in batches as they respond.
+    Servers are queried as soon as their part of the master listing arrives.
+    """
+    request = get_master_request(game)
+    masters = [master.split('://', 1)[-1] for master in master_list]
+
+    def get_addresses(client):
+        return udp.iter_master_addresses(masters, lambda master: client.iter_master_pages(master, request),
+                                         functools.partial(debug_msg, game_info["name"]))
+
+    yield from iter_servers(game, game_info, get_addresses, token)
+
+
+def stat_servers_iter(game: str, game_info: dict, server_list: list, token=None):
+    """Queries the specified servers directly, skipping the master servers. Yields the servers that responded in batches."""
+    yield from iter_servers(game, game_info, lambda client: server_list, token)
+
+
+def stat_server_details(game: str, game_info: dict, host: str, token=None):
+    """Queries a single server anew for the server info dialog. Returns None if the server did not respond."""
+    server_list = helpers.flatten_list(list(stat_servers_iter(game, game_info, [host], token)))
+    if not server_list:
+        return None
+    return server_list[0]
+
+
+def stat_master(game: str, game_info: dict, master_list: list, token=None):
+    """Stats the master server"""
+    return helpers.flatten_list(list(stat_master_iter(game, game_info, master_list, token)))
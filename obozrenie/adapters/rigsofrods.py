@@ -22,28 +22,30 @@ import requests
 
 from obozrenie.global_strings import *
 
+import obozrenie.helpers as helpers
 import obozrenie.i18n as i18n
 import obozrenie.ping as ping
+import obozrenie.records as records
 
 RIGSOFRODS_MSG = BACKENDCAT_MSG + i18n._("Rigs of Rods:")
 
 HTTP_TIMEOUT = 10
 
 
-def parse_server_entry(entry: dict) -> dict:
-    """Map one Rigs of Rods JSON server object to a server dict."""
-    return {'player_count': int(entry['current-users']),
-            'player_limit': int(entry['max-clients']),
-            'password': bool(entry['has-password']),
-            'name': str(entry['name']),
-            'host': '%s:%s' % (entry['ip'], entry['port']),
-            'terrain': str(entry['terrain-name']),
-            'players': [{'name': str(player['username'])}
-                        for player in (entry.get('json-userlist') or [])]}
+def parse_server_entry(entry: dict) -> records.ServerRecord:
+    """Map one Rigs of Rods JSON server object to a server record."""
+    return records.ServerRecord(player_count=int(entry['current-users']),
+                                player_limit=int(entry['max-clients']),
+                                password=bool(entry['has-password']),
+                                name=str(entry['name']),
+                                host='%s:%s' % (entry['ip'], entry['port']),
+                                terrain=str(entry['terrain-name']),
+                                players=[{'name': str(player['username'])}
+                                         for player in (entry.get('json-userlist') or [])])
 
 
 def adapt_server_list(game: str, json_string: str) -> list:
-    """Parse a Rigs of Rods JSON server-list response into a list of server dicts."""
+    """Parse a Rigs of Rods JSON server-list response into a list of server records."""
     server_list = []
 
     for json_entry in json.loads(json_string):
@@ -60,13 +62,16 @@ def adapt_server_list(game: str, json_string: str) -> list:
     return server_list
 
 
-def stat_master(game: str, game_info: dict, master_list: list) -> list:
-    """Stats the master server"""
-    server_table = []
-
+def stat_master_iter(game: str, game_info: dict, master_list: list, token=None):
+    """Stats the master servers, yielding the servers of every master as soon as they are pinged"""
+    if token is None:
+        token = helpers.CancelToken()
     for master_uri in master_list:
+        if token.stopped:
+            return
+
         try:
-            response = requests.get(master_uri, timeout=HTTP_TIMEOUT)
+            response = requests.get(master_uri, timeout=token.remaining(HTTP_TIMEOUT))
             response.raise_for_status()
         except requests.RequestException:
             print(i18n._(RIGSOFRODS_MSG), i18n._("Accessing URI %(uri)s failed with error code %(code)s.") % {
@@ -74,12 +79,18 @@ def stat_master(game: str, game_info: dict, master_list: list) -> list:
             continue
 
         try:
-            server_table += adapt_server_list(game, response.text)
+            server_table = adapt_server_list(game, response.text)
         except ValueError:
             print(i18n._(RIGSOFRODS_MSG), i18n._(
                 "Error parsing URI %(uri)s.") % {'uri': master_uri})
             continue
 
-    ping.add_rtt_info(server_table)
+        # Servers whose host does not answer pings are measured by connecting to them
+        ping.add_rtt_info(server_table, token, ping.tcp_connect_probe)
 
-    return server_table
+        yield server_table
+
+
+def stat_master(game: str, game_info: dict, master_list: list, token=None) -> list:
+    """Stats the master server"""
+    return helpers.flatten_list(list(stat_master_iter(game, game_info, master_list, token)))
@@ -0,0 +1,93 @@
+#!/usr/bin/env python3
+# This source file is part of Obozrenie
+# Copyright 2015 Artem Vorotnikov
+
+# For more information, see https://github.com/obozrenie/obozrenie
+
+# Obozrenie is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License version 3, as
+# published by the Free Software Foundation.
+
+# Obozrenie is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+
+# You should have received a copy of the GNU General Public License
+# along with Obozrenie.  If not, see <http://www.gnu.org/licenses/>.
+
+"""
+Server list fan-out shared by the native query adapters.
+
+Addresses, e.g. from a master server listing, are queried as they arrive over the asyncio_udp proxy, and the results are handed out in batches.
+"""
+
+import time
+
+import obozrenie.i18n as i18n
+import obozrenie.helpers as helpers
+import obozrenie.proxies.asyncio_udp as asyncio_udp
+
+
+def iter_batches(iterable, interval: float):
+    """Groups the items of an iterable into lists, handing out a list every interval seconds and the rest at the end."""
+    batch = []
+    batch_time = time.time()
+    for item in iterable:
+        batch.append(item)
+        if time.time() - batch_time >= interval:
+            yield batch
+            batch = []
+            batch_time = time.time()
+    if batch:
+        yield batch
+
+
+async def iter_master_addresses(masters, get_pages, log):
+    """
+    Yields the "ip:port" addresses listed by each of the master servers, page by page as get_pages(master) gives them.
+    Master servers that fail are logged and skipped.
+    """
+    for master in masters:
+        try:
+            async for page in get_pages(master):
+                for address in page:
+                    yield address
+        except (OSError, ValueError) as e:
+            log(str(e))
+
+
+def iter_servers(client_class, get_addresses, adapt, token, batch_interval: float, log):
+    """
+    Queries the servers whose addresses get_addresses(client) gives, yielding them in batches as they respond.
+    The addresses may come from an async iterable, e.g. the master server listing, and are queried as they arrive.
+    Each result of the client's query_many is turned into a server entry by adapt; results adapt raises ValueError for are logged and left out.
+    """
+    if token is None:
+        token = helpers.CancelToken()
+
+    async def query():
+        client = client_class(token=token)
+        await client.open()
+        try:
+            async for result in client.query_many(get_addresses(client)):
+                yield result
+        finally:
+            client.close()
+
+    stat_start_time = time.time()
+    server_count = 0
+    for batch in iter_batches(asyncio_udp.iter_async(query()), batch_interval):
+        if server_count == 0:
+            log(i18n._("First servers received. Elapsed time: %(stat_time)s s.") % {'stat_time': round(time.time() - stat_start_time, 2)})
+        server_table = []
+        for result in batch:
+            try:
+                server_table.append(adapt(*result))
+            except ValueError as e:
+                log(str(e))
+        server_count += len(server_table)
+        if server_table:
+            yield server_table
+
+    log(i18n._("Received %(server_num)i servers. Elapsed time: %(stat_time)s s.") % {'server_num': server_count, 'stat_time': round(time.time() - stat_start_time, 2)})
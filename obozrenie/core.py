@@ -18,15 +18,168 @@
 
 """Core functions for Obozrenie Game Server Browser."""
 
+import collections.abc
 import os
 import socket
 import threading
+import time
+import types
 
 from obozrenie.global_settings import *
 from obozrenie.global_strings import *
 from obozrenie.option_lists import *
 
-from obozrenie import i18n, helpers, adapters, launch, geoip
+from obozrenie import i18n, helpers, adapters, launch, geoip, ping, records, scheduler, server_cache
+
+
+class ServerSnapshot:
+    """
+    Immutable, versioned view of the server list of a single game.
+
+    Snapshots are published by Game Table writers and are never modified afterwards, so readers may hold on to them without copying.
+    The version is the generation of the list: it only grows when the list actually changes, and diff holds the changes against the previous generation.
+    Every snapshot carries a host index for constant time lookups. Should a host be listed more than once, the index points at its first entry.
+    A stale snapshot holds servers that were not queried in this session, e.g. ones loaded from the server list cache.
+
+    Snapshots made by replace only record the replaced entries on top of a base snapshot. Their server tuple and index are built on first access.
+    """
+
+    __slots__ = ('version', 'diff', 'stale', '_servers', '_index', '_base', '_patch', '_length')
+
+    def __init__(self, version: int = 0, servers=(), index=None, diff=None, stale: bool = False):
+        self.version = version
+        self.stale = stale
+        self._servers = tuple(servers)
+        if index is None:
+            index = {}
+            for i, entry in enumerate(self._servers):
+                index.setdefault(entry['host'], i)
+        self._index = index
+        self.diff = diff
+        self._base = None
+        self._patch = None
+        self._length = len(self._servers)
+
+    @classmethod
+    def _patched(cls, base, patch: dict, length: int, version: int, diff, stale: bool):
+        """Makes a snapshot of base with the entries of patch, by host, updated or appended in order."""
+        snapshot = cls.__new__(cls)
+        snapshot.version = version
+        snapshot.stale = stale
+        snapshot.diff = diff
+        snapshot._servers = None
+        snapshot._index = None
+        snapshot._base = base
+        snapshot._patch = patch
+        snapshot._length = length
+        return snapshot
+
+    def __build(self) -> None:
+        base = self._base
+        servers = list(base.servers)
+        index = base.index
+        for host, entry in self._patch.items():
+            position = base.index.get(host)
+            if position is None:
+                if index is base.index:
+                    index = dict(base.index)
+                index[host] = len(servers)
+                servers.append(entry)
+            else:
+                servers[position] = entry
+        # The index goes first: readers that see the servers rely on it
+        self._index = index
+        self._servers = tuple(servers)
+
+    @property
+    def servers(self) -> tuple:
+        if self._servers is None:
+            self.__build()
+        return self._servers
+
+    @property
+    def index(self) -> dict:
+        if self._index is None:
+            self.__build()
+        return self._index
+
+    def __repr__(self):
+        return "<Server Snapshot - version: %(version)i, servers: %(server_num)i>" % {'version': self.version, 'server_num': len(self)}
+
+    def __len__(self):
+        return self._length
+
+    def __iter__(self):
+        return iter(self.servers)
+
+    def __contains__(self, host):
+        if self._patch is not None:
+            return host in self._patch or host in self._base.index
+        return host in self._index
+
+    def get(self, host: str):
+        """Returns the entry for the specified host or None if it is not listed."""
+        if self._patch is not None:
+            entry = self._patch.get(host)
+            return entry if entry is not None else self._base.get(host)
+        try:
+            return self._servers[self._index[host]]
+        except KeyError:
+            return None
+
+    def replace(self, host: str, entry):
+        """
+        Returns a new snapshot with a single entry updated or appended. No server list is copied.
+        The replaced entries pile up on top of the base snapshot until there are more than the square root of its size, then they are folded into a new base.
+        """
+        if self._patch is None:
+            base, patch = self, {}
+        elif len(self._patch) ** 2 > len(self._base):
+            base, patch = ServerSnapshot(self.version, self.servers, self.index, stale=self.stale), {}
+        else:
+            base, patch = self._base, dict(self._patch)
+
+        if host in self:
+            length = len(self)
+            diff = records.ServerListDiff(changed=[entry])
+        else:
+            length = len(self) + 1
+            diff = records.ServerListDiff(added=[entry])
+        patch[host] = entry
+        return ServerSnapshot._patched(base, patch, length, self.version + 1, diff, self.stale)
+
+    def update(self, servers, stale: bool = False):
+        """Returns a snapshot holding the specified servers, or this very snapshot if nothing has changed."""
+        diff = records.diff_server_lists(self.servers, servers)
+        if not diff and stale == self.stale:
+            return self
+        return ServerSnapshot(self.version + 1, servers, diff=diff, stale=stale)
+
+    def merge(self, entries):
+        """
+        Returns a snapshot with the specified entries updated or appended, or this very snapshot if nothing has changed.
+        Entries missing from the batch are kept, so partial results never remove servers.
+        """
+        servers = list(self.servers)
+        index = None
+        added = []
+        changed = []
+        for entry in entries:
+            host = entry['host']
+            position = (index or self.index).get(host)
+            if position is None:
+                if index is None:
+                    index = dict(self.index)
+                index[host] = len(servers)
+                servers.append(entry)
+                added.append(entry)
+            elif servers[position] != entry:
+                servers[position] = entry
+                changed.append(entry)
+        if not (added or changed):
+            return self
+        diff = records.ServerListDiff(added=added, changed=changed)
+        return ServerSnapshot(self.version + 1, servers, index or self.index, diff, self.stale)
 
 
 class GameTable:
@@ -79,7 +232,9 @@ class GameTable:
 
     Instead this class holds the Game Table and provides read and write accessor methods.
 
-    Please bear in mind that all read accessor methods return deep copies, therefore cleaning up the result is programmer's responsibility.
+    Game info, game settings and server lists are copy-on-write: writers build a new object and swap it in atomically, while read accessors hand out the currently published object without copying it.
+    Every game has a lock of its own, taken by writers only. Readers never wait, and writers of different games never wait for each other. The set of games is fixed once the table is created.
+    Info and settings are returned as read-only mappings, server lists as immutable versioned snapshots of ServerRecord entries. Records must be treated as read-only by the caller, make a copy before altering one.
     """
 
     def __init__(self, gameconfig_object):
@@ -110,93 +265,82 @@ class GameTable:
 
                 # Create dict groups
                 with game_table_temp[game_id] as game_table_entry_temp:
-                    game_table_entry_temp["info"] = helpers.ThreadSafeDict()
-                    game_table_entry_temp["settings"] = helpers.ThreadSafeDict(
-                    )
-                    game_table_entry_temp["servers"] = helpers.ThreadSafeList()
+                    game_info = {}
+                    game_settings = {}
 
                     try:
-                        with game_table_entry_temp["settings"] as game_table_entry_settings_temp:
-                            # Create setting groups
-                            for j in range(len(gameconfig_object[game_id]["settings"])):
-                                option_name = gameconfig_object[game_id]["settings"][j]
-                                game_table_entry_settings_temp[option_name] = ""
+                        # Create setting groups
+                        for j in range(len(gameconfig_object[game_id]["settings"])):
+                            option_name = gameconfig_object[game_id]["settings"][j]
+                            game_settings[option_name] = ""
                     except KeyError:
                         pass
 
-                    with game_table_entry_temp["info"] as game_table_entry_info_temp:
-                        game_table_entry_info_temp["name"] = name
-                        game_table_entry_info_temp['adapter'] = adapter
-                        game_table_entry_info_temp["launch_pattern"] = launch_pattern
-                        try:
-                            game_table_entry_info_temp["steam_app_id"] = steam_app_id
-                        except NameError:
-                            pass
+                    game_info["name"] = name
+                    game_info['adapter'] = adapter
+                    game_info["launch_pattern"] = launch_pattern
+                    try:
+                        game_info["steam_app_id"] = steam_app_id
+                    except NameError:
+                        pass
+
+                    game_table_entry_temp["info"] = types.MappingProxyType(game_info)
+                    game_table_entry_temp["settings"] = types.MappingProxyType(game_settings)
+                    game_table_entry_temp["servers"] = ServerSnapshot()
                     game_table_entry_temp["query-status"] = self.QUERY_STATUS.EMPTY
 
         return game_table
 
+    def _get_game_entry(self, game: str) -> helpers.ThreadSafeDict:
+        """
+        Returns the internal entry of the specified game.
+        """
+        if game in ('', None):
+            raise ValueError(i18n._('Invalid game specified.'))
+
+        try:
+            return self.__game_table[game]
+        except KeyError:
+            raise ValueError(
+                i18n._('Game not found: %(game)s') % {'game': game})
+
     @property
     def copy(self):
         """
-        Returns a deep copy of the Game Table.
-        It is the slowest accessor method. Please try to query for specific information.
+        Returns a shallow view of the whole Game Table.
+        Nested info, settings and server lists are the published read-only objects, so no data is copied.
         """
-        with self.__game_table as game_table:
-            game_table_copy = helpers.deepcopy(game_table)
+        game_table_copy = {}
+        for game, game_entry in self.__game_table.items():
+            game_table_copy[game] = {"info": game_entry["info"],
+                                     "settings": game_entry["settings"],
+                                     "servers": game_entry["servers"].servers,
+                                     "query-status": game_entry["query-status"]}
         return game_table_copy
 
     def get_game_table_copy(self):
         """
-        Returns a deep copy of the Game Table.
-        It is the slowest accessor method. Please try to query for specific information.
+        Returns a shallow view of the whole Game Table. See the copy property.
         """
-        with self.__game_table as game_table:
-            game_table_copy = helpers.deepcopy(game_table)
-        return game_table_copy
+        return self.copy
 
     def get_game_set(self):
         """
         Returns the set of games held by Game Table.
         """
-        with self.__game_table as game_table:
-            game_set = set(game_table.keys())
-        return game_set
+        return set(self.__game_table.keys())
 
     def get_game_info(self, game):
         """
-        Returns information about the specified game.
+        Returns information about the specified game as a read-only mapping.
         """
-        if game in ('', None):
-            raise ValueError(i18n._('Invalid game specified.'))
-
-        with self.__game_table as game_table:
-            try:
-                game_entry = game_table[game]
-            except KeyError:
-                raise ValueError(
-                    i18n._('Game not found: %(game)s') % {'game': game})
-
-            game_info = helpers.deepcopy(game_entry["info"])
-        return game_info
+        return self._get_game_entry(game)["info"]
 
     def get_game_settings(self, game):
         """
-        Returns settings for the specified game.
+        Returns settings for the specified game as a read-only mapping.
         """
-        if game in ('', None):
-            raise ValueError(i18n._('Invalid game specified.'))
-
-        with self.__game_table as game_table:
-            try:
-                game_entry = game_table[game]
-            except KeyError:
-                raise ValueError(
-                    i18n._('Game not found: %(game)s') % {'game': game})
-
-            game_settings = helpers.deepcopy(game_entry["settings"])
-
-        return game_settings
+        return self._get_game_entry(game)["settings"]
 
     def set_game_setting(self, game, option, value):
         faulty_param = None
@@ -206,45 +350,24 @@ class GameTable:
             faulty_param = i18n._('option')
         if faulty_param is not None:
             raise ValueError(
-                i18n._('Invalid %(param)s specified.') % {'param': param})
-
-        with self.__game_table as game_table:
-            try:
-                game_entry = game_table[game]
-            except KeyError:
-                raise ValueError(
-                    i18n._('Game not found: %(game)s') % {'game': game})
+                i18n._('Invalid %(param)s specified.') % {'param': faulty_param})
 
-            game_entry["settings"][option] = value
+        with self._get_game_entry(game) as game_entry:
+            game_settings = dict(game_entry["settings"])
+            game_settings[option] = value
+            game_entry["settings"] = types.MappingProxyType(game_settings)
 
     def get_query_status(self, game: str):
-        if game in ('', None):
-            raise ValueError(i18n._('Invalid game specified.'))
-
-        with self.__game_table as game_table:
-            try:
-                game_entry = game_table[game]
-            except KeyError:
-                raise ValueError(
-                    i18n._('Game not found: %(game)s') % {'game': game})
-
-            query_status = helpers.deepcopy(game_entry["query-status"])
-        return query_status
+        return self._get_game_entry(game)["query-status"]
 
     def set_query_status(self, game, status):
-        if game in ('', None):
-            raise ValueError(i18n._('Invalid game specified.'))
-
-        with self.__game_table as game_table:
-            try:
-                game_entry = game_table[game]
-            except KeyError:
-                raise ValueError(
-                    i18n._('Game not found: %(game)s') % {'game': game})
-
+        with self._get_game_entry(game) as game_entry:
             game_entry["query-status"] = status
 
-    def get_server_info(self, game: str, host: str) -> dict:
+    def get_server_info(self, game: str, host: str):
+        """
+        Returns the entry of the specified server or None if the game has no such server. Lookup is done via the host index.
+        """
         faulty_param = None
         if game in ('', None):
             faulty_param = i18n._('game id')
@@ -252,64 +375,116 @@ class GameTable:
             faulty_param = i18n._('hostname')
         if faulty_param is not None:
             raise ValueError(
-                i18n._('Invalid %(param)s specified.') % {'param': param})
-
-        with self.__game_table as game_table:
-            try:
-                game_entry = game_table[game]
-            except KeyError:
-                raise ValueError(
-                    i18n._('Game not found: %(game)s') % {'game': game})
+                i18n._('Invalid %(param)s specified.') % {'param': faulty_param})
 
-            server_table = helpers.deepcopy(game_entry["servers"])
-        server_entry = server_table[helpers.search_dict_table(
-            server_table, "host", host)]
-        return server_entry
+        return self.get_servers_snapshot(game).get(host)
 
     def set_server_info(self, game: str, host: str, data) -> None:
+        """
+        Updates the entry of the specified server, or appends it if the game has no such server yet. Other entries are left untouched.
+        """
         faulty_param = None
         if game in ('', None):
             faulty_param = i18n._('game id')
         elif host in ('', None):
             faulty_param = i18n._('hostname')
-        elif isinstance(data, dict) is False:
+        elif isinstance(data, collections.abc.Mapping) is False:
             faulty_param = i18n._('server data')
         if faulty_param is not None:
             raise ValueError(
-                i18n._('Invalid %(param)s specified.') % {'param': param})
+                i18n._('Invalid %(param)s specified.') % {'param': faulty_param})
 
-        with self.__game_table as game_table:
-            server_entry_index = game_table[helpers.search_dict_table(
-                helpers.deepcopy(game_table), "host", host)]
-            if server_entry_index is None:
-                self.append_server_info(game, data)
-            else:
-                game_table[server_entry_index] = data
+        entry = records.ServerRecord.from_entry(data)
+        entry['host'] = host
+        with self._get_game_entry(game) as game_entry:
+            game_entry["servers"] = game_entry["servers"].replace(host, entry)
 
-    def get_servers_data(self, game: str) -> dict:
+    def get_servers_snapshot(self, game: str) -> ServerSnapshot:
+        """
+        Returns the currently published server list snapshot. No data is copied.
+        """
         if game in ('', None):
             raise ValueError(i18n._('Please specify a valid game id.'))
 
-        with self.__game_table as game_table:
-            servers_data = helpers.deepcopy(game_table[game]["servers"])
-        return servers_data
+        return self._get_game_entry(game)["servers"]
+
+    def get_servers_data(self, game: str) -> tuple:
+        return self.get_servers_snapshot(game).servers
+
+    def get_servers_generation(self, game: str) -> int:
+        """
+        Returns the generation of the server list. It only grows when the list actually changes.
+        """
+        return self.get_servers_snapshot(game).version
+
+    def get_servers_diff(self, game: str, version: int):
+        """
+        Returns the current snapshot and the changes since the specified generation.
+        The diff is empty if the caller is up to date and None if the changes are not known, in which case the whole list has to be reloaded.
+        """
+        snapshot = self.get_servers_snapshot(game)
+        if version == snapshot.version:
+            diff = records.ServerListDiff()
+        elif version == snapshot.version - 1:
+            diff = snapshot.diff
+        else:
+            diff = None
+        return snapshot, diff
+
+    def set_servers_data(self, game: str, servers_data, stale: bool = False) -> records.ServerListDiff:
+        """
+        Replaces the server list. Returns the changes against the previous list; nothing is published when there are none.
+        Servers that were not queried in this session, e.g. cached ones, are to be marked stale.
+        Server records are published as they are and must not be altered afterwards, plain dicts are copied into records.
+        """
+        if game in ('', None):
+            raise ValueError(i18n._('Please specify a valid game id.'))
 
-    def set_servers_data(self, game: str, servers_data) -> None:
+        # Build the new snapshot and diff before taking the lock, so the lock is only held for the swap.
+        # Should another writer get in first, the diff is redone against its snapshot.
+        server_table = [records.ServerRecord.adopt(entry) for entry in servers_data]
+        while True:
+            old_snapshot = self.get_servers_snapshot(game)
+            snapshot = old_snapshot.update(server_table, stale)
+            with self._get_game_entry(game) as game_entry:
+                if game_entry["servers"] is old_snapshot:
+                    game_entry["servers"] = snapshot
+                    break
+
+        if snapshot is old_snapshot:
+            return records.ServerListDiff()
+        return snapshot.diff
+
+    def merge_servers_data(self, game: str, servers_data) -> records.ServerListDiff:
+        """
+        Merges a partial server list into the current one: listed servers are updated or appended, the others are left untouched.
+        Used to publish results while a query is still running. Returns the changes, nothing is published when there are none.
+        Server records are published as they are, see set_servers_data.
+        """
         if game in ('', None):
             raise ValueError(i18n._('Please specify a valid game id.'))
 
-        with self.__game_table as game_table:
-            self.clear_servers_data(game)
-            for entry in servers_data:
-                game_table[game]["servers"].append(entry)
+        server_table = [records.ServerRecord.adopt(entry) for entry in servers_data]
+        while True:
+            old_snapshot = self.get_servers_snapshot(game)
+            snapshot = old_snapshot.merge(server_table)
+            with self._get_game_entry(game) as game_entry:
+                if game_entry["servers"] is old_snapshot:
+                    game_entry["servers"] = snapshot
+                    break
+
+        if snapshot is old_snapshot:
+            return records.ServerListDiff()
+        return snapshot.diff
 
     def clear_servers_data(self, game: str) -> None:
-        if game in ('', None):
-            raise ValueError(i18n._('Please specify a valid game id.'))
+        self.set_servers_data(game, ())
 
-        with self.__game_table as game_table:
-            with game_table[game]["servers"] as server_list:
-                server_list.clear()
+    def get_lock_stats(self) -> dict:
+        """
+        Returns lock statistics per game: number of acquisitions, how many of them had to wait and the total wait time in seconds.
+        """
+        return {game: game_entry.get_lock_stats() for game, game_entry in self.__game_table.items()}
 
 
 class Core:
@@ -317,8 +492,35 @@ class Core:
     Contains core logic of Obozrenie server browser.
     """
 
-    def __init__(self):
+    def __init__(self, query_concurrency: int = QUERY_CONCURRENCY_LIMIT):
         self.game_table = GameTable(helpers.load_table(GAME_CONFIG_FILE))
+        self.query_executor = scheduler.QueryExecutor(
+            self.stat_master_target, query_concurrency,
+            batch_target=self.stat_master_batch_target, batch_groups=adapters.get_batch_adapters())
+
+        self.viewed_game = None
+        self.game_activity = {}  # Time of the last user request per game
+
+        self.auto_refresher = scheduler.AutoRefresher(self.auto_refresh_game,
+                                                      AUTO_REFRESH_INITIAL_INTERVAL,
+                                                      AUTO_REFRESH_MIN_INTERVAL,
+                                                      AUTO_REFRESH_MAX_INTERVAL)
+        self.auto_refresh_callback = None
+        self.partial_results_callback = None  # Called with the game id whenever a running query publishes a batch of servers
+
+        self.query_tokens = {}  # Cancel tokens of the running queries by game
+        self.query_origins = {}  # Game settings and monotonic start time of the running queries by game
+        self.query_tokens_lock = threading.Lock()
+
+        self.master_refresh_times = {}  # Monotonic time of the last complete master server query by game
+        self.master_refresh_requests = set()  # Games whose next refresh has to ask the master servers
+
+        self.server_details = {}  # (time, entry) of the recently queried server details by (game, host)
+        self.server_details_lock = threading.Lock()
+
+        self.rtt_cache_version = None  # Version of the response time cache last saved
+        if RTT_CACHE_PERSIST:
+            self.load_rtt_cache()
 
         self.geolocation = None
         path = geoip.find_database()
@@ -361,54 +563,360 @@ class Core:
             code = (record.get("country") or {}).get("iso_code")
         return code or ""
 
-    def update_server_list(self, game: str, stat_callback=None) -> None:
-        """Updates server lists."""
-        stat_master_thread = threading.Thread(
-            target=self.stat_master_target, args=(game, stat_callback))
-        stat_master_thread.daemon = True
-        stat_master_thread.start()
+    def update_server_list(self, game: str, stat_callback=None, priority=None, restart: bool = False, full_refresh: bool = False) -> scheduler.QueryJob:
+        """
+        Updates server lists.
+        The query is queued on the query executor. Should the game already be queued or refreshing, the callback is attached to that query instead.
+        With restart, a refresh that is already running is cancelled and a new one is queued, provided it is outdated (see query_is_outdated). Otherwise it is joined.
+        Without an explicit priority the request counts as user activity and is served first.
+        With full_refresh, the master servers are asked for the server list even if the known servers could be requeried instead, see get_known_servers.
+        """
+        if full_refresh:
+            self.master_refresh_requests.add(game)
+        if priority is None:
+            priority = scheduler.PRIORITY.VIEWED
+            self.game_activity[game] = time.time()
+            self.auto_refresher.watch(game)
+        if restart and not self.query_is_outdated(game):
+            restart = False
+        adapter = self.game_table.get_game_info(game)["adapter"]
+        job = self.query_executor.submit(game, stat_callback, priority=priority, group=adapter, restart=restart)
+        if restart:
+            self.cancel_running_query(game)
+        return job
+
+    def query_is_outdated(self, game: str) -> bool:
+        """Tells whether the running refresh of the specified game was started with other game settings or more than QUERY_RESTART_AGE seconds ago."""
+        with self.query_tokens_lock:
+            origin = self.query_origins.get(game)
+        if origin is None:
+            return False
+        settings, start_time = origin
+        return dict(settings) != dict(self.game_table.get_game_settings(game)) or time.monotonic() - start_time >= QUERY_RESTART_AGE
+
+    def cancel_running_query(self, game: str) -> None:
+        """Stops the running refresh of the specified game. The servers received so far are kept."""
+        with self.query_tokens_lock:
+            token = self.query_tokens.get(game)
+        if token is not None:
+            token.cancel()
+
+    def cancel_query(self, game: str) -> None:
+        """Stops the refresh of the specified game, whether it is queued or running."""
+        if self.query_executor.cancel(game):
+            self.auto_refresher.abandon(game)
+        self.cancel_running_query(game)
+
+    def cancel_all_queries(self) -> None:
+        for game in self.game_table.get_game_set():
+            self.cancel_query(game)
+
+    def set_viewed_game(self, game: str) -> None:
+        """Marks the game the user is looking at. It is queried before any other game."""
+        self.viewed_game = game
+        if game not in ('', None):
+            self.game_activity[game] = time.time()
+
+    def get_game_priority(self, game: str) -> int:
+        """Returns the query priority of a game based on user activity."""
+        if game == self.viewed_game:
+            return scheduler.PRIORITY.VIEWED
+        if time.time() - self.game_activity.get(game, 0) < USER_ACTIVITY_WINDOW:
+            return scheduler.PRIORITY.ACTIVE
+        return scheduler.PRIORITY.BACKGROUND
+
+    def refresh_all(self, stat_callback=None, progress_callback=None) -> scheduler.RefreshAll:
+        """
+        Updates server lists of all games.
+        The viewed game goes first, then the games with recent user activity, then the rest. Games of different adapters are interleaved.
+        progress_callback is called with the RefreshAll progress object every time a game is done.
+        """
+        game_list = sorted(self.game_table.get_game_set(), key=lambda game: (self.get_game_priority(game), game))
+
+        def cb_progress(refresh):
+            if progress_callback is not None:
+                progress_callback(refresh)
+            if refresh.completed == refresh.total:
+                helpers.debug_msg([CORE_MSG, i18n._("Refreshed %(game_num)i games. Elapsed time: %(stat_time)s s.") % {
+                    'game_num': refresh.total, 'stat_time': round(refresh.elapsed, 2)}])
+
+        refresh = scheduler.RefreshAll(game_list, cb_progress)
+
+        def cb_game_done(game):
+            if stat_callback is not None:
+                stat_callback(game)
+            refresh.cb_game_done(game)
+
+        for game in game_list:
+            adapter = self.game_table.get_game_info(game)["adapter"]
+            self.query_executor.submit(game, cb_game_done, priority=self.get_game_priority(game), group=adapter)
+
+        return refresh
+
+    def start_auto_refresh(self, stat_callback=None) -> None:
+        """
+        Starts refreshing the games the user asked for in the background.
+        stat_callback is called after every background refresh, like the one of update_server_list.
+        """
+        self.auto_refresh_callback = stat_callback
+        self.auto_refresher.start()
+
+    def auto_refresh_game(self, game: str) -> None:
+        self.update_server_list(game, self.auto_refresh_callback, priority=self.get_game_priority(game))
+
+    def load_cached_servers(self, game: str) -> bool:
+        """
+        Fills a never queried server list from the server list cache. Cached servers are marked stale until the next refresh.
+        Returns whether anything was loaded.
+        """
+        if self.game_table.get_query_status(game) != self.game_table.QUERY_STATUS.EMPTY:
+            return False
+        if len(self.game_table.get_servers_snapshot(game)) > 0:
+            return False
+
+        server_list = server_cache.load_servers(game)
+        if not server_list:
+            return False
+
+        self.game_table.set_servers_data(game, server_list, stale=True)
+        helpers.debug_msg([CORE_MSG, i18n._("Loaded %(server_num)i cached servers for %(game)s.") % {
+            'server_num': len(server_list), 'game': self.game_table.get_game_info(game)["name"]}])
+        return True
+
+    def load_rtt_cache(self) -> None:
+        """Fills the response time cache with the still valid entries saved by a previous session."""
+        entries = server_cache.load_rtt()
+        if entries:
+            ping.service.cache.load((host, ping.PingStats(*stats), rtt_time) for host, stats, rtt_time in entries)
+        self.rtt_cache_version = ping.service.cache.version
+
+    def save_rtt_cache(self) -> None:
+        """Saves the response time cache if it changed since it was last saved."""
+        cache = ping.service.cache
+        if cache.version == self.rtt_cache_version:
+            return
+        self.rtt_cache_version = cache.version
+        try:
+            server_cache.save_rtt((host, stats.as_list(), rtt_time) for host, stats, rtt_time in cache.items())
+        except OSError as e:
+            helpers.debug_msg([CORE_MSG, i18n._("Failed to save response time cache: %(msg)s") % {'msg': e}])
+
+    def set_query_concurrency(self, query_concurrency: int) -> None:
+        """Sets the maximum number of backend queries running at the same time."""
+        self.query_executor.max_workers = query_concurrency
+
+    def get_server_details(self, game: str, host: str):
+        """
+        Returns the entry of a server along with the rules and player list that server list queries leave out.
+        Details are queried on demand and kept for SERVER_DETAILS_TTL seconds. The server list entry is returned as it is for adapters that do not query details and for servers that did not respond.
+        Blocks while the server is queried, so it should not be called from the GUI thread.
+        """
+        entry = self.game_table.get_server_info(game, host)
+        game_info = self.game_table.get_game_info(game)
+        if not adapters.can_stat_server_details(game_info["adapter"]):
+            return entry
+
+        now = time.monotonic()
+        with self.server_details_lock:
+            cached = self.server_details.get((game, host))
+            if cached is not None and now - cached[0] < SERVER_DETAILS_TTL:
+                return cached[1]
+
+        try:
+            details = adapters.stat_server_details(game_info["adapter"], game, game_info, host, helpers.CancelToken(SERVER_DETAILS_TIMEOUT))
+        except Exception as e:
+            helpers.debug_msg([CORE_MSG, i18n._("Failed to query details of %(host)s: %(msg)s") % {'host': host, 'msg': e}])
+            details = None
+        if details is None:
+            return entry
+
+        if entry is not None and 'country' in entry:
+            details['country'] = entry['country']
+        else:
+            details['country'] = self._lookup_country(host.split(':')[0])
+
+        with self.server_details_lock:
+            for key, (details_time, details_entry) in list(self.server_details.items()):
+                if now - details_time >= SERVER_DETAILS_TTL:
+                    del self.server_details[key]
+            self.server_details[(game, host)] = (now, details)
+        return details
+
+    def get_known_servers(self, game: str):
+        """
+        Returns the hosts to requery on the next refresh of a game instead of asking its master servers, or None when the master servers are due.
+        Masters are asked every MASTER_REFRESH_INTERVAL seconds, when a full refresh was requested, when no servers are known and for adapters that cannot query servers on their own.
+        """
+        if not adapters.can_stat_servers(self.game_table.get_game_info(game)["adapter"]):
+            return None
+        if game in self.master_refresh_requests:
+            return None
+        master_refresh_time = self.master_refresh_times.get(game)
+        if master_refresh_time is None or time.monotonic() - master_refresh_time >= MASTER_REFRESH_INTERVAL:
+            return None
+        return list(self.game_table.get_servers_snapshot(game).index) or None
 
     def stat_master_target(self, game: str, callback=None) -> None:
-        """Separate update thread. Strictly per-game."""
+        """Server list query. Strictly per-game, runs on a query executor worker."""
         game_info = self.game_table.get_game_info(game)
-        game_settings = self.game_table.get_game_settings(game)
-        game_name = game_info["name"]
-        master_list = list(game_settings["master_uri"])
-        adapter = game_info["adapter"]
+        master_list = list(self.game_table.get_game_settings(game)["master_uri"])
+        server_list = self.get_known_servers(game)
+        token = helpers.CancelToken(QUERY_DEADLINE)
 
         # Start query if it's not up already
-        if self.game_table.get_query_status(game) != self.game_table.QUERY_STATUS.WORKING:
-            self.game_table.set_query_status(
-                game, self.game_table.QUERY_STATUS.WORKING)
-            helpers.debug_msg([CORE_MSG, i18n._(
-                "Refreshing server list for %(game)s.") % {'game': game_name}])
-            stat_master_cmd = adapters.adapter_table[adapter].stat_master
-            temp_list = None
-
+        start_snapshot = self._begin_query(game, token, server_list)
+        if start_snapshot is not None:
+            temp_list = []
             try:
-                temp_list = stat_master_cmd(game, game_info, master_list)
+                if server_list is None:
+                    batches = adapters.stat_master_iter(game_info["adapter"], game, game_info, master_list, token)
+                else:
+                    batches = adapters.stat_servers_iter(game_info["adapter"], game, game_info, server_list, token)
+                # Batches are published as they arrive; servers missing from them are only dropped once the query is complete.
+                for batch in batches:
+                    self._publish_batch(game, batch, temp_list)
+                    if token.stopped:
+                        break
             except Exception as e:
-                helpers.debug_msg([CORE_MSG, e])
-                helpers.debug_msg([CORE_MSG, i18n._(
-                    "Internal backend error for %(game)s.") % {'game': game_name}])
-                self.game_table.set_query_status(
-                    game, self.game_table.QUERY_STATUS.ERROR)
+                self._fail_query(game, e)
             else:
-                self.game_table.set_servers_data(game, temp_list)
-
-                for entry in temp_list:
-                    host = entry["host"].split(':')[0]
-                    entry['country'] = self._lookup_country(host)
-
-                self.game_table.set_servers_data(game, temp_list)
-
-                self.game_table.set_query_status(
-                    game, self.game_table.QUERY_STATUS.READY)
+                self._finish_query(game, start_snapshot, temp_list, token, server_list is None)
+            finally:
+                self._end_query(game, token)
 
         # Call post-stat callback
         if callback is not None:
             callback(game)
 
+    def stat_master_batch_target(self, games: list) -> None:
+        """
+        Server list query of several games of the same adapter at once, e.g. with a single qstat run. Runs on a query executor worker.
+        Every game has a cancel token of its own: the results of a cancelled game are dropped, and the run itself is only stopped once every game is cancelled.
+        """
+        token = helpers.CancelToken(QUERY_DEADLINE)
+        game_tokens = {}
+        game_table = {}
+        server_lists = {}
+        start_snapshots = {}
+        temp_lists = {}
+        for game in games:
+            game_token = token.child()
+            server_list = self.get_known_servers(game)
+            start_snapshot = self._begin_query(game, game_token, server_list)
+            if start_snapshot is not None:
+                game_info = self.game_table.get_game_info(game)
+                game_table[game] = (game_info, list(self.game_table.get_game_settings(game)["master_uri"]))
+                if server_list is not None:
+                    server_lists[game] = server_list
+                game_tokens[game] = game_token
+                start_snapshots[game] = start_snapshot
+                temp_lists[game] = []
+        if not game_table:
+            return
+
+        def cancel_run():
+            if all(game_token.cancelled for game_token in game_tokens.values()):
+                token.cancel()
+
+        for game_token in game_tokens.values():
+            game_token.on_cancel(cancel_run)
+
+        adapter = self.game_table.get_game_info(next(iter(game_table)))["adapter"]
+        try:
+            for game, batch in adapters.stat_master_batch_iter(adapter, game_table, token, server_lists):
+                if not game_tokens[game].cancelled:
+                    self._publish_batch(game, batch, temp_lists[game])
+                if token.stopped:
+                    break
+        except Exception as e:
+            for game in game_table:
+                self._fail_query(game, e)
+        else:
+            for game in game_table:
+                self._finish_query(game, start_snapshots[game], temp_lists[game], game_tokens[game], game not in server_lists)
+        finally:
+            for game in game_table:
+                self._end_query(game, game_tokens[game])
+
+    def _begin_query(self, game: str, token, server_list=None):
+        """Marks the game as being refreshed. Returns the server list the query started from, or None if the game is being refreshed already."""
+        if self.game_table.get_query_status(game) == self.game_table.QUERY_STATUS.WORKING:
+            return None
+
+        self.game_table.set_query_status(
+            game, self.game_table.QUERY_STATUS.WORKING)
+        if server_list is None:
+            helpers.debug_msg([CORE_MSG, i18n._(
+                "Refreshing server list for %(game)s.") % {'game': self.game_table.get_game_info(game)["name"]}])
+        else:
+            helpers.debug_msg([CORE_MSG, i18n._(
+                "Requerying %(server_num)i known servers for %(game)s.") % {'server_num': len(server_list), 'game': self.game_table.get_game_info(game)["name"]}])
+        with self.query_tokens_lock:
+            self.query_tokens[game] = token
+            self.query_origins[game] = (self.game_table.get_game_settings(game), time.monotonic())
+        return self.game_table.get_servers_snapshot(game)
+
+    def _publish_batch(self, game: str, batch: list, temp_list: list) -> None:
+        """Adds geolocation to a batch of servers received by a running query and publishes it."""
+        for entry in batch:
+            host = entry["host"].split(':')[0]
+            entry['country'] = self._lookup_country(host)
+        temp_list.extend(batch)
+
+        if self.game_table.merge_servers_data(game, batch) and self.partial_results_callback is not None:
+            self.partial_results_callback(game)
+
+    def _fail_query(self, game: str, e: Exception) -> None:
+        helpers.debug_msg([CORE_MSG, e])
+        helpers.debug_msg([CORE_MSG, i18n._(
+            "Internal backend error for %(game)s.") % {'game': self.game_table.get_game_info(game)["name"]}])
+        self.game_table.set_query_status(
+            game, self.game_table.QUERY_STATUS.ERROR)
+        self.auto_refresher.report(game, error=True)
+
+    def _finish_query(self, game: str, start_snapshot: ServerSnapshot, temp_list: list, token, master_refresh: bool = True) -> None:
+        """
+        Publishes the complete server list of a query, unless it was cut short, and marks the game as ready.
+        A complete master refresh also restarts the period during which the known servers are requeried instead.
+        """
+        game_name = self.game_table.get_game_info(game)["name"]
+        if token.cancelled:
+            # Keep whatever was merged so far, but do not treat it as a complete list
+            helpers.debug_msg([CORE_MSG, i18n._(
+                "Refresh of %(game)s cancelled, %(server_num)i servers received.") % {'game': game_name, 'server_num': len(temp_list)}])
+            self.auto_refresher.abandon(game)
+        else:
+            if token.expired:
+                # An incomplete list does not tell which servers are gone
+                helpers.debug_msg([CORE_MSG, i18n._(
+                    "Refresh of %(game)s hit the deadline, keeping %(server_num)i servers received so far.") % {'game': game_name, 'server_num': len(temp_list)}])
+            else:
+                self.game_table.set_servers_data(game, temp_list)
+                if master_refresh:
+                    self.master_refresh_times[game] = time.monotonic()
+                    self.master_refresh_requests.discard(game)
+            diff = records.diff_server_lists(start_snapshot.servers, self.game_table.get_servers_data(game))
+            helpers.debug_msg([CORE_MSG, i18n._(
+                "%(game)s: %(added)i servers added, %(removed)i removed, %(changed)i changed.") % {
+                'game': game_name, 'added': len(diff.added), 'removed': len(diff.removed), 'changed': len(diff.changed)}])
+            self.auto_refresher.report(game, diff, len(temp_list))
+
+            try:
+                server_cache.save_servers(game, self.game_table.get_servers_data(game))
+            except OSError as e:
+                helpers.debug_msg([CORE_MSG, i18n._("Failed to save server list cache: %(msg)s") % {'msg': e}])
+            if RTT_CACHE_PERSIST:
+                self.save_rtt_cache()
+
+        self.game_table.set_query_status(
+            game, self.game_table.QUERY_STATUS.READY)
+
+    def _end_query(self, game: str, token) -> None:
+        with self.query_tokens_lock:
+            if self.query_tokens.get(game) is token:
+                del self.query_tokens[game]
+                del self.query_origins[game]
+
     def start_game(self, game: str, server: str, password: str) -> None:
         """Start game"""
         if game in ('', None):
@@ -68,3 +68,31 @@ GAME_CONFIG_FILE = os.path.join(SETTINGS_INTERNAL_DIR, "game_lists.toml")
 UI_DIR = os.path.join(PROJECT_DIR, "ui")
 GTK_UI_FILE = os.path.join(UI_DIR, "obozrenie_gtk.ui")
 GTK_APPMENU_FILE = os.path.join(UI_DIR, "obozrenie_gtk_appmenu.ui")
+
+# Maximum number of server list queries running at the same time
+QUERY_CONCURRENCY_LIMIT = 4
+
+# Games the user looked at within this many seconds are refreshed before the rest
+USER_ACTIVITY_WINDOW = 900
+
+# Background refresh intervals in seconds, adapted per game to how fast its server list changes
+AUTO_REFRESH_INITIAL_INTERVAL = 300
+AUTO_REFRESH_MIN_INTERVAL = 60
+AUTO_REFRESH_MAX_INTERVAL = 1800
+
+# Server list queries are stopped after this many seconds, keeping the servers received so far
+QUERY_DEADLINE = 120
+# A refresh asked for while one is running joins it, unless the game settings have changed since or it has been running this many seconds
+QUERY_RESTART_AGE = 15
+
+# Player lists and rules of a server are queried when its info is shown and kept for this many seconds
+SERVER_DETAILS_TTL = 10
+SERVER_DETAILS_TIMEOUT = 5
+
+# Master servers are asked for the server list at most this often; refreshes in between requery the servers already known
+MASTER_REFRESH_INTERVAL = 900
+
+# Server response times are reused for this many seconds, for at most this many hosts, and kept next to the server list cache if enabled
+RTT_CACHE_TTL = 300
+RTT_CACHE_SIZE = 50000
+RTT_CACHE_PERSIST = True
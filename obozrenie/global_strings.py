@@ -50,6 +50,7 @@ GTK_STRING_TABLE = {"main-window":                      {"title": PROJECT},
                     "filter-type-label":                {"label": i18n._("Game Type:")},
                     "filter-terrain-label":            {"label": i18n._("Terrain:")},
                     "filter-ping-label":               {"label": i18n._("Max ping:")},
+                    "filter-loss-label":               {"label": i18n._("Max loss, %:")},
                     "filter-secure-label":              {"label": i18n._("Secure:")},
                     "filter-notfull":                   {"label": i18n._("Not full")},
                     "filter-notempty":                  {"label": i18n._("Has players")},
@@ -57,6 +58,8 @@ GTK_STRING_TABLE = {"main-window":                      {"title": PROJECT},
                     "serverlist-view-name-column":      {"title": i18n._("Name")},
                     "serverlist-view-host-column":      {"title": i18n._("Host")},
                     "serverlist-view-ping-column":      {"title": i18n._("Ping")},
+                    "serverlist-view-ping_jitter-column": {"title": i18n._("Jitter")},
+                    "serverlist-view-ping_loss-column": {"title": i18n._("Loss")},
                     "serverlist-view-players-column":   {"title": i18n._("Players")},
                     "serverlist-view-game_mod-column":  {"title": i18n._("Game Mod")},
                     "serverlist-view-game_type-column": {"title": i18n._("Game Type")},
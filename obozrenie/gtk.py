@@ -26,8 +26,9 @@ import threading
 
 import gi
 gi.require_version('Gtk', '3.0')
+gi.require_version('Gdk', '3.0')
 gi.require_version('GdkPixbuf', '2.0')
-from gi.repository import GdkPixbuf, GLib, Gio, Gtk
+from gi.repository import Gdk, GdkPixbuf, GLib, Gio, Gtk
 
 import obozrenie.gtk_templates as templates
 import obozrenie.core as core
@@ -72,11 +73,13 @@ class GUIActions:
                                                                       "filter-type-label":                      "filter-type-label",
                                                                       "filter-terrain-label":                   "filter-terrain-label",
                                                                       "filter-ping-label":                      "filter-ping-label",
+                                                                      "filter-loss-label":                      "filter-loss-label",
                                                                       "filter-secure-label":                    "filter-secure-label",
                                                                       "filter-mod-entry":                       "filter-mod",
                                                                       "filter-type-entry":                      "filter-type",
                                                                       "filter-terrain-entry":                   "filter-terrain",
                                                                       "filter-ping-adjustment":                 "filter-ping",
+                                                                      "filter-loss-adjustment":                 "filter-loss",
                                                                       "filter-secure-comboboxtext":             "filter-secure",
                                                                       "filter-notfull-checkbutton":             "filter-notfull",
                                                                       "filter-notempty-checkbutton":            "filter-notempty",
@@ -85,6 +88,8 @@ class GUIActions:
                                                                       "Name_ServerList_TreeViewColumn":         "serverlist-view-name-column",
                                                                       "Host_ServerList_TreeViewColumn":         "serverlist-view-host-column",
                                                                       "Ping_ServerList_TreeViewColumn":         "serverlist-view-ping-column",
+                                                                      "Jitter_ServerList_TreeViewColumn":       "serverlist-view-ping_jitter-column",
+                                                                      "Loss_ServerList_TreeViewColumn":         "serverlist-view-ping_loss-column",
                                                                       "Players_ServerList_TreeViewColumn":      "serverlist-view-players-column",
                                                                       "GameMod_ServerList_TreeViewColumn":      "serverlist-view-game_mod-column",
                                                                       "GameType_ServerList_TreeViewColumn":     "serverlist-view-game_type-column",
@@ -143,7 +148,15 @@ class GUIActions:
                                          "secure_icon",
                                          "country_icon",
                                          "full",
-                                         "empty")
+                                         "empty",
+                                         "ping_jitter",
+                                         "ping_loss",
+                                         "ping_jitter_text",
+                                         "ping_loss_text")
+
+        # Game and generation of the server list currently in the model, and model rows by host
+        self.server_list_generation = (None, None)
+        self.server_list_iters = {}
 
         self.player_list_model_format = ("name",
                                          "score",
@@ -160,6 +173,8 @@ class GUIActions:
                                     "widget": "filter-terrain"},
                                 {"column": "ping",      "type": "<=",
                                     "widget": "filter-ping"},
+                                {"column": "ping_loss", "type": "<=",
+                                    "widget": "filter-loss"},
                                 {"column": "secure",    "type": "bool is ast bool",
                                     "widget": "filter-secure"},
                                 {"column": "full",      "type": "not true if true",
@@ -203,23 +218,19 @@ class GUIActions:
         """Shows server information window."""
         dialog = self.gtk_widgets["serverinfo-dialog"]
 
-        game_table = self.core.game_table.get_game_table_copy()
         game = self.app.settings.settings_table["common"]["selected-game-connect"]
-        server_list_table = game_table[game]["servers"]
         host = self.app.settings.settings_table["common"]["server-host"]
-        server_entry_index = helpers.search_dict_table(
-            server_list_table, "host", host)
-        if server_entry_index is not None:
-            server_entry = server_list_table[server_entry_index]
-            player_model = self.gtk_widgets["player-list-model"]
-            player_scrolledview = self.gtk_widgets["serverinfo-players-scrolledview"]
-
+        try:
+            server_entry = self.core.game_table.get_server_info(game, host)
+        except ValueError:
+            server_entry = None
+        if server_entry is not None:
             gtk_helpers.set_widget_value(
                 self.gtk_widgets["serverinfo-name"], server_entry["name"])
             gtk_helpers.set_widget_value(
                 self.gtk_widgets["serverinfo-host"], server_entry["host"])
             gtk_helpers.set_widget_value(
-                self.gtk_widgets["serverinfo-game"], game_table[server_entry["game_id"]]["info"]["name"])
+                self.gtk_widgets["serverinfo-game"], self.core.game_table.get_game_info(server_entry["game_id"])["name"])
             gtk_helpers.set_widget_value(
                 self.gtk_widgets['serverinfo-gameid'], server_entry['game_id'])
             gtk_helpers.set_widget_value(
@@ -229,19 +240,36 @@ class GUIActions:
             gtk_helpers.set_widget_value(
                 self.gtk_widgets["serverinfo-ping"], server_entry["ping"])
 
-            player_model.clear()
-            try:
-                player_table = helpers.dict_to_list(
-                    server_entry["players"], self.player_list_model_format)
-                for entry in player_table:
-                    player_model.append(entry)
-                player_scrolledview.set_property("visible", True)
-            except:
-                player_scrolledview.set_property("visible", False)
+            self.fill_player_list(server_entry)
+
+            # Server lists leave player lists out, they are queried for the dialog
+            def worker():
+                details = self.core.get_server_details(game, host)
+                if details is not None and details is not server_entry:
+                    GLib.idle_add(self.fill_player_list, details, host)
+
+            threading.Thread(target=worker, daemon=True).start()
 
             dialog.run()
             dialog.hide()
 
+    def fill_player_list(self, server_entry, host=None) -> None:
+        """Shows the players of a server in the server info dialog. With host, only if the dialog still shows that server."""
+        if host is not None and gtk_helpers.get_widget_value(self.gtk_widgets["serverinfo-host"]) != host:
+            return
+        player_model = self.gtk_widgets["player-list-model"]
+        player_scrolledview = self.gtk_widgets["serverinfo-players-scrolledview"]
+
+        player_model.clear()
+        try:
+            player_table = helpers.dict_to_list(
+                server_entry["players"], self.player_list_model_format)
+            for entry in player_table:
+                player_model.append(entry)
+            player_scrolledview.set_property("visible", True)
+        except:
+            player_scrolledview.set_property("visible", False)
+
     def cb_connect_button_clicked(self, *args):
         game = self.app.settings.settings_table["common"]["selected-game-connect"]
         server = self.app.settings.settings_table["common"]["server-host"]
@@ -354,6 +382,15 @@ class GUIActions:
     def cb_hide(widget, *args):
         widget.hide()
 
+    def cb_main_window_visibility_changed(self, window, *args):
+        """Pauses background refresh while the main window is hidden or minimized."""
+        iconified = bool(window.get_window() is not None and
+                         window.get_window().get_state() & Gdk.WindowState.ICONIFIED)
+        if window.get_visible() and not iconified:
+            self.core.auto_refresher.resume()
+        else:
+            self.core.auto_refresher.pause()
+
     def cb_quit(self, *args):
         """Exits the program."""
         self.app.quit()
@@ -384,10 +421,15 @@ class GUIActions:
     def cb_game_treeview_selection_changed(self, *args):
         game_id = self.app.settings.settings_table["common"]["selected-game-browser"]
         query_status = self.core.game_table.get_query_status(game_id)
+        previous_game = self.core.viewed_game
+        if previous_game not in (None, game_id):
+            self.core.cancel_query(previous_game)  # The servers received so far are kept
+        self.core.set_viewed_game(game_id)
 
         gtk_helpers.set_widget_value(
             self.gtk_widgets["game-combobox"], game_id)
         if query_status == self.core.game_table.QUERY_STATUS.EMPTY:  # Refresh server list on first access
+            self.core.load_cached_servers(game_id)  # Show the cached list while refreshing
             self.cb_update_button_clicked()
         else:
             if query_status == self.core.game_table.QUERY_STATUS.WORKING:
@@ -405,15 +447,32 @@ class GUIActions:
         """Actions on server list update button click"""
         game = self.app.settings.settings_table["common"]["selected-game-browser"]
 
-        self.set_loading_state("working")
         self.set_game_state(game, self.core.game_table.QUERY_STATUS.WORKING)
 
         self.core.update_server_list(
-            game, stat_callback=self.cb_update_server_list)
+            game, stat_callback=self.cb_update_server_list, restart=True, full_refresh=True)
+
+        # Keep showing the servers we have, marked stale, until the refresh is done
+        if len(self.core.game_table.get_servers_snapshot(game)) > 0:
+            self.update_server_list_model(game)
+            self.set_loading_state("stale")
+        else:
+            self.set_loading_state("working")
 
     def cb_update_server_list(self, game: str) -> None:
         GLib.idle_add(self.show_game_page, game)
 
+    def cb_refresh_all(self, *args):
+        """Updates server lists of all games."""
+        selected_game = self.app.settings.settings_table["common"]["selected-game-browser"]
+
+        for game in self.core.game_table.get_game_set():
+            self.set_game_state(game, self.core.game_table.QUERY_STATUS.WORKING)
+            if game == selected_game:
+                self.set_loading_state("working")
+
+        self.core.refresh_all(stat_callback=self.cb_update_server_list)
+
     def fill_game_store(self):
         """
         Loads game list into a list store
@@ -442,28 +501,47 @@ class GUIActions:
         """Set of actions to do after query is complete."""
         query_status = self.app.core.game_table.get_query_status(str(game))
         query_status_enum = self.core.game_table.QUERY_STATUS
-        server_table = self.app.core.game_table.get_servers_data(str(game))
         selected_game = self.app.settings.settings_table["common"]["selected-game-browser"]
 
-        model = self.gtk_widgets["server-list-sort"]
-        view = self.gtk_widgets["serverlist-view"]
-
         self.set_game_state(game, query_status)  # Display game status in GUI
         if selected_game == game:  # Is callback for the game that is currently viewed?
+            snapshot = self.core.game_table.get_servers_snapshot(str(game))
             if query_status == query_status_enum.READY:
-                self.set_loading_state("filling list")
-                view.set_model(None)  # Speed hack
-                self.fill_server_list_model(server_table)
-                view.set_model(model)
-                self.set_loading_state("ready")
+                self.update_server_list_model(str(game))
+                self.set_loading_state("stale" if snapshot.stale else "ready")
             elif query_status == query_status_enum.WORKING:
-                self.set_loading_state("working")
+                if len(snapshot) > 0:
+                    self.update_server_list_model(str(game))
+                    self.set_loading_state("stale")
+                else:
+                    self.set_loading_state("working")
             elif query_status == query_status_enum.ERROR:
                 self.set_loading_state("error")
 
         # In case selected server's existence is altered
         self.cb_server_connect_data_changed()
 
+    def update_server_list_model(self, game: str) -> None:
+        """Brings the server view up to date. Only the changes are applied if they are known, nothing is done if there are none."""
+        model = self.gtk_widgets["server-list-sort"]
+        view = self.gtk_widgets["serverlist-view"]
+
+        shown_game, shown_version = self.server_list_generation
+        if shown_game == game:
+            snapshot, diff = self.core.game_table.get_servers_diff(game, shown_version)
+        else:
+            snapshot, diff = self.core.game_table.get_servers_snapshot(game), None
+
+        if diff is None:
+            self.set_loading_state("filling list")
+            view.set_model(None)  # Speed hack
+            self.fill_server_list_model(snapshot.servers)
+            view.set_model(model)
+        elif diff:
+            self.apply_server_list_diff(diff)
+
+        self.server_list_generation = (game, snapshot.version)
+
     def set_game_state(self, game: str, state: str) -> None:
         icon = ""
         query_status_enum = self.core.game_table.QUERY_STATUS
@@ -486,11 +564,18 @@ class GUIActions:
 
     def set_loading_state(self, state: str) -> None:
         notebook = self.gtk_widgets["serverlist-notebook"]
+        scrolledwindow = self.gtk_widgets["serverlist-scrolledwindow"]
 
         if state == "working":
             notebook.set_property(
                 "page", self.serverlist_notebook_pages["loading"])
+        elif state == "stale":
+            # Servers shown are not fresh, e.g. cached ones while refreshing
+            scrolledwindow.set_opacity(0.6)
+            notebook.set_property(
+                "page", self.serverlist_notebook_pages["servers"])
         elif state == "filling list" or state == "ready":
+            scrolledwindow.set_opacity(1.0)
             notebook.set_property(
                 "page", self.serverlist_notebook_pages["servers"])
         elif state == "error":
@@ -500,14 +585,10 @@ class GUIActions:
     def fill_server_list_model(self, server_table):
         """Fill the server view"""
 
-        view_table = helpers.deepcopy(server_table)
-
         model = self.gtk_widgets["server-list-model"]
         model_append = model.append
         model_format = self.server_list_model_format
 
-        game_icons = self.game_icons
-
         # Clears the model
 
         # UGLY HACK!
@@ -522,36 +603,71 @@ class GUIActions:
         gtk_helpers.set_widget_value(
             self.gtk_widgets["server-connect-game"], game_selection, treeview_colnum=self.game_list_model_format.index("game_id"))
 
-        # Goodies for GUI
-        for entry in view_table:
-            game_id = entry.get("game_id")
-            country = entry.get("country")
-            # Game icon
-            entry["game_icon"] = game_icons.get(game_id)
-
-            # Lock icon
-            if entry["password"] is True:
-                entry["password_icon"] = "network-wireless-encrypted-symbolic"
-            else:
-                entry["password_icon"] = None
+        server_list = [self.get_server_list_row(entry) for entry in server_table]
+        ping_colnum = model_format.index("ping")
+        host_colnum = model_format.index("host")
+        server_list.sort(key=lambda row: row[ping_colnum])
+
+        self.server_list_iters = {}
+        for entry in server_list:
+            self.server_list_iters[entry[host_colnum]] = model_append(entry)
 
-            if entry["secure"] is True:
-                entry["secure_icon"] = "security-high-symbolic"
+    def apply_server_list_diff(self, diff) -> None:
+        """Applies server list changes to the model row by row."""
+        model = self.gtk_widgets["server-list-model"]
+        server_list_iters = self.server_list_iters
+
+        for host in diff.removed:
+            treeiter = server_list_iters.pop(host, None)
+            if treeiter is not None:
+                model.remove(treeiter)
+
+        for entry in diff.changed + diff.added:
+            row = self.get_server_list_row(entry)
+            treeiter = server_list_iters.get(entry["host"])
+            if treeiter is None:
+                server_list_iters[entry["host"]] = model.append(row)
             else:
-                entry["secure_icon"] = None
+                model[treeiter] = row
 
-            # Country flag (emoji derived from the ISO country code)
-            entry["country_icon"] = gtk_helpers.country_code_to_flag_emoji(country)
+    def get_server_list_row(self, entry) -> list:
+        """Builds a server list model row straight from a server record, without copying the record."""
+        game_id = entry.get("game_id")
+        player_count = entry.get("player_count")
+        player_limit = entry.get("player_limit")
 
-            # Filtering stuff
-            entry["full"] = entry["player_count"] >= entry["player_limit"]
-            entry["empty"] = entry["player_count"] == 0
+        # Goodies for GUI
+        gui_columns = {}
+        # Game icon
+        gui_columns["game_icon"] = self.game_icons.get(game_id)
 
-        view_table = helpers.sort_dict_table(view_table, "ping")
-        server_list = helpers.dict_to_list(view_table, model_format)
+        # Lock icon
+        if entry.get("password") is True:
+            gui_columns["password_icon"] = "network-wireless-encrypted-symbolic"
+        else:
+            gui_columns["password_icon"] = None
 
-        for entry in server_list:
-            model_append(entry)
+        if entry.get("secure") is True:
+            gui_columns["secure_icon"] = "security-high-symbolic"
+        else:
+            gui_columns["secure_icon"] = None
+
+        # Country flag (emoji derived from the ISO country code)
+        gui_columns["country_icon"] = gtk_helpers.country_code_to_flag_emoji(entry.get("country"))
+
+        # Filtering stuff
+        gui_columns["full"] = player_count >= player_limit
+        gui_columns["empty"] = player_count == 0
+
+        # Only pinged servers have jitter and loss, the others sort as if they had none
+        ping_jitter = entry.get("ping_jitter")
+        ping_loss = entry.get("ping_loss")
+        gui_columns["ping_jitter"] = ping_jitter or 0
+        gui_columns["ping_loss"] = ping_loss or 0
+        gui_columns["ping_jitter_text"] = "" if ping_jitter is None else str(ping_jitter)
+        gui_columns["ping_loss_text"] = "" if ping_loss is None else i18n._("%(loss)i%%") % {'loss': ping_loss}
+
+        return [gui_columns[key] if key in gui_columns else entry.get(key) for key in self.server_list_model_format]
 
     # Server list filtering
 
@@ -639,19 +755,17 @@ class GUIActions:
     def cb_server_connect_data_changed(self, *args):
         """Resets button sensitivity on server connect data change"""
         game = self.app.settings.settings_table["common"]["selected-game-connect"]
-        try:
-            server_list_table = self.core.game_table.get_servers_data(game)
-        except (ValueError, KeyError):
-            server_list_table = []
         host = self.app.settings.settings_table["common"]["server-host"]
-        server_entry_index = helpers.search_dict_table(
-            server_list_table, "host", host)
+        try:
+            server_entry = self.core.game_table.get_server_info(game, host)
+        except ValueError:
+            server_entry = None
 
         entry_field = self.gtk_widgets["server-connect-host"]
         info_button = self.gtk_widgets["action-info-button"]
         connect_button = self.gtk_widgets["action-connect-button"]
 
-        if server_entry_index is None:
+        if server_entry is None:
             info_button.set_property("sensitive", False)
             if gtk_helpers.get_widget_value(entry_field) == '':
                 connect_button.set_property("sensitive", False)
@@ -762,14 +876,28 @@ class App(Gtk.Application):
             main_window = self.guiactions.gtk_widgets["main-window"]
             self.add_window(main_window)
 
+            # Background refresh, paused while the window is out of sight
+            for signal_name in ("show", "hide", "window-state-event"):
+                main_window.connect(
+                    signal_name, self.guiactions.cb_main_window_visibility_changed)
+            self.core.start_auto_refresh(
+                stat_callback=self.guiactions.cb_update_server_list)
+
+            # Show servers while the query is still running
+            self.core.partial_results_callback = self.guiactions.cb_update_server_list
+
             # Create menu actions
+            refresh_all_action = Gio.SimpleAction.new("refresh-all", None)
             about_action = Gio.SimpleAction.new("about", None)
             quit_action = Gio.SimpleAction.new("quit", None)
 
+            refresh_all_action.connect(
+                "activate", self.guiactions.cb_refresh_all)
             about_action.connect(
                 "activate", self.guiactions.cb_about, main_window)
             quit_action.connect("activate", self.guiactions.cb_quit, self)
 
+            self.add_action(refresh_all_action)
             self.add_action(about_action)
             self.add_action(quit_action)
 
@@ -789,6 +917,8 @@ class App(Gtk.Application):
         GLib.idle_add(self.guiactions.prompt_geoip_download, window)
 
     def on_shutdown(self, app):
+        self.core.auto_refresher.stop()
+        self.core.cancel_all_queries()
         if self.status == "up":
             self.settings.save()
             self.status = "shutting down"
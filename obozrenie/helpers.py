@@ -49,10 +49,112 @@ class ThreadSafeBunch(Bunch):
         self.__lock.release()
 
 
+class ContentionLock:
+    """Reentrant lock that keeps count of how often and for how long callers had to wait for it."""
+
+    def __init__(self):
+        self.__lock = threading.RLock()
+        self.acquisitions = 0
+        self.contentions = 0
+        self.wait_time = 0.0
+
+    def acquire(self):
+        if not self.__lock.acquire(blocking=False):
+            wait_start_time = time.perf_counter()
+            self.__lock.acquire()
+            # Counters are only touched while the lock is held
+            self.contentions += 1
+            self.wait_time += time.perf_counter() - wait_start_time
+        self.acquisitions += 1
+        return True
+
+    def release(self):
+        self.__lock.release()
+
+    def __enter__(self):
+        return self.acquire()
+
+    def __exit__(self, type, value, traceback):
+        self.release()
+
+    def get_stats(self) -> dict:
+        return {'acquisitions': self.acquisitions, 'contentions': self.contentions, 'wait_time': self.wait_time}
+
+
+class CancelToken:
+    """
+    Cancellation flag with an optional deadline, shared by every step of a single query.
+    Steps are expected to check stopped between units of work and to bound blocking calls by remaining().
+    """
+
+    def __init__(self, timeout=None, deadline=None):
+        """timeout is relative to now, deadline is a time.monotonic() value. The earlier of both applies."""
+        if timeout is not None:
+            timeout_deadline = time.monotonic() + timeout
+            deadline = timeout_deadline if deadline is None else min(deadline, timeout_deadline)
+        self.deadline = deadline
+        self.__event = threading.Event()
+        self.__lock = threading.Lock()
+        self.__callbacks = []
+
+    def __repr__(self):
+        return "<Cancel Token - cancelled: %(cancelled)s, remaining: %(remaining)s>" % {'cancelled': self.cancelled, 'remaining': self.remaining()}
+
+    def cancel(self) -> None:
+        """Cancels the query. Callbacks registered with on_cancel are called once."""
+        with self.__lock:
+            if self.__event.is_set():
+                return
+            self.__event.set()
+            callbacks, self.__callbacks = self.__callbacks, []
+        for callback in callbacks:
+            callback()
+
+    def on_cancel(self, callback) -> None:
+        """Registers a callback for cancellation, e.g. killing a subprocess. It is called right away if the token is already cancelled."""
+        with self.__lock:
+            if not self.__event.is_set():
+                self.__callbacks.append(callback)
+                return
+        callback()
+
+    def child(self):
+        """Returns a token with the same deadline that can be cancelled on its own. Cancelling this token cancels the child as well."""
+        child = CancelToken(deadline=self.deadline)
+        self.on_cancel(child.cancel)
+        return child
+
+    @property
+    def cancelled(self) -> bool:
+        return self.__event.is_set()
+
+    @property
+    def expired(self) -> bool:
+        return self.deadline is not None and time.monotonic() >= self.deadline
+
+    @property
+    def stopped(self) -> bool:
+        """Whether the query should stop, either because it was cancelled or because the deadline has passed."""
+        return self.cancelled or self.expired
+
+    def remaining(self, limit=None):
+        """Returns the seconds left until the deadline, capped at limit. None means no limit at all."""
+        if self.deadline is None:
+            return limit
+        remaining = max(0.0, self.deadline - time.monotonic())
+        if limit is not None:
+            remaining = min(remaining, limit)
+        return remaining
+
+    def wait(self, timeout=None) -> bool:
+        """Sleeps until cancellation, the deadline or the timeout, whichever comes first. Returns whether the token was cancelled."""
+        return self.__event.wait(self.remaining(timeout))
+
+
 class ThreadSafeDict(dict):
     def __init__(self, * p_arg, ** n_arg):
         super().__init__(* p_arg, ** n_arg)
-        self.__lock = threading.RLock()
+        self.__lock = ContentionLock()
 
     def __enter__(self):
         self.__lock.acquire()
@@ -64,6 +166,9 @@ class ThreadSafeDict(dict):
     def __deepcopy__(self, *args):
         return ThreadSafeDict(json.loads(json.dumps(dict(self))))
 
+    def get_lock_stats(self) -> dict:
+        return self.__lock.get_stats()
+
 
 class ThreadSafeList(list):
     def __init__(self, * p_arg, ** n_arg):
@@ -16,117 +16,573 @@
 # You should have received a copy of the GNU General Public License
 # along with Obozrenie.  If not, see <http://www.gnu.org/licenses/>.
 
+"""
+Server response time measurement.
+
+Hosts are pinged in-process with ICMP echo requests multiplexed on a single unprivileged ICMP socket (Linux, see net.ipv4.ping_group_range).
+Where such sockets are not permitted, the system ping utility is run for every host instead.
+A single long-lived ping service is shared by all adapters, so concurrent refreshes share its request rate and never probe the same host twice at once.
+Response times are cached for a while, so refreshes only probe the hosts that are new or whose response time has expired.
+Every host is probed several times, so a single lost packet does not make it look unreachable; the probes of different hosts are interleaved.
+Adapters may pass an application level probe, e.g. a protocol handshake, that measures the servers which do not answer ICMP echo requests.
+"""
+
+import asyncio
+import collections
+import concurrent.futures
+import itertools
+import re
+import socket
+import statistics
+import struct
 import subprocess
 import sys
 import threading
+import time
 
-import obozrenie.helpers as helpers
-
+from obozrenie.global_settings import *
+from obozrenie.global_strings import *
 
-def add_rtt_info(array):
-    """Appends server response time to the table."""
-    hosts_array = []
-    rtt_array = []
-    rtt_array.append([])
-
-    for entry in array:
-        host = entry['host'].split(":")
-        if len(host) > 1:
-            host = ":".join(host[0:-1])
-        else:
-            host = ":".join(host)
-        hosts_array.append(host)
-
-    pinger = Pinger()
-    pinger.hosts = list(set(hosts_array))
-    pinger.action = "ping"
+import obozrenie.i18n as i18n
+import obozrenie.helpers as helpers
 
-    pinger.status.clear()
-    rtt_array = pinger.start()
+PING_MSG = CORECAT_MSG + i18n._("Ping")
+PING_TIMEOUT = 1.0  # Seconds to wait for an echo reply, like ping -W 1
+PING_MAX_IN_FLIGHT = 100  # Hosts waiting for a reply at the same time, per echo request sent to each
+PING_RATE = 1000  # Hosts pinged per second at most, over all callers
+PING_POLL_INTERVAL = 0.1  # Seconds between checks of the caller's token
+PING_UNREACHABLE = 9999
+PING_SAMPLES = 3  # Echo requests per host
+PING_SAMPLE_INTERVAL = 0.05  # Seconds between the echo requests to a host
+PING_UTILITY_INTERVAL = 0.2  # Seconds between the echo requests of the ping utility, the least it allows unprivileged users
+PING_UTILITY_TIME_PATTERN = re.compile(r'time[=<]\s*([\d.]+)')
+
+ICMP_ECHO_REPLY = 0
+ICMP_ECHO_REQUEST = 8
+ICMP_HEADER = struct.Struct('!BBHHH')  # Type, code, checksum, identifier, sequence number
+ICMP_PAYLOAD = b'obozrenie'
+
+
+def icmp_checksum(data: bytes) -> int:
+    """The Internet checksum of RFC 1071."""
+    if len(data) % 2:
+        data += b'\x00'
+    total = sum(struct.unpack('!%iH' % (len(data) // 2), data))
+    total = (total >> 16) + (total & 0xffff)
+    total += total >> 16
+    return ~total & 0xffff
+
+
+def build_echo_request(identifier: int, sequence: int, payload: bytes = ICMP_PAYLOAD) -> bytes:
+    header = ICMP_HEADER.pack(ICMP_ECHO_REQUEST, 0, 0, identifier, sequence)
+    checksum = icmp_checksum(header + payload)
+    return ICMP_HEADER.pack(ICMP_ECHO_REQUEST, 0, checksum, identifier, sequence) + payload
+
+
+def parse_echo_reply(data: bytes) -> tuple:
+    """Returns the identifier and the sequence number of an echo reply. ICMP sockets of the SOCK_DGRAM type receive packets without the IP header."""
+    if len(data) < ICMP_HEADER.size:
+        raise ValueError(i18n._("Truncated ICMP packet."))
+    packet_type, code, checksum, identifier, sequence = ICMP_HEADER.unpack_from(data)
+    if packet_type != ICMP_ECHO_REPLY:
+        raise ValueError(i18n._("Not an ICMP echo reply."))
+    return identifier, sequence
+
+
+def open_icmp_socket() -> socket.socket:
+    """
+    Opens an unprivileged ICMP socket. Raises OSError where the system does not permit one.
+    The socket is bound right away: the kernel stamps the local port of an ICMP socket on its echo requests as the identifier, and an unbound socket has none to read yet.
+    """
+    icmp_socket = socket.socket(socket.AF_INET, socket.SOCK_DGRAM, socket.IPPROTO_ICMP)
+    try:
+        icmp_socket.bind(('0.0.0.0', 0))
+        icmp_socket.setblocking(False)
+    except OSError:
+        icmp_socket.close()
+        raise
+    return icmp_socket
+
+
+def get_ping_host(host: str) -> str:
+    """Strips the port from a "host:port" string."""
+    host = host.split(":")
+    if len(host) > 1:
+        return ":".join(host[0:-1])
+    return ":".join(host)
+
+
+def parse_utility_output(output: str) -> list:
+    """Returns the response times in the output of the ping utility, one per reply."""
+    return [float(match) for match in PING_UTILITY_TIME_PATTERN.findall(output)]
+
+
+def utility_ping(host: str, samples: int = 1) -> list:
+    """Pings the host with the system ping utility. Returns the response time of every reply, in milliseconds."""
+    if sys.platform == 'win32':
+        ping_cmd = ["ping", '-n', str(samples), host]
+    else:
+        ping_cmd = ["ping", '-c', str(samples), '-i', str(PING_UTILITY_INTERVAL), '-n', '-W', '1', host]
+
+    try:
+        ping_output_byte, _ = subprocess.Popen(ping_cmd, stdout=subprocess.PIPE).communicate()
+    except OSError:
+        return []
+    return parse_utility_output(ping_output_byte.decode(errors='replace'))
+
+
+def parse_probe_address(address: str) -> tuple:
+    """Splits a "host:port" string, with the host in brackets for IPv6, into a socket address."""
+    host, port = address.rsplit(':', 1)
+    return (host.strip('[]'), int(port))
+
+
+async def tcp_connect_probe(address: tuple, timeout: float):
+    """Returns the time a TCP connection to the address takes to be established in seconds, or None if it is refused or times out."""
+    start_time = time.monotonic()
+    try:
+        reader, writer = await asyncio.wait_for(asyncio.open_connection(*address), timeout)
+    except (asyncio.TimeoutError, OSError):
+        return None
+    rtt = time.monotonic() - start_time
+    writer.close()
+    return rtt
+
+
+class UDPProbeProtocol(asyncio.DatagramProtocol):
+    """Resolves the waiter with the first datagram that is_response accepts, along with its time of arrival."""
+
+    def __init__(self, is_response):
+        self.is_response = is_response
+        self.waiter = asyncio.get_running_loop().create_future()
+
+    def datagram_received(self, data, addr):
+        if not self.waiter.done() and self.is_response(data):
+            self.waiter.set_result((data, time.monotonic()))
+
+    def error_received(self, exc):
+        if not self.waiter.done():
+            self.waiter.set_exception(exc)
+
+
+async def udp_probe(address: tuple, request: bytes, timeout: float, is_response, goodbye=None):
+    """
+    Sends the request to the address over a socket of its own. Returns the time the response took in seconds, or None if none came.
+    goodbye, if given, builds a datagram from the response to send back once it arrived, e.g. to close a session the request opened.
+    """
+    loop = asyncio.get_running_loop()
+    try:
+        transport, protocol = await loop.create_datagram_endpoint(lambda: UDPProbeProtocol(is_response), remote_addr=address)
+    except OSError:
+        return None
+    try:
+        send_time = time.monotonic()
+        transport.sendto(request)
+        data, receive_time = await asyncio.wait_for(protocol.waiter, timeout)
+        if goodbye is not None:
+            transport.sendto(goodbye(data))
+        return receive_time - send_time
+    except (asyncio.TimeoutError, OSError):
+        return None
+    finally:
+        transport.close()
+
+
+def add_rtt_info(array, token=None, probe=None):
+    """
+    Appends server response time statistics to the table: the median response time as ping, the lowest one, the jitter and the packet loss.
+    probe, a coroutine function of a socket address and a timeout returning the round trip time in seconds or None, measures the servers whose host did not answer any ICMP echo request.
+    Hosts left unpinged when the token stops the pinger get the unreachable value.
+    """
+    stats_table = service.ping([get_ping_host(entry['host']) for entry in array], token)
+
+    # Servers behind hosts that dropped every echo request get the application level probe
+    if probe is not None:
+        silent_servers = []
+        for entry in array:
+            stats = stats_table.get(get_ping_host(entry['host']))
+            if stats is not None and stats.loss == 100:
+                silent_servers.append(entry['host'])
+        if silent_servers and (token is None or not token.stopped):
+            stats_table.update(service.probe(silent_servers, probe, token))
 
     # Match ping in host list.
     for entry in array:
-        host = entry['host'].split(":")
-        if len(host) > 1:
-            host = ":".join(host[0:-1])
+        stats = stats_table.get(entry['host'], stats_table.get(get_ping_host(entry['host'])))
+        if stats is None:
+            entry["ping"] = PING_UNREACHABLE
+            continue
+        entry["ping"] = stats.rtt
+        entry["ping_min"] = stats.rtt_min
+        entry["ping_jitter"] = stats.jitter
+        entry["ping_loss"] = stats.loss
+
+
+class PingStats:
+    """Response time statistics of a host over several probes. Times are in milliseconds, the loss is in percent."""
+
+    __slots__ = ('rtt', 'rtt_min', 'jitter', 'loss')
+
+    def __init__(self, rtt: int = PING_UNREACHABLE, rtt_min: int = PING_UNREACHABLE, jitter: int = 0, loss: int = 100):
+        self.rtt = rtt
+        self.rtt_min = rtt_min
+        self.jitter = jitter
+        self.loss = loss
+
+    @classmethod
+    def from_samples(cls, samples: list, sent: int):
+        """
+        Computes the statistics of the response times of the replies, in the order they were sent, out of sent probes.
+        The jitter is the mean difference between consecutive response times.
+        """
+        if not samples:
+            return cls()
+        if len(samples) > 1:
+            jitter = statistics.mean(abs(current - previous) for previous, current in zip(samples, samples[1:]))
         else:
-            host = ":".join(host)
-        entry["ping"] = rtt_array[host]
-
+            jitter = 0
+        return cls(round(statistics.median(samples)), round(min(samples)), round(jitter),
+                   round(100 * (sent - len(samples)) / max(sent, len(samples))))
 
-class Pinger():
-    status = {}  # Populated while we are running
-    hosts = []  # List of all hosts/ips in our input queue
+    def __eq__(self, other):
+        if not isinstance(other, PingStats):
+            return NotImplemented
+        return self.as_list() == other.as_list()
 
-    action = "ping"
-    options = []
+    def __repr__(self):
+        return "<Ping Stats - RTT: %(rtt)i ms, min: %(rtt_min)i ms, jitter: %(jitter)i ms, loss: %(loss)i%%>" % {
+            'rtt': self.rtt, 'rtt_min': self.rtt_min, 'jitter': self.jitter, 'loss': self.loss}
 
-    # How many ping process at the time.
-    thread_count = 100
+    def as_list(self) -> list:
+        return [self.rtt, self.rtt_min, self.jitter, self.loss]
 
-    # Lock object to keep track the threads in loops, where it can potentially be race conditions.
-    lock = threading.Lock()
 
-    def ping(self, entry):
-        """Pings the requested server. Note: this function is not threaded yet, therefore pinging may take up to a second."""
-        if sys.platform == 'win32':
-            ping_cmd = ["ping", '-n', '1', entry]
-        else:
-            ping_cmd = ["ping", '-c', '1', '-n', '-W', '1', entry]
+class ICMPProtocol(asyncio.DatagramProtocol):
+    """Resolves the waiter of every echo reply that carries our identifier, by sender and sequence number, with its time of arrival."""
 
-        ping_output_byte, _ = subprocess.Popen(ping_cmd, stdout=subprocess.PIPE).communicate()
-        ping_output = ping_output_byte.decode()
+    def __init__(self, identifier: int):
+        self.identifier = identifier
+        self.waiters = {}  # Futures by (ip, sequence number)
 
+    def datagram_received(self, data, addr):
         try:
-            if sys.platform == 'win32':
-                rtt_info = ping_output.rstrip('\n').split('\n')[-1].split(',')[0].split('=')[-1].strip('ms')
-            else:
-                rtt_info = ping_output.split('\n')[1].split('=')[-1].split(' ')[0]
-
-            rtt_num = round(float(rtt_info))
-        except:
-            rtt_num = 9999
-
-        return rtt_num
-
-    def pop_queue(self):
-        entry = None
-
-        self.lock.acquire()  # Grab or wait+grab the lock.
-
-        if self.hosts:
-            entry = self.hosts.pop()
-
-        self.lock.release()  # Release the lock, so another thread could grab it.
-
-        return entry
-
-    def dequeue(self):
-        while True:
-            entry = self.pop_queue()
-
-            if not entry:
+            identifier, sequence = parse_echo_reply(data)
+        except ValueError:
+            return
+        if identifier != self.identifier:
+            return
+        waiter = self.waiters.get((addr[0], sequence))
+        if waiter is not None and not waiter.done():
+            waiter.set_result(time.monotonic())
+
+    def error_received(self, exc):
+        pass
+
+
+class RateLimiter:
+    """Spaces out the callers of wait() so that no more than rate of them pass per second."""
+
+    def __init__(self, rate: float):
+        self.interval = 1 / rate
+        self.__next_time = 0.0
+
+    async def wait(self) -> None:
+        now = time.monotonic()
+        pass_time = max(now, self.__next_time)
+        self.__next_time = pass_time + self.interval
+        if pass_time > now:
+            await asyncio.sleep(pass_time - now)
+
+
+class RTTCache:
+    """
+    Response time statistics by host, valid for ttl seconds. Thread-safe.
+    Beyond max_size hosts, the least recently used ones are evicted.
+    """
+
+    def __init__(self, ttl: float = RTT_CACHE_TTL, max_size: int = RTT_CACHE_SIZE):
+        self.ttl = ttl
+        self.max_size = max_size
+        self.version = 0  # Incremented on every update, e.g. to tell whether the cache needs saving
+
+        self.__entries = collections.OrderedDict()  # (stats, time) by host, the least recently used first
+        self.__lock = threading.Lock()
+
+    def __repr__(self):
+        return "<RTT Cache - hosts: %(hosts)i / %(max_size)i, TTL: %(ttl)s s>" % {'hosts': len(self), 'max_size': self.max_size, 'ttl': self.ttl}
+
+    def __len__(self):
+        return len(self.__entries)
+
+    def get_many(self, hosts) -> dict:
+        """Returns the statistics of the hosts that have not expired yet."""
+        now = time.time()
+        result = {}
+        with self.__lock:
+            for host in hosts:
+                entry = self.__entries.get(host)
+                if entry is None:
+                    continue
+                rtt, rtt_time = entry
+                if now - rtt_time >= self.ttl:
+                    del self.__entries[host]
+                    continue
+                self.__entries.move_to_end(host)
+                result[host] = rtt
+        return result
+
+    def update(self, rtt_table: dict, rtt_time: float = None) -> None:
+        """Stores the statistics of hosts measured at rtt_time, now by default."""
+        if not rtt_table:
+            return
+        if rtt_time is None:
+            rtt_time = time.time()
+        with self.__lock:
+            for host, rtt in rtt_table.items():
+                self.__entries[host] = (rtt, rtt_time)
+                self.__entries.move_to_end(host)
+            while len(self.__entries) > self.max_size:
+                self.__entries.popitem(last=False)
+            self.version += 1
+
+    def load(self, entries) -> None:
+        """Adds (host, stats, time) entries, e.g. saved by a previous session. Expired ones are skipped."""
+        now = time.time()
+        with self.__lock:
+            for host, rtt, rtt_time in sorted(entries, key=lambda entry: entry[2], reverse=True):
+                if now - rtt_time < self.ttl and host not in self.__entries:
+                    self.__entries[host] = (rtt, rtt_time)
+                    self.__entries.move_to_end(host, last=False)
+            while len(self.__entries) > self.max_size:
+                self.__entries.popitem(last=False)
+
+    def items(self) -> list:
+        """Returns the (host, stats, time) entries that have not expired yet, the least recently used first."""
+        now = time.time()
+        with self.__lock:
+            return [(host, rtt, rtt_time) for host, (rtt, rtt_time) in self.__entries.items() if now - rtt_time < self.ttl]
+
+    def clear(self) -> None:
+        with self.__lock:
+            self.__entries.clear()
+            self.version += 1
+
+
+class PingService:
+    """
+    Long-lived pinger for any number of concurrent callers.
+    Probes run on an event loop of the service's own thread: no more than rate hosts per second in total.
+    Every host gets samples echo requests, sample_interval seconds apart, and the requests to other hosts go out in between.
+    The limits count hosts, not echo requests. A sampled host is waited for longer, so max_in_flight * samples hosts are pinged at a time, which keeps a refresh as fast as with a single echo request per host.
+    A host asked for by several callers at once is probed once, and the result is handed to all of them.
+    Hosts with a response time in the cache are not probed.
+    Application level probes of "host:port" addresses go through the same limits and cache, one probe per address.
+    ICMP echo requests share a single socket; the ping utility is run on a bounded thread pool where ICMP sockets are not permitted.
+    """
+
+    def __init__(self, timeout: float = PING_TIMEOUT, max_in_flight: int = PING_MAX_IN_FLIGHT, rate: float = PING_RATE, cache: RTTCache = None,
+                 samples: int = PING_SAMPLES, sample_interval: float = PING_SAMPLE_INTERVAL):
+        self.timeout = timeout
+        self.max_in_flight = max_in_flight
+        self.rate = rate
+        self.samples = max(1, int(samples))
+        self.sample_interval = sample_interval
+        self.cache = cache if cache is not None else RTTCache()
+
+        self.__lock = threading.Lock()
+        self.__loop = None
+        self.__thread = None
+
+        # State of the event loop thread
+        self.__setup_lock = None
+        self.__in_flight = None
+        self.__rate_limiter = None
+        self.__transport = None
+        self.__protocol = None
+        self.__executor = None
+        self.__sequences = itertools.count()
+        self.__probes = {}  # Running and queued probes by host
+        self.__callers = {}  # Tokens of the callers waiting for a probe, by host
+
+    def __repr__(self):
+        return "<Ping Service - mode: %(mode)s, probes: %(probes)i>" % {'mode': self.mode, 'probes': len(self.__probes)}
+
+    @property
+    def mode(self):
+        """"icmp" or "utility" once the first probe has run, None before."""
+        if self.__transport is not None:
+            return "icmp"
+        if self.__executor is not None:
+            return "utility"
+        return None
+
+    def open_socket(self) -> socket.socket:
+        return open_icmp_socket()
+
+    def get_destination(self, ip: str) -> tuple:
+        return (ip, 0)
+
+    def ping(self, hosts, token=None) -> dict:
+        """
+        Pings the hosts and returns their response time statistics. Thread-safe.
+        Hosts that did not reply get the unreachable response time. Hosts whose probe has not finished when the token stops are left out.
+        """
+        return self.__measure_many(hosts, token, self.__ping_host)
+
+    def probe(self, addresses, probe, token=None) -> dict:
+        """
+        Measures the response time of the "host:port" addresses with probe, a coroutine function of a socket address and a timeout returning the round trip time in seconds or None. Thread-safe.
+        Returns statistics by address like ping() does.
+        """
+        return self.__measure_many(addresses, token, lambda address: self.__app_probe(address, probe))
+
+    def __measure_many(self, keys, token, measure) -> dict:
+        if token is None:
+            token = helpers.CancelToken()
+        rtt_table = self.cache.get_many(set(keys))
+        keys = set(keys) - set(rtt_table)
+        if not keys:
+            return rtt_table
+
+        helpers.debug_msg([PING_MSG, i18n._("Probing %(host_num)i hosts, %(cached_num)i response times cached.") % {'host_num': len(keys), 'cached_num': len(rtt_table)}])
+        fresh_table = asyncio.run_coroutine_threadsafe(self.__run_many(keys, token, measure), self.__get_loop()).result()
+        self.cache.update(fresh_table)
+        rtt_table.update(fresh_table)
+        return rtt_table
+
+    def close(self) -> None:
+        """Stops the event loop thread and releases the socket. The service starts anew if used again."""
+        with self.__lock:
+            loop, thread = self.__loop, self.__thread
+            self.__loop = self.__thread = None
+        if loop is None:
+            return
+
+        async def cancel_probes():
+            probes = list(self.__probes.values())
+            for probe in probes:
+                probe.cancel()
+            await asyncio.gather(*probes, return_exceptions=True)
+
+        asyncio.run_coroutine_threadsafe(cancel_probes(), loop).result()
+        loop.call_soon_threadsafe(loop.stop)
+        thread.join()
+        if self.__transport is not None:
+            self.__transport.close()
+        if self.__executor is not None:
+            self.__executor.shutdown(wait=False)
+        loop.close()
+        self.__setup_lock = self.__in_flight = self.__rate_limiter = None
+        self.__transport = self.__protocol = self.__executor = None
+        self.__probes.clear()
+        self.__callers.clear()
+
+    def __get_loop(self):
+        with self.__lock:
+            if self.__loop is None:
+                self.__loop = asyncio.new_event_loop()
+                self.__thread = threading.Thread(target=self.__loop.run_forever, daemon=True)
+                self.__thread.start()
+            return self.__loop
+
+    async def __setup(self) -> None:
+        """Opens the ICMP socket on first use, or picks the ping utility if the system does not permit one."""
+        if self.__setup_lock is None:
+            self.__setup_lock = asyncio.Lock()
+            self.__in_flight = asyncio.Semaphore(self.max_in_flight * self.samples)
+            self.__rate_limiter = RateLimiter(self.rate)
+        async with self.__setup_lock:
+            if self.mode is not None:
+                return
+            try:
+                icmp_socket = self.open_socket()
+            except OSError as e:
+                helpers.debug_msg([PING_MSG, i18n._("ICMP sockets are not available, falling back to the ping utility: %(error)s") % {'error': e}])
+                self.__executor = concurrent.futures.ThreadPoolExecutor(self.max_in_flight)
+                return
+            # The kernel puts the local port of an ICMP socket into the identifier field
+            identifier = icmp_socket.getsockname()[1]
+            loop = asyncio.get_running_loop()
+            self.__transport, self.__protocol = await loop.create_datagram_endpoint(lambda: ICMPProtocol(identifier), sock=icmp_socket)
+
+    async def __run_many(self, keys: set, token, measure) -> dict:
+        await self.__setup()
+        probes = {key: self.__request(key, token, measure) for key in keys}
+        pending = set(probes.values())
+        while pending and not token.stopped:
+            done, pending = await asyncio.wait(pending, timeout=PING_POLL_INTERVAL)
+        return {key: probe.result() for key, probe in probes.items() if probe.done() and probe.result() is not None}
+
+    def __request(self, key: str, token, measure) -> asyncio.Future:
+        """Joins the running probe of the host or address, or queues a new one."""
+        probe = self.__probes.get(key)
+        if probe is None:
+            self.__callers[key] = []
+            probe = asyncio.ensure_future(self.__probe(key, measure))
+            self.__probes[key] = probe
+
+            def forget(probe):
+                self.__probes.pop(key, None)
+                self.__callers.pop(key, None)
+
+            probe.add_done_callback(forget)
+        self.__callers[key].append(token)
+        return probe
+
+    async def __probe(self, key: str, measure):
+        """Returns the statistics of the host or address, or None if every caller has stopped waiting for it."""
+        async with self.__in_flight:
+            if all(token.stopped for token in self.__callers[key]):
                 return None
+            return await measure(key)
 
-            if self.action == "ping":
-                result = self.ping(entry)
-            else:
-                result = None
-
-            self.status[entry] = result
-
-    def start(self):
-        threads = []
-
-        for i in range(self.thread_count):
-            # Create self.thread_count number of threads that together will
-            # cooperate removing every ip in the list. Each thread will do the
-            # job as fast as it can.
-            t = threading.Thread(target=self.dequeue)
-            t.start()
-            threads.append(t)
-
-        # Wait until all the threads are done. .join() is blocking.
-        [t.join() for t in threads]
+    async def __app_probe(self, address: str, probe) -> PingStats:
+        try:
+            socket_address = parse_probe_address(address)
+        except ValueError:
+            return PingStats()
+        await self.__rate_limiter.wait()
+        rtt = await probe(socket_address, self.timeout)
+        return PingStats.from_samples([] if rtt is None else [rtt * 1000], 1)
+
+    async def __ping_host(self, host: str) -> PingStats:
+        await self.__rate_limiter.wait()
+        if self.__transport is None:
+            samples = await asyncio.get_running_loop().run_in_executor(self.__executor, utility_ping, host, self.samples)
+            return PingStats.from_samples(samples, self.samples)
+        return await self.__icmp_ping(host)
+
+    async def __icmp_ping(self, host: str) -> PingStats:
+        """Sends the echo requests to the host, then waits for the replies for up to timeout seconds after the last one."""
+        loop = asyncio.get_running_loop()
+        try:
+            ip = (await loop.getaddrinfo(host, None, family=socket.AF_INET, type=socket.SOCK_DGRAM))[0][4][0]
+        except OSError:
+            return PingStats()
 
-        return self.status
+        requests = []  # (sequence number, waiter, send time)
+        try:
+            for i in range(self.samples):
+                if i > 0:
+                    await asyncio.sleep(self.sample_interval)
+
+                sequence = next(self.__sequences) & 0xffff
+                waiter = loop.create_future()
+                self.__protocol.waiters[(ip, sequence)] = waiter
+                requests.append((sequence, waiter, time.monotonic()))
+                try:
+                    self.__transport.sendto(build_echo_request(self.__protocol.identifier, sequence), self.get_destination(ip))
+                except OSError:
+                    waiter.cancel()
+
+            await asyncio.wait([waiter for sequence, waiter, send_time in requests], timeout=self.timeout)
+        finally:
+            for sequence, waiter, send_time in requests:
+                del self.__protocol.waiters[(ip, sequence)]
+
+        samples = [(waiter.result() - send_time) * 1000 for sequence, waiter, send_time in requests
+                   if waiter.done() and not waiter.cancelled()]
+        return PingStats.from_samples(samples, self.samples)
+
+
+service = PingService()
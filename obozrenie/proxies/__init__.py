@@ -21,12 +21,13 @@ import obozrenie.helpers as helpers
 from obozrenie.global_settings import *
 from obozrenie.global_strings import *
 
+from . import asyncio_udp
 from . import qstat_process
 from . import requests_http
 
 proxy_table = {}
 
-proxy_list = ('qstat_process', 'requests_http')
+proxy_list = ('asyncio_udp', 'qstat_process', 'requests_http')
 
 for proxy in proxy_list:
     proxy_table[proxy] = globals()[proxy]
@@ -0,0 +1,225 @@
+#!/usr/bin/env python3
+# This source file is part of Obozrenie
+# Copyright 2015 Artem Vorotnikov
+
+# For more information, see https://github.com/obozrenie/obozrenie
+
+# Obozrenie is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License version 3, as
+# published by the Free Software Foundation.
+
+# Obozrenie is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+
+# You should have received a copy of the GNU General Public License
+# along with Obozrenie.  If not, see <http://www.gnu.org/licenses/>.
+
+"""
+asyncio UDP transport shared by the native query adapters.
+
+A single socket serves all queries of a refresh. Datagrams are handed to whoever listens to their sender, so any number of servers can be queried at once.
+The event loop runs in a thread of its own, see iter_async.
+"""
+
+import asyncio
+import queue
+import socket
+import threading
+import time
+
+import obozrenie.i18n as i18n
+import obozrenie.helpers as helpers
+
+
+def parse_address(address: str) -> tuple:
+    """Splits an "ip:port" string into a socket address."""
+    host, port = address.rsplit(':', 1)
+    return (host, int(port))
+
+
+async def aiterate(iterable):
+    """Iterates over both plain and async iterables."""
+    if hasattr(iterable, '__aiter__'):
+        async for item in iterable:
+            yield item
+    else:
+        for item in iterable:
+            yield item
+
+
+def iter_async(async_iterable):
+    """
+    Runs an async iterable on an event loop of its own thread and yields its items in the calling thread.
+    The loop keeps receiving while the caller is busy, so response times are not skewed by the consumer.
+    """
+    stop = threading.Event()
+    items = queue.Queue()
+    end = object()
+
+    async def run():
+        iterator = async_iterable.__aiter__()
+        try:
+            while not stop.is_set():
+                try:
+                    item = await iterator.__anext__()
+                except StopAsyncIteration:
+                    break
+                items.put((item, None))
+        except Exception as e:
+            items.put((end, e))
+        finally:
+            await iterator.aclose()
+            items.put((end, None))
+
+    thread = threading.Thread(target=asyncio.run, args=(run(),))
+    thread.daemon = True
+    thread.start()
+    try:
+        while True:
+            item, error = items.get()
+            if error is not None:
+                raise error
+            if item is end:
+                return
+            yield item
+    finally:
+        stop.set()
+
+
+class DatagramDispatcher(asyncio.DatagramProtocol):
+    """Queues every received datagram, along with its time of arrival, for whoever listens to its sender."""
+
+    def __init__(self):
+        self.listeners = {}  # Queues by socket address
+
+    def datagram_received(self, data, addr):
+        listener = self.listeners.get(addr[:2])
+        if listener is not None:
+            listener.put_nowait((data, time.monotonic()))
+
+    def error_received(self, exc):
+        pass
+
+
+class UDPClient:
+    """
+    Sends queries over a single UDP socket.
+    No more than max_in_flight queries wait for a response at any time. Servers that do not respond are asked again up to retries times.
+    """
+
+    def __init__(self, timeout: float, retries: int, max_in_flight: int, token=None):
+        self.timeout = timeout
+        self.retries = retries
+        self.max_in_flight = max_in_flight
+        self.token = token if token is not None else helpers.CancelToken()
+        self.transport = None
+        self.protocol = None
+
+    async def open(self) -> None:
+        loop = asyncio.get_running_loop()
+        self.transport, self.protocol = await loop.create_datagram_endpoint(DatagramDispatcher, local_addr=('0.0.0.0', 0))
+
+    def close(self) -> None:
+        if self.transport is not None:
+            self.transport.close()
+            self.transport = None
+
+    async def resolve(self, address: str) -> tuple:
+        """Resolves a "host:port" string, e.g. of a master server, into an IPv4 socket address."""
+        host, port = parse_address(address)
+        address_info = await asyncio.get_running_loop().getaddrinfo(host, port, family=socket.AF_INET, type=socket.SOCK_DGRAM)
+        return address_info[0][4][:2]
+
+    def __listen(self, address: tuple) -> asyncio.Queue:
+        if address in self.protocol.listeners:
+            raise ValueError(i18n._("A query to %(address)s is already in flight.") % {'address': "%s:%i" % address})
+        listener = asyncio.Queue()
+        self.protocol.listeners[address] = listener
+        return listener
+
+    async def request(self, address: tuple, packet: bytes, timeout: float):
+        """Sends a packet and returns the response along with the round trip time, or None on timeout. The wait never outlasts the deadline of the token."""
+        timeout = self.token.remaining(timeout)
+        if self.token.stopped:
+            return None
+        listener = self.__listen(address)
+        send_time = time.monotonic()
+        try:
+            self.transport.sendto(packet, address)
+            data, receive_time = await asyncio.wait_for(listener.get(), timeout)
+        except asyncio.TimeoutError:
+            return None
+        finally:
+            del self.protocol.listeners[address]
+        return data, receive_time - send_time
+
+    async def exchange(self, address: tuple, packet: bytes, timeout: float):
+        """Sends a packet and yields the responses until none arrives for timeout seconds or the deadline of the token passes. For replies that span several datagrams."""
+        if self.token.stopped:
+            return
+        listener = self.__listen(address)
+        try:
+            self.transport.sendto(packet, address)
+            while True:
+                try:
+                    data, receive_time = await asyncio.wait_for(listener.get(), self.token.remaining(timeout))
+                except asyncio.TimeoutError:
+                    return
+                yield data
+        finally:
+            del self.protocol.listeners[address]
+
+    async def query_many(self, addresses, query):
+        """
+        Runs the query coroutine function for each of the "ip:port" addresses, which may be an iterable or an async iterable.
+        Yields (address, result) as results come in; addresses the query returned None for are left out. Duplicate addresses are queried once.
+        """
+        pending = asyncio.Queue(self.max_in_flight)
+        results = asyncio.Queue()
+        done = object()
+        feed_error = []
+
+        async def feed():
+            seen = set()
+            try:
+                async for address in aiterate(addresses):
+                    if self.token.stopped:
+                        break
+                    if address not in seen:
+                        seen.add(address)
+                        await pending.put(address)
+            except Exception as e:
+                feed_error.append(e)
+            finally:
+                for i in range(self.max_in_flight):
+                    await pending.put(None)
+
+        async def work():
+            try:
+                while True:
+                    address = await pending.get()
+                    if address is None:
+                        break
+                    result = await query(parse_address(address))
+                    if result is not None:
+                        await results.put((address, result))
+            finally:
+                await results.put(done)
+
+        tasks = [asyncio.ensure_future(feed())]
+        tasks += [asyncio.ensure_future(work()) for i in range(self.max_in_flight)]
+        try:
+            running_workers = self.max_in_flight
+            while running_workers > 0:
+                result = await results.get()
+                if result is done:
+                    running_workers -= 1
+                else:
+                    yield result
+            if feed_error:
+                raise feed_error[0]
+        finally:
+            for task in tasks:
+                task.cancel()
@@ -0,0 +1,178 @@
+#!/usr/bin/env python3
+# This source file is part of Obozrenie
+# Copyright 2015 Artem Vorotnikov
+
+# For more information, see https://github.com/obozrenie/obozrenie
+
+# Obozrenie is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License version 3, as
+# published by the Free Software Foundation.
+
+# Obozrenie is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+
+# You should have received a copy of the GNU General Public License
+# along with Obozrenie.  If not, see <http://www.gnu.org/licenses/>.
+
+"""
+QStat process management shared by all qstat backed games.
+
+qstat handles a single request list per process and exits, so processes are not reused. Instead, the pool hands out a bounded number of process slots.
+Output is streamed to the consumer as it arrives, and processes are killed when their time is up, when the consumer is cancelled or when it stops reading.
+"""
+
+import collections
+import subprocess
+import threading
+import time
+
+from obozrenie.global_strings import *
+
+import obozrenie.i18n as i18n
+import obozrenie.helpers as helpers
+
+QSTAT_MSG = BACKENDCAT_MSG + i18n._("QStat")
+QSTAT_EXECUTABLE = "qstat"
+QSTAT_MAX_PROCESSES = 4  # qstat processes running at the same time
+QSTAT_READ_SIZE = 65536  # Bytes read from the qstat pipe at a time
+QSTAT_EXIT_TIMEOUT = 1  # Seconds a process that closed its output has to exit before it is killed
+QSTAT_HISTORY_SIZE = 64  # Finished invocations kept for inspection
+
+
+def read_chunks(stream, size=QSTAT_READ_SIZE):
+    """Yields whatever is available in the stream, up to size bytes at a time, until EOF."""
+    while True:
+        chunk = stream.read1(size)
+        if not chunk:
+            return
+        yield chunk
+
+
+class QStatInvocation:
+    """Timing and outcome of a single qstat run."""
+
+    def __init__(self, args: list):
+        self.args = list(args)
+        self.queue_time = time.monotonic()
+        self.start_time = None
+        self.end_time = None
+        self.returncode = None
+        self.killed = False
+        self.bytes_read = 0
+
+    def __repr__(self):
+        return "<QStat Invocation - elapsed: %(elapsed)s s, exit status: %(returncode)s, killed: %(killed)s, read: %(bytes_read)i B>" % {
+            'elapsed': round(self.elapsed, 2), 'returncode': self.returncode, 'killed': self.killed, 'bytes_read': self.bytes_read}
+
+    @property
+    def wait_time(self) -> float:
+        """Seconds spent waiting for a free process slot."""
+        if self.start_time is None:
+            return time.monotonic() - self.queue_time
+        return self.start_time - self.queue_time
+
+    @property
+    def elapsed(self) -> float:
+        """Run time of the process so far, or in total once it is over."""
+        if self.start_time is None:
+            return 0.0
+        if self.end_time is None:
+            return time.monotonic() - self.start_time
+        return self.end_time - self.start_time
+
+
+class QStatProcessPool:
+    """
+    Runs qstat processes, no more than max_processes at a time.
+    Finished invocations are kept in history, the most recent last.
+    """
+
+    def __init__(self, max_processes: int = QSTAT_MAX_PROCESSES, executable: str = QSTAT_EXECUTABLE):
+        self.executable = executable
+        self.max_processes = max(1, int(max_processes))
+        self.history = collections.deque(maxlen=QSTAT_HISTORY_SIZE)
+
+        self.__condition = threading.Condition()
+        self.__running = 0
+
+    def __repr__(self):
+        return "<QStat Process Pool - running: %(running)i / %(max_processes)i>" % {'running': self.__running, 'max_processes': self.max_processes}
+
+    @property
+    def running(self) -> int:
+        return self.__running
+
+    def __acquire(self, token) -> bool:
+        with self.__condition:
+            while self.__running >= self.max_processes:
+                if token.stopped:
+                    return False
+                self.__condition.wait(0.1)
+            self.__running += 1
+            return True
+
+    def __release(self) -> None:
+        with self.__condition:
+            self.__running -= 1
+            self.__condition.notify_all()
+
+    def run(self, args: list, stdin_data: bytes, token=None, timeout=None):
+        """
+        Runs qstat with the specified arguments and request list, yielding its output in chunks as it arrives.
+        Waits for a free process slot first. The process is killed after timeout seconds, as soon as the token is cancelled, or when the consumer closes the generator.
+        Nothing is run if the token stops while waiting.
+        """
+        if token is None:
+            token = helpers.CancelToken()
+
+        invocation = QStatInvocation(args)
+        if not self.__acquire(token):
+            return
+
+        try:
+            invocation.start_time = time.monotonic()
+            process = subprocess.Popen([self.executable] + invocation.args, stdin=subprocess.PIPE, stdout=subprocess.PIPE)
+
+            def kill():
+                if process.poll() is None:
+                    invocation.killed = True
+                    process.kill()
+
+            token.on_cancel(kill)
+            kill_timer = None
+            if timeout is not None:
+                kill_timer = threading.Timer(timeout, kill)
+                kill_timer.daemon = True
+                kill_timer.start()
+
+            try:
+                process.stdin.write(stdin_data)
+                process.stdin.close()
+
+                for chunk in read_chunks(process.stdout):
+                    invocation.bytes_read += len(chunk)
+                    yield chunk
+
+                # The output is over, give the process a moment to exit by itself
+                try:
+                    process.wait(QSTAT_EXIT_TIMEOUT)
+                except subprocess.TimeoutExpired:
+                    pass
+            finally:
+                if kill_timer is not None:
+                    kill_timer.cancel()
+                kill()
+                process.stdout.close()
+                invocation.returncode = process.wait()
+                invocation.end_time = time.monotonic()
+                self.history.append(invocation)
+                helpers.debug_msg([QSTAT_MSG, i18n._("Process finished. Exit status: %(returncode)s, killed: %(killed)s, output: %(bytes_read)i bytes, waited: %(wait_time)s s, elapsed time: %(elapsed)s s.") % {
+                    'returncode': invocation.returncode, 'killed': invocation.killed, 'bytes_read': invocation.bytes_read,
+                    'wait_time': round(invocation.wait_time, 2), 'elapsed': round(invocation.elapsed, 2)}])
+        finally:
+            self.__release()
+
+
+pool = QStatProcessPool()
@@ -0,0 +1,166 @@
+#!/usr/bin/env python3
+# This source file is part of Obozrenie
+# Copyright 2015 Artem Vorotnikov
+
+# For more information, see https://github.com/obozrenie/obozrenie
+
+# Obozrenie is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License version 3, as
+# published by the Free Software Foundation.
+
+# Obozrenie is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+
+# You should have received a copy of the GNU General Public License
+# along with Obozrenie.  If not, see <http://www.gnu.org/licenses/>.
+
+"""Compact server record representation."""
+
+import collections.abc
+
+SERVER_FIELDS = ('host',
+                 'name',
+                 'ping',
+                 'ping_min',
+                 'ping_jitter',
+                 'ping_loss',
+                 'player_count',
+                 'player_limit',
+                 'password',
+                 'secure',
+                 'country',
+                 'game_id',
+                 'game_mod',
+                 'game_type',
+                 'game_name',
+                 'terrain',
+                 'rules',
+                 'players')
+
+_SERVER_FIELD_SET = frozenset(SERVER_FIELDS)
+
+
+class ServerRecord(collections.abc.MutableMapping):
+    """
+    A single server entry, stored in slots instead of a per-instance dict.
+
+    Records behave like the plain server dicts they replace: fields are accessed with record['host'], iteration yields only the fields that were set and records compare equal to dicts holding the same data.
+    Only the fields in SERVER_FIELDS may be set.
+    """
+
+    __slots__ = SERVER_FIELDS
+
+    def __init__(self, *args, **fields):
+        if args:
+            fields = dict(*args, **fields)
+        for key, value in fields.items():
+            self[key] = value
+
+    @classmethod
+    def from_entry(cls, entry):
+        """Returns a new record holding the data of a record or a server dict."""
+        if isinstance(entry, cls):
+            return entry.copy()
+        return cls(entry)
+
+    @classmethod
+    def adopt(cls, entry):
+        """Returns the entry itself if it already is a record, otherwise a new record holding its data. Adopted records must not be altered afterwards."""
+        if isinstance(entry, cls):
+            return entry
+        return cls(entry)
+
+    def __getitem__(self, key):
+        if key not in _SERVER_FIELD_SET:
+            raise KeyError(key)
+        try:
+            return getattr(self, key)
+        except AttributeError:
+            raise KeyError(key) from None
+
+    def __setitem__(self, key, value):
+        if key not in _SERVER_FIELD_SET:
+            raise KeyError(key)
+        setattr(self, key, value)
+
+    def __delitem__(self, key):
+        if key not in _SERVER_FIELD_SET:
+            raise KeyError(key)
+        try:
+            delattr(self, key)
+        except AttributeError:
+            raise KeyError(key) from None
+
+    def __iter__(self):
+        for key in SERVER_FIELDS:
+            if hasattr(self, key):
+                yield key
+
+    def __len__(self):
+        return sum(1 for _ in self)
+
+    def __repr__(self):
+        return "<Server Record - %s>" % dict(self)
+
+    def copy(self):
+        """Returns a shallow copy of the record."""
+        record = ServerRecord.__new__(ServerRecord)
+        for key in SERVER_FIELDS:
+            try:
+                setattr(record, key, getattr(self, key))
+            except AttributeError:
+                pass
+        return record
+
+    def as_dict(self) -> dict:
+        """Returns the record as a plain server dict."""
+        return dict(self)
+
+
+class ServerListDiff:
+    """
+    Difference between two server lists, keyed by host.
+
+    added and changed hold the new records, removed holds the hosts that are gone. An empty diff is false.
+    """
+
+    __slots__ = ('added', 'removed', 'changed')
+
+    def __init__(self, added=(), removed=(), changed=()):
+        self.added = tuple(added)
+        self.removed = tuple(removed)
+        self.changed = tuple(changed)
+
+    def __bool__(self):
+        return bool(self.added or self.removed or self.changed)
+
+    def __repr__(self):
+        return "<Server List Diff - added: %(added)i, removed: %(removed)i, changed: %(changed)i>" % {'added': len(self.added), 'removed': len(self.removed), 'changed': len(self.changed)}
+
+
+def diff_server_lists(old_servers, new_servers) -> ServerListDiff:
+    """Computes the changes needed to turn one server list into another. Should a host be listed more than once, its first entry counts."""
+    old_table = {}
+    for entry in old_servers:
+        old_table.setdefault(entry['host'], entry)
+
+    added = []
+    changed = []
+    seen = set()
+    for entry in new_servers:
+        host = entry['host']
+        if host in seen:
+            continue
+        seen.add(host)
+
+        old_entry = old_table.get(host)
+        if old_entry is None:
+            added.append(entry)
+        elif old_entry != entry:
+            changed.append(entry)
+
+    removed = [host for host in old_table if host not in seen]
+
+    return ServerListDiff(added, removed, changed)
@@ -0,0 +1,401 @@
+#!/usr/bin/env python3
+# This source file is part of Obozrenie
+# Copyright 2015 Artem Vorotnikov
+
+# For more information, see https://github.com/obozrenie/obozrenie
+
+# Obozrenie is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License version 3, as
+# published by the Free Software Foundation.
+
+# Obozrenie is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+
+# You should have received a copy of the GNU General Public License
+# along with Obozrenie.  If not, see <http://www.gnu.org/licenses/>.
+
+"""Scheduling of server list queries."""
+
+import itertools
+import threading
+import time
+
+from obozrenie.global_strings import *
+
+import obozrenie.helpers as helpers
+import obozrenie.i18n as i18n
+
+
+# Lower values are served first
+PRIORITY = helpers.enum('VIEWED', 'ACTIVE', 'BACKGROUND')
+
+
+class QueryJob:
+    """A pending or running query of a single game, shared by everyone who asked for it."""
+
+    def __init__(self, game: str, priority: int, group, sequence: int):
+        self.game = game
+        self.priority = priority
+        self.group = group
+        self.sequence = sequence
+        self.callbacks = []
+        self.done = threading.Event()
+
+    def __repr__(self):
+        return "<Query Job - game: %(game)s, priority: %(priority)i, done: %(done)s>" % {'game': self.game, 'priority': self.priority, 'done': self.done.is_set()}
+
+    def wait(self, timeout=None) -> bool:
+        return self.done.wait(timeout)
+
+
+class QueryExecutor:
+    """
+    Runs queries on a bounded number of worker threads.
+
+    A request for a game that is already queued or running does not start another query: it is attached to the existing job and its callback fires when that job is done.
+    A restart request for a running game queues a new job instead, which starts once the running one is over. Queries of the same game never run at once.
+    Worker threads are started on demand, up to max_workers, and exit once the queue is empty.
+
+    Queued jobs are served by priority. Among jobs of equal priority the one whose group has the fewest running jobs goes first, so that jobs of different kinds (e.g. HTTP and qstat backed games) are interleaved, then the oldest one.
+
+    Jobs of a group listed in batch_groups are run together: a worker that takes one also takes the other startable jobs of its group and priority, and hands all of their games to batch_target at once.
+    Every job of a batch is still finished on its own.
+    """
+
+    def __init__(self, target, max_workers: int, batch_target=None, batch_groups=()):
+        self.target = target
+        self.batch_target = batch_target
+        self.batch_groups = frozenset(batch_groups)
+        self.__max_workers = max(1, int(max_workers))
+
+        self.__condition = threading.Condition()
+        self.__pending = []
+        self.__jobs = {}  # Queued and running jobs by game
+        self.__running = {}  # Running jobs by game
+        self.__busy_workers = 0  # Workers running a job or a batch of jobs
+        self.__worker_count = 0
+        self.__sequence = itertools.count()
+
+    def __repr__(self):
+        return "<Query Executor - running: %(running)i, pending: %(pending)i, max workers: %(max_workers)i>" % {'running': len(self.__running), 'pending': len(self.__pending), 'max_workers': self.__max_workers}
+
+    @property
+    def max_workers(self) -> int:
+        return self.__max_workers
+
+    @max_workers.setter
+    def max_workers(self, value: int) -> None:
+        with self.__condition:
+            self.__max_workers = max(1, int(value))
+            self.__spawn_workers()
+
+    def get_running(self) -> set:
+        with self.__condition:
+            return set(self.__running.keys())
+
+    def get_pending(self) -> list:
+        with self.__condition:
+            return [job.game for job in sorted(self.__pending, key=lambda job: (job.priority, job.sequence))]
+
+    def submit(self, game: str, callback=None, priority: int = PRIORITY.VIEWED, group=None, restart: bool = False) -> QueryJob:
+        """
+        Queues a query of the specified game, or joins the one already queued or running.
+        A queued job asked for again with a more urgent priority is moved up.
+        With restart, a running job is not joined; it is up to the caller to stop it.
+        """
+        with self.__condition:
+            job = self.__jobs.get(game)
+            if job is None or (restart and self.__running.get(game) is job):
+                job = QueryJob(game, priority, group, next(self.__sequence))
+                self.__jobs[game] = job
+                self.__pending.append(job)
+                self.__spawn_workers()
+            elif priority < job.priority:
+                job.priority = priority
+            if callback is not None:
+                job.callbacks.append(callback)
+        return job
+
+    def cancel(self, game: str) -> bool:
+        """
+        Drops the queued job of the specified game. Its callbacks are still called, so that waiters learn the query is over.
+        Returns whether a job was dropped; running jobs have to be stopped by their target.
+        """
+        with self.__condition:
+            job = self.__jobs.get(game)
+            if job is None or job not in self.__pending:
+                return False
+            self.__pending.remove(job)
+            del self.__jobs[game]
+        self.__finish(job)
+        return True
+
+    def __spawn_workers(self) -> None:
+        while self.__worker_count < min(self.__max_workers, self.__busy_workers + len(self.__pending)):
+            self.__worker_count += 1
+            worker = threading.Thread(target=self.__work)
+            worker.daemon = True
+            worker.start()
+
+    def __take_job(self):
+        with self.__condition:
+            if not self.__pending or self.__busy_workers >= self.__max_workers:
+                self.__worker_count -= 1
+                return None
+
+            group_load = {}
+            for running_job in self.__running.values():
+                group_load[running_job.group] = group_load.get(running_job.group, 0) + 1
+
+            startable_jobs = [job for job in self.__pending if job.game not in self.__running]
+            if not startable_jobs:
+                self.__worker_count -= 1
+                return None
+
+            job = min(startable_jobs, key=lambda job: (job.priority, group_load.get(job.group, 0), job.sequence))
+            batch = [job]
+            if self.batch_target is not None and job.group in self.batch_groups:
+                batch += [other_job for other_job in startable_jobs
+                          if other_job is not job and other_job.group == job.group and other_job.priority == job.priority]
+
+            for batch_job in batch:
+                self.__pending.remove(batch_job)
+                self.__running[batch_job.game] = batch_job
+            self.__busy_workers += 1
+            return batch
+
+    def __work(self) -> None:
+        while True:
+            batch = self.__take_job()
+            if batch is None:
+                return
+
+            try:
+                if len(batch) > 1:
+                    self.batch_target([job.game for job in batch])
+                else:
+                    self.target(batch[0].game)
+            except Exception as e:
+                helpers.debug_msg([CORE_MSG, e])
+
+            with self.__condition:
+                self.__busy_workers -= 1
+                for job in batch:
+                    del self.__running[job.game]
+                    if self.__jobs.get(job.game) is job:
+                        del self.__jobs[job.game]
+
+            for job in batch:
+                self.__finish(job)
+
+    def __finish(self, job: QueryJob) -> None:
+        with self.__condition:
+            callbacks = list(job.callbacks)
+
+        for callback in callbacks:
+            try:
+                callback(job.game)
+            except Exception as e:
+                helpers.debug_msg([CORE_MSG, i18n._("Query callback failed: %(msg)s") % {'msg': e}])
+        job.done.set()
+
+
+class RefreshAll:
+    """Progress of a refresh of several games at once."""
+
+    def __init__(self, games, progress_callback=None):
+        self.games = list(games)
+        self.total = len(self.games)
+        self.completed = 0
+        self.start_time = time.time()
+        self.end_time = None
+        self.progress_callback = progress_callback
+        self.done = threading.Event()
+        self.__lock = threading.Lock()
+
+        if self.total == 0:
+            self.end_time = self.start_time
+            self.done.set()
+
+    def __repr__(self):
+        return "<Refresh All - completed: %(completed)i / %(total)i>" % {'completed': self.completed, 'total': self.total}
+
+    @property
+    def elapsed(self) -> float:
+        """Wall time of the refresh so far, or in total once it is done."""
+        if self.end_time is not None:
+            return self.end_time - self.start_time
+        return time.time() - self.start_time
+
+    def wait(self, timeout=None) -> bool:
+        return self.done.wait(timeout)
+
+    def cb_game_done(self, game: str) -> None:
+        with self.__lock:
+            self.completed += 1
+            finished = self.completed == self.total
+            if finished:
+                self.end_time = time.time()
+
+        if self.progress_callback is not None:
+            self.progress_callback(self)
+        if finished:
+            self.done.set()
+
+
+class AutoRefreshState:
+    """Background refresh bookkeeping of a single game."""
+
+    def __init__(self, interval: float):
+        self.interval = interval
+        self.due = time.monotonic() + interval
+        self.errors = 0
+        self.in_flight = False
+
+
+class AutoRefresher:
+    """
+    Refreshes watched games in the background.
+
+    The interval of every game adapts to how much of its server list changed on the last refresh: lists that barely change are polled less and less often, busy ones more often.
+    Failed refreshes back off exponentially. Nothing is refreshed while the refresher is paused; overdue games are refreshed as soon as it is resumed.
+    """
+
+    # Share of changed servers below which the interval grows and above which it shrinks
+    CALM_CHANGE_RATIO = 0.05
+    BUSY_CHANGE_RATIO = 0.25
+
+    def __init__(self, submit, initial_interval: float, min_interval: float, max_interval: float):
+        self.submit = submit
+        self.initial_interval = initial_interval
+        self.min_interval = min_interval
+        self.max_interval = max_interval
+
+        self.__condition = threading.Condition()
+        self.__games = {}
+        self.__paused = False
+        self.__running = False
+
+    def __repr__(self):
+        return "<Auto Refresher - games: %(game_num)i, paused: %(paused)s>" % {'game_num': len(self.__games), 'paused': self.__paused}
+
+    @property
+    def paused(self) -> bool:
+        return self.__paused
+
+    def start(self) -> None:
+        with self.__condition:
+            if self.__running:
+                return
+            self.__running = True
+        thread = threading.Thread(target=self.__run)
+        thread.daemon = True
+        thread.start()
+
+    def stop(self) -> None:
+        with self.__condition:
+            self.__running = False
+            self.__condition.notify_all()
+
+    def pause(self) -> None:
+        with self.__condition:
+            self.__paused = True
+
+    def resume(self) -> None:
+        with self.__condition:
+            self.__paused = False
+            self.__condition.notify_all()
+
+    def watch(self, game: str) -> None:
+        """Starts refreshing the game in the background."""
+        with self.__condition:
+            if game not in self.__games:
+                self.__games[game] = AutoRefreshState(self.initial_interval)
+                self.__condition.notify_all()
+
+    def unwatch(self, game: str) -> None:
+        with self.__condition:
+            self.__games.pop(game, None)
+
+    def get_interval(self, game: str):
+        with self.__condition:
+            try:
+                return self.__games[game].interval
+            except KeyError:
+                return None
+
+    def report(self, game: str, diff=None, server_count: int = 0, error: bool = False) -> None:
+        """Adapts the interval of a game to the outcome of its latest refresh, whoever started it."""
+        with self.__condition:
+            state = self.__games.get(game)
+            if state is None:
+                return
+
+            if error:
+                state.errors += 1
+                interval = state.interval * 2 ** state.errors
+            else:
+                state.errors = 0
+                change_count = 0
+                if diff is not None:
+                    change_count = len(diff.added) + len(diff.removed) + len(diff.changed)
+                change_ratio = change_count / max(1, server_count)
+                if change_ratio < self.CALM_CHANGE_RATIO:
+                    state.interval = state.interval * 1.5
+                elif change_ratio > self.BUSY_CHANGE_RATIO:
+                    state.interval = state.interval / 2
+                state.interval = min(self.max_interval, max(self.min_interval, state.interval))
+                interval = state.interval
+
+            state.in_flight = False
+            state.due = time.monotonic() + min(self.max_interval, interval)
+            self.__condition.notify_all()
+
+    def abandon(self, game: str) -> None:
+        """Notes that the latest refresh of a game was cancelled or dropped. The game is due again after its current interval."""
+        with self.__condition:
+            state = self.__games.get(game)
+            if state is None:
+                return
+            state.in_flight = False
+            state.due = time.monotonic() + state.interval
+            self.__condition.notify_all()
+
+    def __take_due_games(self) -> list:
+        """Waits until at least one game is due and returns the due games, or None once stopped."""
+        with self.__condition:
+            while self.__running:
+                now = time.monotonic()
+                due_games = []
+                next_due = None
+                if not self.__paused:
+                    for game, state in self.__games.items():
+                        if state.in_flight:
+                            continue
+                        if state.due <= now:
+                            due_games.append(game)
+                        elif next_due is None or state.due < next_due:
+                            next_due = state.due
+
+                if due_games:
+                    for game in due_games:
+                        self.__games[game].in_flight = True
+                    return due_games
+
+                timeout = None if next_due is None else next_due - now
+                self.__condition.wait(timeout)
+        return None
+
+    def __run(self) -> None:
+        while True:
+            due_games = self.__take_due_games()
+            if due_games is None:
+                return
+            for game in due_games:
+                try:
+                    self.submit(game)
+                except Exception as e:
+                    helpers.debug_msg([CORE_MSG, e])
+                    self.report(game, error=True)
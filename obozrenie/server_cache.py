@@ -0,0 +1,126 @@
+#!/usr/bin/env python3
+# This source file is part of Obozrenie
+# Copyright 2015 Artem Vorotnikov
+
+# For more information, see https://github.com/obozrenie/obozrenie
+
+# Obozrenie is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License version 3, as
+# published by the Free Software Foundation.
+
+# Obozrenie is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+
+# You should have received a copy of the GNU General Public License
+# along with Obozrenie.  If not, see <http://www.gnu.org/licenses/>.
+
+"""On-disk cache of the last successfully queried server lists and of the server response times."""
+
+import gzip
+import json
+import os
+import time
+
+from xdg import BaseDirectory
+
+import obozrenie.records as records
+
+CACHE_DIR = os.path.join(BaseDirectory.xdg_cache_home, "obozrenie", "servers")
+
+# Bump on any incompatible change of the file layout. Files of other versions are ignored.
+SCHEMA_VERSION = 1
+
+RTT_CACHE_FILE = "rtt.json.gz"
+RTT_SCHEMA_VERSION = 2
+
+
+def get_cache_path(game: str) -> str:
+    return os.path.join(CACHE_DIR, game + ".json.gz")
+
+
+def save_servers(game: str, servers) -> None:
+    """Save a server list, atomically.
+
+    Servers are stored as rows of a single field list rather than as
+    objects, so field names are written once per file. Unset fields are
+    stored as null.
+    """
+    path = get_cache_path(game)
+    tmp_path = path + ".part"
+    rows = [[entry.get(key) for key in records.SERVER_FIELDS] for entry in servers]
+    cache = {'schema': SCHEMA_VERSION,
+             'game': game,
+             'time': time.time(),
+             'fields': records.SERVER_FIELDS,
+             'servers': rows}
+
+    os.makedirs(CACHE_DIR, exist_ok=True)
+    with gzip.open(tmp_path, 'wt', encoding='utf-8', compresslevel=6) as handle:
+        json.dump(cache, handle, separators=(',', ':'))
+    os.replace(tmp_path, path)
+
+
+def load_servers(game: str):
+    """Load a cached server list as server records.
+
+    Returns None when there is no cache for the game, or the file is
+    unreadable or of another schema version.
+    """
+    try:
+        with gzip.open(get_cache_path(game), 'rt', encoding='utf-8') as handle:
+            cache = json.load(handle)
+        if cache['schema'] != SCHEMA_VERSION or cache['game'] != game:
+            return None
+
+        fields = cache['fields']
+        server_list = []
+        for row in cache['servers']:
+            server_list.append(records.ServerRecord(
+                {key: value for key, value in zip(fields, row) if value is not None}))
+        return server_list
+    except (OSError, EOFError, ValueError, KeyError, TypeError):
+        return None
+
+
+def get_rtt_cache_path() -> str:
+    return os.path.join(CACHE_DIR, RTT_CACHE_FILE)
+
+
+def save_rtt(entries) -> None:
+    """Save (host, stats, time) entries of the response time cache, atomically.
+
+    stats is the list of the median and the lowest response time, the
+    jitter and the packet loss.
+    """
+    path = get_rtt_cache_path()
+    tmp_path = path + ".part"
+    cache = {'schema': RTT_SCHEMA_VERSION,
+             'time': time.time(),
+             'hosts': [list(entry) for entry in entries]}
+
+    os.makedirs(CACHE_DIR, exist_ok=True)
+    with gzip.open(tmp_path, 'wt', encoding='utf-8', compresslevel=6) as handle:
+        json.dump(cache, handle, separators=(',', ':'))
+    os.replace(tmp_path, path)
+
+
+def load_rtt():
+    """Load the (host, stats, time) entries of the response time cache.
+
+    Returns None when there is no cache, or the file is unreadable or of
+    another schema version.
+    """
+    try:
+        with gzip.open(get_rtt_cache_path(), 'rt', encoding='utf-8') as handle:
+            cache = json.load(handle)
+        if cache['schema'] != RTT_SCHEMA_VERSION:
+            return None
+        entries = []
+        for host, stats, rtt_time in cache['hosts']:
+            rtt, rtt_min, jitter, loss = stats
+            entries.append((str(host), [int(rtt), int(rtt_min), int(jitter), int(loss)], float(rtt_time)))
+        return entries
+    except (OSError, EOFError, ValueError, KeyError, TypeError):
+        return None
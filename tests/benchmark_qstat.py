@@ -0,0 +1,123 @@
+#!/usr/bin/env python3
+# This source file is part of Obozrenie
+# Copyright 2015 Artem Vorotnikov
+
+# For more information, see https://github.com/obozrenie/obozrenie
+
+# Obozrenie is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License version 3, as
+# published by the Free Software Foundation.
+
+# Obozrenie is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+
+# You should have received a copy of the GNU General Public License
+# along with Obozrenie.  If not, see <http://www.gnu.org/licenses/>.
+
+"""
+Compares the XML and the raw QStat output parsers.
+
+The same generated servers are rendered as -xml and as -raw output and fed to both parsers in pipe sized chunks.
+"""
+
+import argparse
+import os
+import sys
+import time
+import tracemalloc
+from xml.sax.saxutils import escape
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+from obozrenie.adapters import qstat
+from obozrenie.proxies import qstat_process
+
+DELIMITER = qstat.QSTAT_RAW_DELIMITER
+
+
+def generate_servers(server_count: int, player_count: int) -> list:
+    servers = []
+    for i in range(server_count):
+        servers.append({'address': "10.%i.%i.%i:27960" % (i >> 16 & 255, i >> 8 & 255, i & 255),
+                        'name': "^1Server ^7%i" % i,
+                        'map': "q3dm%i" % (i % 19),
+                        'gametype': "baseq3",
+                        'maxplayers': 16,
+                        'ping': 20 + i % 200,
+                        'rules': [("sv_hostname", "Server %i" % i), ("g_needpass", str(i % 2)), ("gamename", "baseq3"),
+                                  ("version", "ioq3 1.36_GIT"), ("sv_maxclients", "16"), ("timelimit", "15")],
+                        'players': [("Player^3%i" % j, j * 3, 30 + j) for j in range(player_count)]})
+    return servers
+
+
+def render_xml(servers: list) -> bytes:
+    lines = ['<?xml version="1.0" encoding="UTF-8"?>', '<qstat>',
+             '<server type="Q3M" address="master.example.net:27950" status="UP" servers="%i"></server>' % len(servers)]
+    for server in servers:
+        lines.append('<server type="Q3S" address="%s" status="UP"><hostname>%s</hostname><name>%s</name><gametype>%s</gametype>'
+                     '<map>%s</map><numplayers>%i</numplayers><maxplayers>%i</maxplayers><ping>%i</ping><retries>0</retries>' %
+                     (server['address'], server['address'], escape(server['name']), server['gametype'], server['map'],
+                      len(server['players']), server['maxplayers'], server['ping']))
+        lines.append('<rules>' + ''.join('<rule name="%s">%s</rule>' % (name, escape(value)) for name, value in server['rules']) + '</rules>')
+        lines.append('<players>' + ''.join('<player><name>%s</name><score>%i</score><ping>%i</ping></player>' % (escape(name), score, ping)
+                                           for name, score, ping in server['players']) + '</players></server>')
+    lines.append('</qstat>')
+    return '\n'.join(lines).encode()
+
+
+def render_raw(servers: list) -> bytes:
+    lines = [DELIMITER.join(("Q3M", "master.example.net:27950", str(len(servers))))]
+    for server in servers:
+        lines.append(DELIMITER.join(("Q3S", server['address'], server['name'], server['map'], str(server['maxplayers']),
+                                     str(len(server['players'])), str(server['ping']), "0", server['gametype'])))
+        lines.append(DELIMITER.join("%s=%s" % rule for rule in server['rules']))
+        lines.extend(DELIMITER.join((name, str(score), str(ping))) for name, score, ping in server['players'])
+        lines.append('')
+    return '\n'.join(lines).encode()
+
+
+def chunked(data: bytes):
+    for i in range(0, len(data), qstat_process.QSTAT_READ_SIZE):
+        yield data[i:i + qstat_process.QSTAT_READ_SIZE]
+
+
+def measure(name: str, parse):
+    tracemalloc.start()
+    start_time = time.perf_counter()
+    result = list(qstat.adapt_qstat_entries(parse(), 'q3a', 'Quake III Arena', 'Q3M', 'Q3S', None, None))
+    elapsed = time.perf_counter() - start_time
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    print("%-4s %8i servers  %7.3f s  peak %6.1f MiB" % (name, len(result), elapsed, peak / 2 ** 20))
+    return result
+
+
+def parse_arguments(description: str):
+    """Parses the server count and the players per server from the command line, exiting with the usage on invalid input."""
+    parser = argparse.ArgumentParser(description=description.strip().splitlines()[0])
+    parser.add_argument('servers', type=int, nargs='?', default=20000, help="number of generated servers (default: %(default)s)")
+    parser.add_argument('players', type=int, nargs='?', default=0, help="players per server (default: %(default)s)")
+    args = parser.parse_args()
+    if args.servers < 1 or args.players < 0:
+        parser.error("the server count must be positive and the player count must not be negative")
+    return args
+
+
+def main():
+    args = parse_arguments(__doc__)
+    player_count = args.players
+    servers = generate_servers(args.servers, player_count)
+    xml_output = render_xml(servers)
+    raw_output = render_raw(servers)
+    print("Output size: xml %.1f MiB, raw %.1f MiB" % (len(xml_output) / 2 ** 20, len(raw_output) / 2 ** 20))
+
+    xml_result = measure("xml", lambda: qstat.iter_qstat_entries(chunked(xml_output)))
+    raw_result = measure("raw", lambda: qstat.iter_qstat_raw_entries(chunked(raw_output), ['Q3S'], ['Q3M'], players=player_count > 0))
+    if xml_result != raw_result:
+        sys.exit("Parsers disagree")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,80 @@
+#!/usr/bin/env python3
+# This source file is part of Obozrenie
+# Copyright 2015 Artem Vorotnikov
+
+# For more information, see https://github.com/obozrenie/obozrenie
+
+# Obozrenie is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License version 3, as
+# published by the Free Software Foundation.
+
+# Obozrenie is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+
+# You should have received a copy of the GNU General Public License
+# along with Obozrenie.  If not, see <http://www.gnu.org/licenses/>.
+
+"""
+Compares parsing QStat XML output as a whole with parsing it incrementally from the pipe.
+
+Before: the output is read to the end, decoded and turned into entries with xmltodict and a JSON round trip.
+After: the output is fed to iter_qstat_entries in pipe sized chunks.
+
+Results with Python 3.11 on a single core, peak traced memory including the adapted entries:
+
+    servers  players  XML        before               after
+    20000    8        20.7 MiB   6.4-8.3 s  178.5 MiB   5.4-5.6 s  64.9 MiB
+    20000    0        10.0 MiB   3.2 s       97.4 MiB   1.9 s      27.0 MiB
+"""
+
+import json
+import os
+import sys
+import time
+import tracemalloc
+import xmltodict
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+from obozrenie import helpers
+from obozrenie.adapters import qstat
+
+from benchmark_qstat import chunked, generate_servers, parse_arguments, render_xml
+
+
+def parse_whole(chunks):
+    qstat_output = b''.join(chunks).decode()
+    server_table_dict = json.loads(json.dumps(xmltodict.parse(qstat_output)))
+    return helpers.enforce_array(server_table_dict['qstat']['server'])
+
+
+def measure(name: str, parse):
+    """Times a parser, then runs it again under tracemalloc for its peak memory, as tracing slows parsing down several times."""
+    start_time = time.perf_counter()
+    result = list(qstat.adapt_qstat_entries(parse(), 'q3a', 'Quake III Arena', 'Q3M', 'Q3S', None, None))
+    elapsed = time.perf_counter() - start_time
+    del result
+    tracemalloc.start()
+    result = list(qstat.adapt_qstat_entries(parse(), 'q3a', 'Quake III Arena', 'Q3M', 'Q3S', None, None))
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    print("%-6s %8i servers  %7.3f s  peak %6.1f MiB" % (name, len(result), elapsed, peak / 2 ** 20))
+    return result
+
+
+def main():
+    args = parse_arguments(__doc__)
+
+    xml_output = render_xml(generate_servers(args.servers, args.players))
+    print("Output size: %.1f MiB" % (len(xml_output) / 2 ** 20))
+
+    before = measure("before", lambda: parse_whole(chunked(xml_output)))
+    after = measure("after", lambda: qstat.iter_qstat_entries(chunked(xml_output)))
+    if before != after:
+        sys.exit("Parsers disagree")
+
+
+if __name__ == "__main__":
+    main()
@@ -17,15 +17,22 @@
 # along with Obozrenie.  If not, see <http://www.gnu.org/licenses/>.
 
 
+import asyncio
+import io
 import json
 import os
+import socket
+import struct
 import tempfile
 import threading
+import time
+import types
 import unittest
 import xmltodict
 from unittest import mock
 
 from obozrenie import helpers, adapters, i18n, launch
+from obozrenie.proxies import qstat_process
 
 
 class HelpersTests(unittest.TestCase):
@@ -178,7 +185,7 @@ class QStatTests(unittest.TestCase):
         """Check QStat output parsing - masters"""
         xml_string = '<server type="Q2S" address="localhost:12345" status="UP"><hostname>localhost</hostname><name>Gandalfehtgreen&apos;s Casino (R.I.P.)</name><gametype>action</gametype><map>locknload</map><numplayers>0</numplayers><maxplayers>15</maxplayers><numspectators>0</numspectators><maxspectators>0</maxspectators><ping>1126</ping><retries>1</retries><rules><rule name="*Q2Admin">2.0~3a63381</rule><rule name="actionversion">TNG 2.81~d504f0d</rule><rule name="allitem">0</rule><rule name="allweapon">0</rule><rule name="capturelimit">0</rule><rule name="cheats">0</rule><rule name="ctf">0</rule><rule name="deathmatch">1</rule><rule name="dmflags">8</rule><rule name="fraglimit">0</rule><rule name="game">action</rule><rule name="gamedate">Sep 15 2013</rule><rule name="gamedir">action</rule><rule name="gamename">action</rule><rule name="items">1</rule><rule name="matchmode">0</rule><rule name="needpass">0</rule><rule name="port">12345</rule><rule name="protocol">34</rule><rule name="q2a_mvd">1.6hau</rule><rule name="roundlimit">15</rule><rule name="roundtimelimit">5</rule><rule name="t1">0</rule><rule name="t2">0</rule><rule name="t3">0</rule><rule name="teamplay">1</rule><rule name="tgren">1</rule><rule name="timelimit">60</rule><rule name="use_3teams">0</rule><rule name="use_classic">0</rule><rule name="use_tourney">0</rule><rule name="uptime">297+0:09.46</rule></rules><players><player><name>PlayerA</name><score>0</score><ping>3</ping></player><player><name>PlayerB</name><score>0</score><ping>4</ping></player><player><name>PlayerC</name><score>0</score><ping>5</ping></player></players></server>'
 
-        spec_server_dict = {'game_name': 'action', 'password': False, 'game_mod': '', 'player_count': 0, 'secure': False, 'ping': 1126, 'rules': {'gamedir': 'action', 'needpass': '0', 'uptime': '297+0:09.46', 'use_classic': '0', 'timelimit': '60', 'capturelimit': '0', 'game': 'action', 'tgren': '1', 'actionversion': 'TNG 2.81~d504f0d', 'allitem': '0', 'use_tourney': '0', 't1': '0', 'protocol': '34', 'port': '12345', 'cheats': '0', 'ctf': '0', 'deathmatch': '1', 'q2a_mvd': '1.6hau', '*Q2Admin': '2.0~3a63381', 'teamplay': '1', 'use_3teams': '0', 'gamedate': 'Sep 15 2013', 't2': '0', 'fraglimit': '0', 'matchmode': '0', 'dmflags': '8', 'allweapon': '0', 'roundlimit': '15', 'gamename': 'action', 'roundtimelimit': '5', 'items': '1', 't3': '0'}, 'players': [{'name': 'PlayerA', 'ping': 3, 'score': 0}, {'name': 'PlayerB', 'ping': 4, 'score': 0}, {'name': 'PlayerC', 'ping': 5, 'score': 0}], 'name': "Gandalfehtgreen's Casino (R.I.P.)", 'player_limit': 15, 'host': 'localhost', 'game_type': 'action', 'game_id': 'q2', 'terrain': 'locknload'}
+        spec_server_dict = {'game_name': 'action', 'password': False, 'game_mod': 'action', 'player_count': 0, 'secure': False, 'ping': 1126, 'rules': {'gamedir': 'action', 'needpass': '0', 'uptime': '297+0:09.46', 'use_classic': '0', 'timelimit': '60', 'capturelimit': '0', 'game': 'action', 'tgren': '1', 'actionversion': 'TNG 2.81~d504f0d', 'allitem': '0', 'use_tourney': '0', 't1': '0', 'protocol': '34', 'port': '12345', 'cheats': '0', 'ctf': '0', 'deathmatch': '1', 'q2a_mvd': '1.6hau', '*Q2Admin': '2.0~3a63381', 'teamplay': '1', 'use_3teams': '0', 'gamedate': 'Sep 15 2013', 't2': '0', 'fraglimit': '0', 'matchmode': '0', 'dmflags': '8', 'allweapon': '0', 'roundlimit': '15', 'gamename': 'action', 'roundtimelimit': '5', 'items': '1', 't3': '0'}, 'players': [{'name': 'PlayerA', 'ping': 3, 'score': 0}, {'name': 'PlayerB', 'ping': 4, 'score': 0}, {'name': 'PlayerC', 'ping': 5, 'score': 0}], 'name': "Gandalfehtgreen's Casino (R.I.P.)", 'player_limit': 15, 'host': 'localhost', 'game_type': 'action', 'game_id': 'q2', 'terrain': 'locknload'}
         spec_debug_msg = None
 
         func = adapters.qstat.adapt_qstat_entry
@@ -192,6 +199,132 @@ class QStatTests(unittest.TestCase):
         unit = self.unit_parse_server_entry()
         self.assertTrue(unit['expectation'] == unit['result'])
 
+    spec_qstat_output = ('<?xml version="1.0" encoding="UTF-8"?>\n<qstat>\n'
+                         '<server type="Q2M" address="localhost:27900" status="UP" servers="2"></server>\n'
+                         '<server type="Q2S" address="localhost:27910" status="UP"><hostname>localhost:27910</hostname><name>^1A</name>'
+                         '<gametype>action</gametype><map>q2dm1</map><numplayers>1</numplayers><maxplayers>8</maxplayers><ping>20</ping>'
+                         '<rules><rule name="needpass">1</rule></rules><players><player><name>PlayerA</name><score>3</score><ping>20</ping></player></players></server>\n'
+                         '<server type="Q2S" address="localhost:27911" status="UP"><hostname>localhost:27911</hostname><name>B</name>'
+                         '<gametype>action</gametype><map>q2dm2</map><numplayers>0</numplayers><maxplayers>8</maxplayers><ping>30</ping>'
+                         '<rules></rules><players></players></server>\n'
+                         '</qstat>\n').encode()
+
+    def test_streaming_parser_matches_xmltodict(self):
+        """Entries parsed from arbitrarily split chunks are the same as the ones xmltodict gives for the whole output."""
+        chunks = [self.spec_qstat_output[i:i + 7] for i in range(0, len(self.spec_qstat_output), 7)]
+        expectation = xmltodict.parse(self.spec_qstat_output)['qstat']['server']
+        self.assertEqual(list(adapters.qstat.iter_qstat_entries(chunks)), json.loads(json.dumps(expectation)))
+
+    def test_streaming_parser_discards_parsed_servers(self):
+        """Servers are detached from the root once parsed, so the parsed tree stays empty however long the output is."""
+        roots = []
+
+        class RecordingParser(adapters.qstat.ElementTree.XMLPullParser):
+            def read_events(self):
+                for event, element in super().read_events():
+                    if not roots:
+                        roots.append(element)
+                    yield event, element
+
+        chunks = [self.spec_qstat_output[i:i + 7] for i in range(0, len(self.spec_qstat_output), 7)]
+        with mock.patch.object(adapters.qstat.ElementTree, "XMLPullParser", RecordingParser):
+            for entry in adapters.qstat.iter_qstat_entries(chunks):
+                self.assertLessEqual(len(roots[0]), 1)
+        self.assertEqual(roots[0].tag, 'qstat')
+        self.assertEqual(len(roots[0]), 0)
+
+    def test_stat_master_reads_qstat_pipe(self):
+        qstat_process = mock.MagicMock(stdin=io.BytesIO(), stdout=io.BytesIO(self.spec_qstat_output))
+        with mock.patch.object(adapters.qstat.qstat_process.subprocess, "Popen", return_value=qstat_process):
+            result = adapters.qstat.stat_master('q2', {'name': 'Quake II'}, ['localhost:27900'])
+        self.assertEqual([(entry['host'], entry['name'], entry['password']) for entry in result],
+                         [('localhost:27910', 'A', True), ('localhost:27911', 'B', False)])
+
+    def test_batch_run_demultiplexes_games(self):
+        """A single qstat run over several games hands every server back to its own game."""
+        output = self.spec_qstat_output.replace(b'</qstat>', b'<server type="Q4M" address="localhost:27650" status="UP" servers="1"></server>\n'
+                                                                 b'<server type="Q4S" address="localhost:28004" status="UP"><hostname>localhost:28004</hostname><name>C</name>'
+                                                                 b'<gametype>DM</gametype><map>q4dm1</map><numplayers>2</numplayers><maxplayers>16</maxplayers><ping>40</ping>'
+                                                                 b'<rules></rules><players></players></server>\n</qstat>')
+        qstat_process = mock.MagicMock(stdout=io.BytesIO(output))
+        games = {'q2': ({'name': 'Quake II'}, ['localhost:27900']), 'q4': ({'name': 'Quake 4'}, ['localhost:27650'])}
+        with mock.patch.object(adapters.qstat.qstat_process.subprocess, "Popen", return_value=qstat_process) as popen:
+            result = {}
+            for game, batch in adapters.qstat.stat_master_batch_iter(games):
+                result.setdefault(game, []).extend(batch)
+        self.assertEqual(popen.call_count, 1)
+        qstat_process.stdin.write.assert_called_once_with(b'Q2M localhost:27900\nQ4M localhost:27650')
+        self.assertEqual([entry['host'] for entry in result['q2']], ['localhost:27910', 'localhost:27911'])
+        self.assertEqual([(entry['host'], entry['game_id']) for entry in result['q4']], [('localhost:28004', 'q4')])
+        self.assertEqual(adapters.qstat.sim_budget.free, adapters.qstat.QSTAT_MAXSIM)
+
+    def test_plan_batches_separates_indistinguishable_games(self):
+        def config(server_type, game_type=None, parser='xml'):
+            return {'master_type': server_type + 'M', 'server_type': server_type, 'server_game_name': None, 'server_game_type': game_type, 'parser': parser}
+        game_configs = {'a': config('A2S', 'tf'), 'b': config('A2S', 'dod'), 'c': config('Q2S'), 'd': config('Q2S'), 'e': config('A2S'), 'f': config('Q4S', parser='raw')}
+        self.assertEqual(adapters.qstat.plan_batches(game_configs), [['a', 'b', 'c'], ['d', 'e'], ['f']])
+
+    def test_sim_budget_is_shared(self):
+        budget = adapters.qstat.SimBudget(512)
+        self.assertEqual(budget.acquire(300), 300)
+        self.assertEqual(budget.acquire(1000), 212)
+        token = helpers.CancelToken()
+        token.cancel()
+        self.assertEqual(budget.acquire(128, token), 0)
+        budget.release(300)
+        self.assertEqual(budget.acquire(128), 128)
+
+    def test_stat_servers_skips_masters(self):
+        qstat_process = mock.MagicMock(stdout=io.BytesIO(self.spec_qstat_output))
+        with mock.patch.object(adapters.qstat.qstat_process.subprocess, "Popen", return_value=qstat_process):
+            result = helpers.flatten_list(list(adapters.qstat.stat_servers_iter('q2', {'name': 'Quake II'}, ['localhost:27910', 'localhost:27911', 'localhost:27910'])))
+        qstat_process.stdin.write.assert_called_once_with(b'Q2S localhost:27910\nQ2S localhost:27911')
+        self.assertEqual([entry['host'] for entry in result], ['localhost:27910', 'localhost:27911'])
+
+    def test_player_lists_are_only_requested_for_details(self):
+        qstat_process = mock.MagicMock(stdout=io.BytesIO(self.spec_qstat_output))
+        with mock.patch.object(adapters.qstat.qstat_process.subprocess, "Popen", return_value=qstat_process) as popen:
+            adapters.qstat.stat_master('q2', {'name': 'Quake II'}, ['localhost:27900'])
+        self.assertIn("-R", popen.call_args[0][0])
+        self.assertNotIn("-P", popen.call_args[0][0])
+
+        qstat_process = mock.MagicMock(stdout=io.BytesIO(self.spec_qstat_output))
+        with mock.patch.object(adapters.qstat.qstat_process.subprocess, "Popen", return_value=qstat_process) as popen:
+            entry = adapters.qstat.stat_server_details('q2', {'name': 'Quake II'}, 'localhost:27910')
+        self.assertIn("-P", popen.call_args[0][0])
+        qstat_process.stdin.write.assert_called_once_with(b'Q2S localhost:27910')
+        self.assertEqual(entry['players'], [{'name': 'PlayerA', 'score': 3, 'ping': 20}])
+
+    spec_qstat_raw_output = ('Q2M\x1flocalhost:27900\x1f2\n'
+                             'Q2S\x1flocalhost:27910\x1f^1A\x1fq2dm1\x1f8\x1f1\x1f20\x1f0\x1faction\n'
+                             'needpass=1\n'
+                             'PlayerA\x1f3\x1f20\n'
+                             '\n'
+                             'Q2S\x1flocalhost:27911\x1fB\x1fq2dm2\x1f8\x1f0\x1f30\x1f0\x1faction\n'
+                             '\n'
+                             '\n'
+                             'Q2S\x1flocalhost:27912\x1fDOWN\n').encode()
+
+    def test_raw_parser_matches_xml_parser(self):
+        """Raw output split at arbitrary points gives the same server dicts as the XML output of the same servers."""
+        qstat = adapters.qstat
+        chunks = [self.spec_qstat_raw_output[i:i + 5] for i in range(0, len(self.spec_qstat_raw_output), 5)]
+        raw_entries = qstat.iter_qstat_raw_entries(chunks, ['Q2S'], ['Q2M'], players=True)
+        xml_entries = qstat.iter_qstat_entries([self.spec_qstat_output])
+        args = ('q2', 'Quake II', 'Q2M', 'Q2S', None, None)
+        self.assertEqual(list(qstat.adapt_qstat_entries(raw_entries, *args)), list(qstat.adapt_qstat_entries(xml_entries, *args)))
+
+    def test_raw_parser_is_selected_per_game(self):
+        qstat = adapters.qstat
+        game_config = dict(qstat.get_game_config('q2'), parser='raw')
+        qstat_process = mock.MagicMock(stdout=io.BytesIO(self.spec_qstat_raw_output))
+        with mock.patch.object(adapters.qstat.qstat_process.subprocess, "Popen", return_value=qstat_process) as popen, \
+                mock.patch.object(qstat, "get_game_config", return_value=game_config):
+            result = qstat.stat_master('q2', {'name': 'Quake II'}, ['localhost:27900'])
+        self.assertEqual(popen.call_args[0][0][:3], ["qstat", "-raw", qstat.QSTAT_RAW_DELIMITER])
+        self.assertEqual([(entry['host'], entry['name'], entry['password']) for entry in result],
+                         [('localhost:27910', 'A', True), ('localhost:27911', 'B', False)])
+
     def test_build_host_list_preserves_order_and_dedupes(self):
         """Masters must keep their configured order and be de-duplicated.
 
@@ -210,6 +343,60 @@ class QStatTests(unittest.TestCase):
                                   "live.example.net:27950"])
 
 
+class QStatProcessTests(unittest.TestCase):
+    """Tests for the qstat process pool. A Python interpreter stands in for qstat."""
+
+    def _make_pool(self, max_processes=1):
+        import sys
+        return qstat_process.QStatProcessPool(max_processes, executable=sys.executable)
+
+    def test_output_is_streamed_and_recorded(self):
+        pool = self._make_pool()
+        script = "import sys, time; sys.stdout.write(sys.stdin.read().upper() + '\\n'); sys.stdout.flush(); time.sleep(0.3); print('done')"
+        chunks = pool.run(["-c", script], b"q3m localhost")
+        first_chunk = next(chunks)
+        self.assertEqual(first_chunk, b"Q3M LOCALHOST\n")
+        self.assertEqual(len(pool.history), 0)  # Still running after the first chunk
+        self.assertEqual(b"".join(chunks), b"done\n")
+        invocation = pool.history[-1]
+        self.assertEqual((invocation.returncode, invocation.killed, invocation.bytes_read), (0, False, 19))
+        self.assertGreaterEqual(invocation.elapsed, 0.3)
+        self.assertEqual(pool.running, 0)
+
+    def test_timeout_and_cancel_kill_the_process(self):
+        pool = self._make_pool()
+        script = "import time; print('started', flush=True); time.sleep(30)"
+        start_time = time.monotonic()
+        self.assertEqual(b"".join(pool.run(["-c", script], b"", timeout=1)), b"started\n")
+        self.assertTrue(pool.history[-1].killed)
+
+        token = helpers.CancelToken()
+        chunks = pool.run(["-c", script], b"", token)
+        next(chunks)
+        token.cancel()
+        self.assertEqual(list(chunks), [])
+        self.assertTrue(pool.history[-1].killed)
+        self.assertNotEqual(pool.history[-1].returncode, 0)
+        self.assertLess(time.monotonic() - start_time, 10)
+
+    def test_process_count_is_capped(self):
+        pool = self._make_pool(max_processes=2)
+        peak = []
+
+        def run():
+            for chunk in pool.run(["-c", "import time; print('x', flush=True); time.sleep(0.2)"], b""):
+                peak.append(pool.running)
+
+        threads = [threading.Thread(target=run) for i in range(5)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join(10)
+        self.assertEqual(len(pool.history), 5)
+        self.assertLessEqual(max(peak), 2)
+        self.assertTrue(any(invocation.wait_time > 0.1 for invocation in pool.history))
+
+
 class RigsofrodsTests(unittest.TestCase):
     module = adapters.rigsofrods
 
@@ -362,6 +549,1314 @@ class GeoIPModuleTests(unittest.TestCase):
             self.assertFalse(os.path.exists(cache_db))
 
 
+class GameTableTests(unittest.TestCase):
+    """Tests for the Game Table accessors."""
+
+    spec_gameconfig = {'q3a': {'name': 'Quake III Arena', 'adapter': 'qstat',
+                               'launch_pattern': 'quake', 'settings': ['path', 'master_uri']},
+                       'minetest': {'name': 'Minetest', 'adapter': 'minetest',
+                                    'launch_pattern': 'minetest', 'settings': ['path']}}
+
+    def _make_table(self):
+        from obozrenie import core
+        return core.GameTable(self.spec_gameconfig)
+
+    def test_snapshot_is_shared_not_copied(self):
+        table = self._make_table()
+        table.set_servers_data('q3a', [{'host': '1.2.3.4:27960', 'name': 'A'}])
+        self.assertIs(table.get_servers_data('q3a'), table.get_servers_data('q3a'))
+
+    def test_held_snapshot_survives_writes(self):
+        table = self._make_table()
+        table.set_servers_data('q3a', [{'host': '1.2.3.4:27960', 'name': 'A'}])
+        snapshot = table.get_servers_snapshot('q3a')
+        table.set_servers_data('q3a', [{'host': '5.6.7.8:27960', 'name': 'B'}])
+        self.assertEqual([entry['host'] for entry in snapshot], ['1.2.3.4:27960'])
+        self.assertGreater(table.get_servers_snapshot('q3a').version, snapshot.version)
+
+    def test_writer_input_is_not_aliased(self):
+        table = self._make_table()
+        servers = [{'host': '1.2.3.4:27960', 'name': 'A'}]
+        table.set_servers_data('q3a', servers)
+        servers[0]['name'] = 'Changed'
+        self.assertEqual(table.get_servers_data('q3a')[0]['name'], 'A')
+
+    def test_writer_records_are_published_as_they_are(self):
+        from obozrenie import records
+        table = self._make_table()
+        record = records.ServerRecord(host='1.2.3.4:27960', name='A')
+        table.merge_servers_data('q3a', [record])
+        self.assertIs(table.get_servers_data('q3a')[0], record)
+        table.set_servers_data('q3a', [record, {'host': '5.6.7.8:27960', 'name': 'B'}])
+        servers = table.get_servers_data('q3a')
+        self.assertIs(servers[0], record)
+        self.assertIsInstance(servers[1], records.ServerRecord)
+
+    def test_settings_are_read_only_and_copy_on_write(self):
+        table = self._make_table()
+        settings = table.get_game_settings('q3a')
+        with self.assertRaises(TypeError):
+            settings['path'] = 'quake3'
+        table.set_game_setting('q3a', 'path', 'quake3')
+        self.assertEqual(settings['path'], '')
+        self.assertEqual(table.get_game_settings('q3a')['path'], 'quake3')
+
+    def test_server_info_lookup_by_host(self):
+        table = self._make_table()
+        table.set_servers_data('q3a', [{'host': '1.2.3.4:27960', 'name': 'A'},
+                                       {'host': '5.6.7.8:27960', 'name': 'B'}])
+        self.assertEqual(table.get_server_info('q3a', '5.6.7.8:27960')['name'], 'B')
+        self.assertIsNone(table.get_server_info('q3a', '9.9.9.9:27960'))
+
+    def test_set_server_info_touches_single_entry(self):
+        table = self._make_table()
+        table.set_servers_data('q3a', [{'host': '1.2.3.4:27960', 'name': 'A'},
+                                       {'host': '5.6.7.8:27960', 'name': 'B'}])
+        untouched = table.get_server_info('q3a', '1.2.3.4:27960')
+        table.set_server_info('q3a', '5.6.7.8:27960', {'name': 'C'})
+        table.set_server_info('q3a', '9.9.9.9:27960', {'name': 'D'})
+        self.assertIs(table.get_server_info('q3a', '1.2.3.4:27960'), untouched)
+        self.assertEqual(table.get_server_info('q3a', '5.6.7.8:27960')['name'], 'C')
+        self.assertEqual([entry['host'] for entry in table.get_servers_data('q3a')],
+                         ['1.2.3.4:27960', '5.6.7.8:27960', '9.9.9.9:27960'])
+
+    def test_replaced_entries_match_a_rebuilt_list(self):
+        """Snapshots made by replace, including ones folded into a new base, list the same servers as a list rebuilt from scratch."""
+        from obozrenie import core
+        expectation = [{'host': '10.0.0.%i:27960' % i, 'name': str(i)} for i in range(10)]
+        first = core.ServerSnapshot(0, expectation)
+        snapshot = first
+        for i in range(40):
+            entry = {'host': '10.0.0.%i:27960' % (i * 7 % 15), 'name': 'r%i' % i}
+            if entry['host'] in snapshot:
+                self.assertEqual(list(snapshot.replace(entry['host'], entry).diff.changed), [entry])
+                expectation[[server['host'] for server in expectation].index(entry['host'])] = entry
+            else:
+                expectation.append(entry)
+            snapshot = snapshot.replace(entry['host'], entry)
+            self.assertEqual(len(snapshot), len(expectation))
+            self.assertIs(snapshot.get(entry['host']), entry)
+        self.assertEqual(list(snapshot), expectation)
+        self.assertEqual(snapshot.servers, core.ServerSnapshot(0, expectation).servers)
+        self.assertEqual(snapshot.index, core.ServerSnapshot(0, expectation).index)
+        self.assertEqual(snapshot.version, 40)
+        self.assertEqual([entry['name'] for entry in first], [str(i) for i in range(10)])
+
+    def test_readers_do_not_wait_for_writers(self):
+        table = self._make_table()
+        table.set_servers_data('q3a', [{'host': '1.2.3.4:27960', 'name': 'A'}])
+        locked = threading.Event()
+        release = threading.Event()
+
+        def writer():
+            with table._get_game_entry('q3a'):
+                locked.set()
+                release.wait(5)
+
+        thread = threading.Thread(target=writer)
+        thread.start()
+        locked.wait(5)
+        try:
+            self.assertEqual(len(table.get_servers_data('q3a')), 1)
+            table.set_servers_data('minetest', [{'host': '5.6.7.8:30000', 'name': 'B'}])
+        finally:
+            release.set()
+            thread.join()
+        self.assertEqual(table.get_lock_stats()['minetest']['contentions'], 0)
+
+    def test_lock_contention_is_counted(self):
+        lock = helpers.ContentionLock()
+        locked = threading.Event()
+
+        def holder():
+            with lock:
+                locked.set()
+                time.sleep(0.05)
+
+        thread = threading.Thread(target=holder)
+        thread.start()
+        locked.wait(5)
+        with lock:
+            pass
+        thread.join()
+        stats = lock.get_stats()
+        self.assertEqual(stats['acquisitions'], 2)
+        self.assertEqual(stats['contentions'], 1)
+        self.assertGreater(stats['wait_time'], 0)
+
+    def test_unknown_game_raises_value_error(self):
+        table = self._make_table()
+        with self.assertRaises(ValueError):
+            table.get_servers_data('nonexistent')
+
+
+class ServerRecordTests(unittest.TestCase):
+    """Tests for the slotted server record."""
+
+    def test_record_behaves_like_server_dict(self):
+        from obozrenie import records
+        spec_dict = {'host': '1.2.3.4:27960', 'name': 'A', 'ping': 50, 'rules': {}, 'players': []}
+        record = records.ServerRecord(spec_dict)
+        self.assertEqual(record, spec_dict)
+        self.assertEqual(record.as_dict(), spec_dict)
+        self.assertEqual(record.get('country'), None)
+        self.assertNotIn('country', record)
+        record['country'] = 'DE'
+        self.assertEqual(record['country'], 'DE')
+
+    def test_record_rejects_unknown_fields(self):
+        from obozrenie import records
+        record = records.ServerRecord()
+        with self.assertRaises(KeyError):
+            record['nonexistent'] = 1
+        with self.assertRaises(KeyError):
+            record['nonexistent']
+
+    def test_record_has_no_instance_dict(self):
+        from obozrenie import records
+        self.assertFalse(hasattr(records.ServerRecord(host='1.2.3.4:27960'), '__dict__'))
+
+    def test_game_table_stores_records(self):
+        from obozrenie import core, records
+        table = core.GameTable(GameTableTests.spec_gameconfig)
+        table.set_servers_data('q3a', [{'host': '1.2.3.4:27960', 'name': 'A'}])
+        self.assertIsInstance(table.get_server_info('q3a', '1.2.3.4:27960'), records.ServerRecord)
+
+
+class ServerListDiffTests(unittest.TestCase):
+    """Tests for server list diffing."""
+
+    def test_diff_by_host(self):
+        from obozrenie import records
+        old = [{'host': 'a:1', 'ping': 10}, {'host': 'b:1', 'ping': 20}, {'host': 'c:1', 'ping': 30}]
+        new = [{'host': 'a:1', 'ping': 10}, {'host': 'b:1', 'ping': 25}, {'host': 'd:1', 'ping': 40}]
+        diff = records.diff_server_lists(old, new)
+        self.assertEqual([entry['host'] for entry in diff.added], ['d:1'])
+        self.assertEqual(list(diff.removed), ['c:1'])
+        self.assertEqual([entry['host'] for entry in diff.changed], ['b:1'])
+
+    def test_identical_lists_give_empty_diff(self):
+        from obozrenie import records
+        servers = [{'host': 'a:1', 'ping': 10}]
+        self.assertFalse(records.diff_server_lists(servers, [dict(servers[0])]))
+
+    def test_unchanged_refresh_keeps_generation(self):
+        from obozrenie import core
+        table = core.GameTable(GameTableTests.spec_gameconfig)
+        table.set_servers_data('q3a', [{'host': 'a:1', 'ping': 10}])
+        generation = table.get_servers_generation('q3a')
+        self.assertFalse(table.set_servers_data('q3a', [{'host': 'a:1', 'ping': 10}]))
+        self.assertEqual(table.get_servers_generation('q3a'), generation)
+        _, diff = table.get_servers_diff('q3a', generation)
+        self.assertFalse(diff)
+
+    def test_game_table_reports_delta_since_generation(self):
+        from obozrenie import core
+        table = core.GameTable(GameTableTests.spec_gameconfig)
+        table.set_servers_data('q3a', [{'host': 'a:1', 'ping': 10}])
+        generation = table.get_servers_generation('q3a')
+        table.set_servers_data('q3a', [{'host': 'a:1', 'ping': 15}, {'host': 'b:1', 'ping': 20}])
+        snapshot, diff = table.get_servers_diff('q3a', generation)
+        self.assertEqual(len(diff.changed), 1)
+        self.assertEqual(len(diff.added), 1)
+        self.assertIsNone(table.get_servers_diff('q3a', generation - 1)[1])
+
+
+class QueryExecutorTests(unittest.TestCase):
+    """Tests for the bounded query executor."""
+
+    def test_duplicate_requests_are_coalesced(self):
+        from obozrenie import scheduler
+        started = threading.Event()
+        release = threading.Event()
+        calls = []
+
+        def target(game):
+            calls.append(game)
+            started.set()
+            release.wait(5)
+
+        executor = scheduler.QueryExecutor(target, 2)
+        results = []
+        job = executor.submit('q3a', results.append)
+        started.wait(5)
+        self.assertIs(executor.submit('q3a', results.append), job)
+        release.set()
+        self.assertTrue(job.wait(5))
+        self.assertEqual(calls, ['q3a'])
+        self.assertEqual(results, ['q3a', 'q3a'])
+
+    def test_concurrency_is_capped(self):
+        from obozrenie import scheduler
+        lock = threading.Lock()
+        running = []
+        peak = []
+
+        def target(game):
+            with lock:
+                running.append(game)
+                peak.append(len(running))
+            time.sleep(0.02)
+            with lock:
+                running.remove(game)
+
+        executor = scheduler.QueryExecutor(target, 2)
+        jobs = [executor.submit('game%i' % i) for i in range(8)]
+        for job in jobs:
+            self.assertTrue(job.wait(5))
+        self.assertLessEqual(max(peak), 2)
+
+
+class QuerySchedulerTests(unittest.TestCase):
+    """Tests for query priorities and refresh-all."""
+
+    def _run_blocked(self, submissions, max_workers=1):
+        """Submits jobs while a blocker occupies the workers and returns the order they ran in."""
+        from obozrenie import scheduler
+        release = threading.Event()
+        order = []
+
+        def target(game):
+            if game == 'blocker':
+                release.wait(5)
+            else:
+                order.append(game)
+
+        executor = scheduler.QueryExecutor(target, max_workers)
+        executor.submit('blocker')
+        jobs = [executor.submit(game, priority=priority, group=group) for game, priority, group in submissions]
+        release.set()
+        for job in jobs:
+            self.assertTrue(job.wait(5))
+        return order
+
+    def test_jobs_are_served_by_priority(self):
+        from obozrenie import scheduler
+        order = self._run_blocked([('rest', scheduler.PRIORITY.BACKGROUND, 'qstat'),
+                                   ('recent', scheduler.PRIORITY.ACTIVE, 'qstat'),
+                                   ('viewed', scheduler.PRIORITY.VIEWED, 'qstat')])
+        self.assertEqual(order, ['viewed', 'recent', 'rest'])
+
+    def test_groups_are_interleaved(self):
+        from obozrenie import scheduler
+        background = scheduler.PRIORITY.BACKGROUND
+        releases = {'slow-qstat': threading.Event(), 'slow-other': threading.Event()}
+        order = []
+
+        def target(game):
+            if game in releases:
+                releases[game].wait(5)
+            else:
+                order.append(game)
+
+        executor = scheduler.QueryExecutor(target, 2)
+        executor.submit('slow-qstat', group='qstat')
+        executor.submit('slow-other', group='other')
+        jobs = [executor.submit(game, priority=background, group=group)
+                for game, group in (('q1', 'qstat'), ('q2', 'qstat'), ('h1', 'minetest'))]
+        # One worker frees up while a qstat game is still running: the HTTP game goes next
+        releases['slow-other'].set()
+        jobs[2].wait(5)
+        releases['slow-qstat'].set()
+        for job in jobs:
+            self.assertTrue(job.wait(5))
+        self.assertEqual(order[0], 'h1')
+
+    def test_jobs_of_batch_groups_run_together(self):
+        from obozrenie import scheduler
+        release = threading.Event()
+        runs = []
+
+        def target(game):
+            if game == 'blocker':
+                release.wait(5)
+            else:
+                runs.append([game])
+
+        executor = scheduler.QueryExecutor(target, 1, batch_target=runs.append, batch_groups=['qstat'])
+        executor.submit('blocker')
+        background = scheduler.PRIORITY.BACKGROUND
+        jobs = [executor.submit('q2', priority=background, group='qstat'),
+                executor.submit('q4', priority=background, group='qstat'),
+                executor.submit('minetest', priority=background, group='minetest'),
+                executor.submit('viewed', priority=scheduler.PRIORITY.VIEWED, group='qstat')]
+        release.set()
+        for job in jobs:
+            self.assertTrue(job.wait(5))
+        self.assertEqual(sorted(map(sorted, runs)), [['minetest'], ['q2', 'q4'], ['viewed']])
+
+    def test_refresh_all_reports_progress(self):
+        from obozrenie import core
+        c = core.Core()
+        refreshed = []
+        progress = []
+        with mock.patch.object(c, 'stat_master_target', side_effect=refreshed.append):
+            c.query_executor.target = c.stat_master_target
+            c.query_executor.batch_target = refreshed.extend
+            refresh = c.refresh_all(progress_callback=progress.append)
+            self.assertTrue(refresh.wait(5))
+        self.assertEqual(sorted(refreshed), sorted(c.game_table.get_game_set()))
+        self.assertEqual(len(progress), refresh.total)
+        self.assertEqual(refresh.completed, refresh.total)
+        self.assertGreaterEqual(refresh.elapsed, 0)
+
+
+class AutoRefresherTests(unittest.TestCase):
+    """Tests for adaptive background refresh."""
+
+    def _make_refresher(self, submit=None):
+        from obozrenie import scheduler
+        return scheduler.AutoRefresher(submit or (lambda game: None), 100, 10, 1000)
+
+    def test_calm_lists_back_off_busy_lists_speed_up(self):
+        from obozrenie import records
+        refresher = self._make_refresher()
+        refresher.watch('calm')
+        refresher.watch('busy')
+        refresher.report('calm', records.ServerListDiff(), 100)
+        refresher.report('busy', records.ServerListDiff(changed=[{'host': str(i)} for i in range(50)]), 100)
+        self.assertGreater(refresher.get_interval('calm'), 100)
+        self.assertLess(refresher.get_interval('busy'), 100)
+
+    def test_interval_stays_within_bounds(self):
+        from obozrenie import records
+        refresher = self._make_refresher()
+        refresher.watch('calm')
+        for i in range(20):
+            refresher.report('calm', records.ServerListDiff(), 100)
+        self.assertEqual(refresher.get_interval('calm'), 1000)
+
+    def test_errors_do_not_change_base_interval(self):
+        refresher = self._make_refresher()
+        refresher.watch('broken')
+        refresher.report('broken', error=True)
+        self.assertEqual(refresher.get_interval('broken'), 100)
+
+    def test_due_games_are_submitted_unless_paused(self):
+        submitted = threading.Event()
+        refresher = self._make_refresher(lambda game: submitted.set())
+        refresher.initial_interval = 0
+        refresher.pause()
+        refresher.start()
+        try:
+            refresher.watch('q3a')
+            self.assertFalse(submitted.wait(0.1))
+            refresher.resume()
+            self.assertTrue(submitted.wait(5))
+        finally:
+            refresher.stop()
+
+    def test_abandoned_games_are_refreshed_again(self):
+        submitted = []
+        resubmitted = threading.Event()
+
+        def submit(game):
+            submitted.append(game)
+            if len(submitted) > 1:
+                resubmitted.set()
+
+        refresher = self._make_refresher(submit)
+        refresher.initial_interval = 0
+        refresher.start()
+        try:
+            refresher.watch('q3a')
+            for i in range(50):
+                if submitted:
+                    break
+                time.sleep(0.01)
+            refresher.abandon('q3a')
+            self.assertTrue(resubmitted.wait(5))
+        finally:
+            refresher.stop()
+
+    def test_cancelled_queries_are_abandoned(self):
+        from obozrenie import core
+        c = core.Core()
+        c.set_query_concurrency(0)
+        with mock.patch.object(c.auto_refresher, "abandon") as abandon:
+            c.update_server_list('q3a', priority=0)
+            c.cancel_query('q3a')
+            token = helpers.CancelToken()
+            token.cancel()
+            c._finish_query('q3a', c.game_table.get_servers_snapshot('q3a'), [], token)
+        self.assertEqual(abandon.call_args_list, [mock.call('q3a'), mock.call('q3a')])
+
+
+class ServerCacheTests(unittest.TestCase):
+    """Tests for the on-disk server list cache."""
+
+    spec_servers = [{'host': '1.2.3.4:27960', 'name': 'A', 'ping': 50, 'player_count': 1,
+                     'player_limit': 16, 'rules': {'g_needpass': '0'}, 'players': [{'name': 'PlayerA'}]},
+                    {'host': '5.6.7.8:27960', 'name': 'B', 'ping': 70}]
+
+    def test_save_then_load_round_trip(self):
+        from obozrenie import server_cache
+        with tempfile.TemporaryDirectory() as d:
+            with mock.patch.object(server_cache, "CACHE_DIR", d):
+                server_cache.save_servers('q3a', self.spec_servers)
+                self.assertEqual(server_cache.load_servers('q3a'), self.spec_servers)
+
+    def test_other_schema_is_ignored(self):
+        from obozrenie import server_cache
+        with tempfile.TemporaryDirectory() as d:
+            with mock.patch.object(server_cache, "CACHE_DIR", d):
+                server_cache.save_servers('q3a', self.spec_servers)
+                with mock.patch.object(server_cache, "SCHEMA_VERSION", server_cache.SCHEMA_VERSION + 1):
+                    self.assertIsNone(server_cache.load_servers('q3a'))
+                self.assertIsNone(server_cache.load_servers('missing'))
+
+    def test_cached_servers_are_stale_until_refreshed(self):
+        from obozrenie import core, server_cache
+        with tempfile.TemporaryDirectory() as d:
+            with mock.patch.object(server_cache, "CACHE_DIR", d):
+                server_cache.save_servers('q3a', self.spec_servers)
+                c = core.Core()
+                self.assertTrue(c.load_cached_servers('q3a'))
+                self.assertTrue(c.game_table.get_servers_snapshot('q3a').stale)
+                c.game_table.set_servers_data('q3a', self.spec_servers)
+                self.assertFalse(c.game_table.get_servers_snapshot('q3a').stale)
+
+    def test_rtt_cache_is_persisted(self):
+        from obozrenie import core, ping, server_cache
+        with tempfile.TemporaryDirectory() as d:
+            with mock.patch.object(server_cache, "CACHE_DIR", d), \
+                    mock.patch.object(ping, "service", ping.PingService()):
+                c = core.Core()
+                ping.service.cache.update({'1.2.3.4': ping.PingStats(50, 45, 5, 33)})
+                ping.service.cache.update({'5.6.7.8': ping.PingStats(70, 70, 0, 0)}, time.time() - ping.service.cache.ttl)
+                c.save_rtt_cache()
+                self.assertEqual([entry[:2] for entry in server_cache.load_rtt()], [('1.2.3.4', [50, 45, 5, 33])])
+
+                ping.service.cache.clear()
+                core.Core()
+                self.assertEqual(ping.service.cache.get_many(['1.2.3.4']), {'1.2.3.4': ping.PingStats(50, 45, 5, 33)})
+
+
+class StreamingQueryTests(unittest.TestCase):
+    """Tests for publishing partial query results."""
+
+    def test_merge_keeps_unlisted_servers(self):
+        from obozrenie import core
+        table = core.GameTable(GameTableTests.spec_gameconfig)
+        table.set_servers_data('q3a', [{'host': '1.2.3.4:27960', 'name': 'A'},
+                                       {'host': '5.6.7.8:27960', 'name': 'B'}])
+        diff = table.merge_servers_data('q3a', [{'host': '5.6.7.8:27960', 'name': 'C'},
+                                                {'host': '9.9.9.9:27960', 'name': 'D'}])
+        self.assertEqual([entry['host'] for entry in diff.added], ['9.9.9.9:27960'])
+        self.assertEqual([entry['host'] for entry in diff.changed], ['5.6.7.8:27960'])
+        self.assertEqual([entry['name'] for entry in table.get_servers_data('q3a')], ['A', 'C', 'D'])
+        version = table.get_servers_generation('q3a')
+        self.assertFalse(table.merge_servers_data('q3a', [{'host': '9.9.9.9:27960', 'name': 'D'}]))
+        self.assertEqual(table.get_servers_generation('q3a'), version)
+
+    def test_batches_are_published_before_query_ends(self):
+        from obozrenie import adapters, core, server_cache
+        c = core.Core()
+        c.game_table.set_servers_data('q3a', [{'host': '9.9.9.9:27960', 'name': 'Gone'}])
+        seen = []
+
+        def stat_master_iter(game, game_info, master_list, token):
+            yield [{'host': '1.2.3.4:27960', 'name': 'A'}]
+            yield [{'host': '5.6.7.8:27960', 'name': 'B'}]
+
+        def partial_results_callback(game):
+            seen.append([entry['name'] for entry in c.game_table.get_servers_data(game)])
+
+        c.partial_results_callback = partial_results_callback
+        fake_adapter = types.SimpleNamespace(stat_master_iter=stat_master_iter)
+        with tempfile.TemporaryDirectory() as d:
+            with mock.patch.object(server_cache, "CACHE_DIR", d), \
+                    mock.patch.dict(adapters.adapter_table, {c.game_table.get_game_info('q3a')['adapter']: fake_adapter}):
+                c.stat_master_target('q3a')
+        self.assertEqual(seen, [['Gone', 'A'], ['Gone', 'A', 'B']])
+        self.assertEqual([entry['name'] for entry in c.game_table.get_servers_data('q3a')], ['A', 'B'])
+        self.assertEqual(c.game_table.get_query_status('q3a'), c.game_table.QUERY_STATUS.READY)
+
+    def test_plain_adapters_yield_single_batch(self):
+        from obozrenie import adapters
+        fake_adapter = types.SimpleNamespace(stat_master=lambda game, game_info, master_list: [{'host': '1.2.3.4:27960'}])
+        with mock.patch.dict(adapters.adapter_table, {'fake': fake_adapter}):
+            self.assertEqual(list(adapters.stat_master_iter('fake', 'q3a', {}, [])), [[{'host': '1.2.3.4:27960'}]])
+
+
+class QueryCancellationTests(unittest.TestCase):
+    """Tests for cancelling queries and query deadlines."""
+
+    spec_old_servers = [{'host': '9.9.9.9:27960', 'name': 'Old'}]
+
+    def _run_query(self, c, stat_master_iter):
+        from obozrenie import adapters, server_cache
+        fake_adapter = types.SimpleNamespace(stat_master_iter=stat_master_iter)
+        with tempfile.TemporaryDirectory() as d:
+            with mock.patch.object(server_cache, "CACHE_DIR", d), \
+                    mock.patch.dict(adapters.adapter_table, {c.game_table.get_game_info('q3a')['adapter']: fake_adapter}):
+                c.stat_master_target('q3a')
+        return sorted(entry['name'] for entry in c.game_table.get_servers_data('q3a'))
+
+    def test_token_deadline(self):
+        token = helpers.CancelToken(0)
+        self.assertTrue(token.expired)
+        self.assertFalse(token.cancelled)
+        self.assertEqual(token.remaining(10), 0)
+        self.assertEqual(helpers.CancelToken().remaining(10), 10)
+        self.assertIsNone(helpers.CancelToken().remaining())
+
+    def test_token_cancel_callbacks_run_once(self):
+        token = helpers.CancelToken()
+        calls = []
+        token.on_cancel(lambda: calls.append('before'))
+        token.cancel()
+        token.cancel()
+        token.on_cancel(lambda: calls.append('after'))
+        self.assertEqual(calls, ['before', 'after'])
+        self.assertTrue(token.stopped)
+
+    def test_child_tokens(self):
+        token = helpers.CancelToken(60)
+        child = token.child()
+        other = token.child()
+        self.assertEqual(child.deadline, token.deadline)
+        child.cancel()
+        self.assertFalse(token.cancelled or other.cancelled)
+        token.cancel()
+        self.assertTrue(other.cancelled)
+        self.assertAlmostEqual(helpers.CancelToken(60, deadline=time.monotonic() + 1).remaining(10), 1, places=1)
+
+    def test_restart_joins_an_up_to_date_query(self):
+        """Asking for a refresh again only restarts a running one when its settings have changed or it has run for a while."""
+        from obozrenie import core
+        c = core.Core()
+        c.set_query_concurrency(0)
+        token = helpers.CancelToken()
+        c._begin_query('q3a', token)
+        c.update_server_list('q3a', restart=True)
+        self.assertFalse(token.cancelled)
+        c.game_table.set_game_setting('q3a', 'master_uri', ['master://master.example.net:27950'])
+        c.update_server_list('q3a', restart=True)
+        self.assertTrue(token.cancelled)
+        c._end_query('q3a', token)
+
+        c.game_table.set_query_status('q3a', c.game_table.QUERY_STATUS.READY)
+        token = helpers.CancelToken()
+        c._begin_query('q3a', token)
+        with mock.patch.object(core, "QUERY_RESTART_AGE", 0):
+            c.update_server_list('q3a', restart=True)
+        self.assertTrue(token.cancelled)
+
+    def test_cancelling_a_game_of_a_batch(self):
+        from obozrenie import adapters, core, server_cache
+        c = core.Core()
+        run_tokens = []
+
+        def stat_master_batch_iter(games, token, server_lists):
+            run_tokens.append(token)
+            yield 'q2', [{'host': '1.2.3.4:27910', 'name': 'A'}]
+            c.cancel_query('q2')
+            self.assertFalse(token.stopped)
+            yield 'q2', [{'host': '1.2.3.5:27910', 'name': 'B'}]
+            yield 'q4', [{'host': '5.6.7.8:27650', 'name': 'C'}]
+            c.cancel_query('q4')
+            self.assertTrue(token.cancelled)
+
+        fake_adapter = types.SimpleNamespace(stat_master_batch_iter=stat_master_batch_iter)
+        with tempfile.TemporaryDirectory() as d:
+            with mock.patch.object(server_cache, "CACHE_DIR", d), \
+                    mock.patch.dict(adapters.adapter_table, {'qstat': fake_adapter}):
+                c.stat_master_batch_target(['q2', 'q4'])
+        self.assertEqual(len(run_tokens), 1)
+        self.assertEqual([entry['name'] for entry in c.game_table.get_servers_data('q2')], ['A'])
+        self.assertEqual([entry['name'] for entry in c.game_table.get_servers_data('q4')], ['C'])
+        self.assertEqual(c.game_table.get_query_status('q2'), c.game_table.QUERY_STATUS.READY)
+
+    def test_cancelled_query_keeps_partial_results(self):
+        from obozrenie import core
+        c = core.Core()
+        c.game_table.set_servers_data('q3a', self.spec_old_servers)
+
+        def stat_master_iter(game, game_info, master_list, token):
+            yield [{'host': '1.2.3.4:27960', 'name': 'A'}]
+            c.cancel_query(game)
+            self.assertTrue(token.cancelled)
+            yield [{'host': '5.6.7.8:27960', 'name': 'B'}]
+            yield [{'host': '5.6.7.9:27960', 'name': 'C'}]
+
+        self.assertEqual(self._run_query(c, stat_master_iter), ['A', 'B', 'Old'])
+        self.assertEqual(c.game_table.get_query_status('q3a'), c.game_table.QUERY_STATUS.READY)
+        self.assertEqual(c.query_tokens, {})
+
+    def test_deadline_keeps_unseen_servers(self):
+        from obozrenie import core
+        c = core.Core()
+        c.game_table.set_servers_data('q3a', self.spec_old_servers)
+
+        def stat_master_iter(game, game_info, master_list, token):
+            self.assertTrue(token.expired)
+            yield [{'host': '1.2.3.4:27960', 'name': 'A'}]
+
+        with mock.patch.object(core, "QUERY_DEADLINE", 0):
+            self.assertEqual(self._run_query(c, stat_master_iter), ['A', 'Old'])
+
+    def test_minetest_stops_between_masters(self):
+        from obozrenie.adapters import minetest
+        token = helpers.CancelToken()
+
+        def get_json(master_uri, timeout):
+            token.cancel()
+            return []
+
+        with mock.patch.object(minetest, "get_json", side_effect=get_json) as get_json_mock:
+            self.assertEqual(minetest.stat_master('minetest', {}, ['http://a', 'http://b'], token), [])
+        self.assertEqual(get_json_mock.call_count, 1)
+
+    def test_queued_query_is_dropped(self):
+        from obozrenie import scheduler
+        release = threading.Event()
+        started = []
+
+        def target(game):
+            started.append(game)
+            release.wait(5)
+
+        executor = scheduler.QueryExecutor(target, 1)
+        executor.submit('blocker')
+        finished = []
+        job = executor.submit('q3a', callback=finished.append)
+        self.assertTrue(executor.cancel('q3a'))
+        self.assertTrue(job.wait(5))
+        release.set()
+        self.assertEqual(finished, ['q3a'])
+        self.assertNotIn('q3a', started)
+
+    def test_restart_waits_for_running_query(self):
+        from obozrenie import scheduler
+        release = threading.Event()
+        started = threading.Event()
+        running = []
+        overlaps = []
+
+        def target(game):
+            if running:
+                overlaps.append(game)
+            running.append(game)
+            started.set()
+            release.wait(5)
+            running.remove(game)
+
+        executor = scheduler.QueryExecutor(target, 2)
+        first = executor.submit('q3a')
+        started.wait(5)
+        second = executor.submit('q3a', restart=True)
+        self.assertIsNot(first, second)
+        release.set()
+        self.assertTrue(second.wait(5))
+        self.assertEqual(overlaps, [])
+
+
+def build_a2s_info(name, game_dir, players, password=False):
+    """Builds an A2S_INFO response like a Source server would send it."""
+    return (b'\xff\xff\xff\xffI\x11' + name.encode() + b'\x00de_dust2\x00' + game_dir.encode() + b'\x00Counter-Strike\x00' +
+            struct.pack('<H', 730) + bytes((players, 32, 0)) + b'dl' + bytes((int(password), 1)) + b'1.0.0.0\x00' +
+            b'\x80' + struct.pack('<H', 27015))
+
+
+class FakeA2SServer(threading.Thread):
+    """Local stand-in for a Source server. Answers A2S_INFO, and A2S_PLAYER if given players, after a challenge handshake and can ignore the first requests."""
+
+    def __init__(self, info, challenge=True, drop=0, players=None):
+        super().__init__(daemon=True)
+        self.info = info
+        self.players = players
+        self.challenge = challenge
+        self.drop = drop
+        self.requests = 0
+        self.sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        self.sock.bind(('127.0.0.1', 0))
+        self.address = "127.0.0.1:%i" % self.sock.getsockname()[1]
+
+    def run(self):
+        while True:
+            try:
+                data, addr = self.sock.recvfrom(1400)
+            except OSError:
+                return
+            self.requests += 1
+            if self.requests <= self.drop:
+                continue
+            if self.challenge and not data.endswith(b'\x01\x02\x03\x04'):
+                self.sock.sendto(b'\xff\xff\xff\xffA\x01\x02\x03\x04', addr)
+            elif data.startswith(b'\xff\xff\xff\xffU'):
+                if self.players is not None:
+                    response = b'\xff\xff\xff\xffD' + bytes((len(self.players),))
+                    for i, (name, score) in enumerate(self.players):
+                        response += bytes((i,)) + name.encode() + b'\x00' + struct.pack('<lf', score, 60.0)
+                    self.sock.sendto(response, addr)
+            else:
+                self.sock.sendto(self.info, addr)
+
+    def close(self):
+        self.sock.close()
+
+
+class FakeSteamMaster(threading.Thread):
+    """Local stand-in for a Steam master server. Serves its listing in pages and logs what it was asked for."""
+
+    def __init__(self, addresses, page_size=2, page_delay=0):
+        super().__init__(daemon=True)
+        self.addresses = addresses
+        self.page_size = page_size
+        self.page_delay = page_delay
+        self.log = []
+        self.sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        self.sock.bind(('127.0.0.1', 0))
+        self.address = "127.0.0.1:%i" % self.sock.getsockname()[1]
+
+    def run(self):
+        while True:
+            try:
+                data, addr = self.sock.recvfrom(1400)
+            except OSError:
+                return
+            seed, filter_string = data[2:].split(b'\x00')[:2]
+            self.log.append(('page', seed.decode(), filter_string.decode(), data[1]))
+            start = 0 if seed == b'0.0.0.0:0' else self.addresses.index(seed.decode()) + 1
+            page = self.addresses[start:start + self.page_size]
+            if start + self.page_size >= len(self.addresses):
+                page = page + ['0.0.0.0:0']
+            if start > 0:
+                time.sleep(self.page_delay)
+            response = b'\xff\xff\xff\xff\x66\x0a'
+            for address in page:
+                ip, port = address.split(':')
+                response += socket.inet_aton(ip) + struct.pack('>H', int(port))
+            self.sock.sendto(response, addr)
+
+    def close(self):
+        self.sock.close()
+
+
+class A2STests(unittest.TestCase):
+    """Tests for the native A2S adapter."""
+
+    def _query(self, addresses, **client_args):
+        from obozrenie.adapters import a2s
+
+        async def query():
+            client = a2s.A2SClient(**client_args)
+            await client.open()
+            try:
+                return [result async for result in client.query_many(addresses)]
+            finally:
+                client.close()
+
+        return asyncio.run(query())
+
+    def test_parse_info(self):
+        from obozrenie.adapters import a2s
+        info = a2s.parse_info(build_a2s_info('Server A', 'csgo', 5, password=True)[5:])
+        entry = a2s.adapt_server_entry('1.2.3.4:27015', info, 0.0421, 'csgo')
+        self.assertEqual(info['port'], 27015)
+        self.assertEqual((entry['name'], entry['game_type'], entry['game_name'], entry['terrain']),
+                         ('Server A', 'csgo', 'Counter-Strike', 'de_dust2'))
+        self.assertEqual((entry['player_count'], entry['player_limit'], entry['ping']), (5, 32, 42))
+        self.assertTrue(entry['password'])
+        self.assertTrue(entry['secure'])
+
+    def test_challenge_retries_and_silent_servers(self):
+        servers = [FakeA2SServer(build_a2s_info('Challenged', 'csgo', 1)),
+                   FakeA2SServer(build_a2s_info('Lossy', 'csgo', 2), challenge=False, drop=1),
+                   FakeA2SServer(b'', drop=100)]
+        for server in servers:
+            server.start()
+        try:
+            results = self._query([server.address for server in servers] + [servers[0].address],
+                                  timeout=0.2, retries=1, max_in_flight=2)
+        finally:
+            for server in servers:
+                server.close()
+        self.assertEqual(sorted(info['name'] for address, info, rtt in results), ['Challenged', 'Lossy'])
+        self.assertTrue(all(rtt >= 0 for address, info, rtt in results))
+        self.assertEqual(servers[0].requests, 2)  # Queried once despite being listed twice
+        self.assertEqual(servers[2].requests, 2)  # Gave up after the retry
+
+    def test_master_pages_are_pipelined(self):
+        """Servers of the first page are queried while the master is still serving the rest of the listing."""
+        from obozrenie.adapters import a2s
+        servers = [FakeA2SServer(build_a2s_info('Server %i' % i, 'csgo', i)) for i in range(5)]
+        master = FakeSteamMaster([server.address for server in servers], page_size=2, page_delay=0.3)
+        for thread in servers + [master]:
+            thread.start()
+        try:
+            with mock.patch.object(a2s, "A2S_BATCH_INTERVAL", 0):
+                batches = []
+                for batch in a2s.stat_master_iter('csgo', {'name': 'CS:GO'}, ['master://' + master.address]):
+                    batches.append((batch, len(master.log)))
+        finally:
+            for thread in servers + [master]:
+                thread.close()
+        self.assertEqual(sorted(entry['name'] for batch, pages in batches for entry in batch),
+                         ['Server %i' % i for i in range(5)])
+        self.assertLess(batches[0][1], 3)  # First server was in before the last page was asked for
+        self.assertEqual([entry[1] for entry in master.log], ['0.0.0.0:0', servers[1].address, servers[3].address])
+        self.assertEqual({(entry[2], entry[3]) for entry in master.log}, {('\\gamedir\\csgo', 0xFF)})
+
+    def test_server_details_include_players(self):
+        from obozrenie.adapters import a2s
+        server = FakeA2SServer(build_a2s_info('Server A', 'csgo', 2), players=[('PlayerA', 12), ('PlayerB', -1)])
+        server.start()
+        try:
+            entry = a2s.stat_server_details('csgo', {'name': 'CS:GO'}, server.address)
+        finally:
+            server.close()
+        self.assertEqual(entry['name'], 'Server A')
+        self.assertEqual(entry['players'], [{'name': 'PlayerA', 'score': 12, 'ping': 9999},
+                                            {'name': 'PlayerB', 'score': -1, 'ping': 9999}])
+
+    def test_server_details_respect_the_deadline(self):
+        """A silent server is given up on at the deadline of the token, not after every retry and handshake has timed out."""
+        from obozrenie.adapters import a2s
+        server = FakeA2SServer(b'', drop=100)
+        server.start()
+        try:
+            start_time = time.monotonic()
+            entry = a2s.stat_server_details('csgo', {'name': 'CS:GO'}, server.address, helpers.CancelToken(0.3))
+            elapsed = time.monotonic() - start_time
+        finally:
+            server.close()
+        self.assertIsNone(entry)
+        self.assertLess(elapsed, a2s.A2S_TIMEOUT)
+
+    def test_in_flight_queries_are_bounded(self):
+        from obozrenie.adapters import a2s
+        in_flight = []
+        peak = []
+        original_request = a2s.A2SClient.request
+
+        async def request(client, address, packet, timeout):
+            in_flight.append(address)
+            peak.append(len(in_flight))
+            try:
+                return await original_request(client, address, packet, timeout)
+            finally:
+                in_flight.remove(address)
+
+        with mock.patch.object(a2s.A2SClient, "request", request):
+            self._query(["127.0.0.1:%i" % port for port in range(1, 11)], timeout=0.05, retries=0, max_in_flight=3)
+        self.assertEqual(max(peak), 3)
+
+
+class FakeUDPResponder(threading.Thread):
+    """Local stand-in for a UDP server that answers every request with a fixed list of datagrams and logs the requests."""
+
+    def __init__(self, responses):
+        super().__init__(daemon=True)
+        self.responses = responses
+        self.log = []
+        self.sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        self.sock.bind(('127.0.0.1', 0))
+        self.address = "127.0.0.1:%i" % self.sock.getsockname()[1]
+
+    def run(self):
+        while True:
+            try:
+                data, addr = self.sock.recvfrom(1400)
+            except OSError:
+                return
+            self.log.append(data)
+            for response in self.responses:
+                self.sock.sendto(response, addr)
+
+    def close(self):
+        self.sock.close()
+
+
+def build_dpmaster_page(addresses, last=False, ext=False):
+    """Builds a getservers(Ext)Response datagram like dpmaster sends it."""
+    page = b'\xff\xff\xff\xffgetserversExtResponse' if ext else b'\xff\xff\xff\xffgetserversResponse'
+    for address in addresses:
+        ip, port = address.split(':')
+        page += b'\\' + socket.inet_aton(ip) + struct.pack('>H', int(port))
+    if ext:
+        page += b'/' + bytes(18)  # IPv6 entries are skipped
+    if last:
+        page += b'\\EOT\x00\x00\x00'
+    return page
+
+
+class Quake3Tests(unittest.TestCase):
+    """Tests for the native Quake III family adapter."""
+
+    spec_status = (b'\xff\xff\xff\xffstatusResponse\n\\sv_hostname\\^1Red ^xF00Server\\mapname\\q3dm17'
+                   b'\\sv_maxclients\\16\\gamename\\baseq3\\g_needpass\\1\n'
+                   b'12 48 "^2Player^7A"\n0 999 1 "PlayerB"\n')
+
+    def test_parse_status(self):
+        from obozrenie.adapters import quake3
+        rules, players = quake3.parse_status(self.spec_status)
+        entry = quake3.adapt_server_entry('1.2.3.4:27960', rules, players, 0.05, 'q3a')
+        self.assertEqual(rules['mapname'], 'q3dm17')
+        self.assertEqual(players, [{'name': 'PlayerA', 'score': 12, 'ping': 48},
+                                   {'name': 'PlayerB', 'score': 0, 'ping': 999}])
+        self.assertEqual((entry['name'], entry['terrain'], entry['game_type']), ('Red Server', 'q3dm17', 'baseq3'))
+        self.assertEqual((entry['player_count'], entry['player_limit'], entry['ping']), (2, 16, 50))
+        self.assertTrue(entry['password'])
+
+    def test_rules_are_matched_by_name(self):
+        """Rules whose names are only part of a known rule name, e.g. game of gamename, set their own field or none."""
+        from obozrenie.adapters import quake3
+        rules = {'gamename': 'baseq3', 'game': 'cpma', 'name': 'x', 'e': '1'}
+        entry = quake3.adapt_server_entry('1.2.3.4:27960', rules, [], 0.05, 'q3a')
+        self.assertEqual((entry['game_name'], entry['game_mod'], entry['game_type']), ('baseq3', 'cpma', 'baseq3'))
+
+    def test_every_quake3_game_has_a_master_request(self):
+        from obozrenie.adapters import quake3
+        from obozrenie.global_settings import GAME_CONFIG_FILE
+        game_table = helpers.load_table(GAME_CONFIG_FILE)
+        games = [game for game, entry in game_table.items() if entry.get('adapter') == 'quake3']
+        self.assertIn('et', games)
+        for game in games:
+            self.assertTrue(quake3.get_master_request(game).startswith(quake3.PACKET_HEADER + b'getservers'), game)
+
+    def test_master_listing_feeds_status_queries(self):
+        from obozrenie.adapters import quake3
+        servers = [FakeUDPResponder([self.spec_status]) for i in range(3)]
+        silent = FakeUDPResponder([])
+        addresses = [server.address for server in servers + [silent]]
+        master = FakeUDPResponder([build_dpmaster_page(addresses[:2], ext=True),
+                                   build_dpmaster_page(addresses[2:] + [addresses[0]], last=True, ext=True)])
+        for thread in servers + [silent, master]:
+            thread.start()
+        try:
+            with mock.patch.object(quake3, "QUAKE3_TIMEOUT", 0.2):
+                result = quake3.stat_master('xonotic', {'name': 'Xonotic'}, ['master://' + master.address])
+        finally:
+            for thread in servers + [silent, master]:
+                thread.close()
+        self.assertEqual(master.log, [b'\xff\xff\xff\xffgetserversExt Xonotic 3 empty full'])
+        self.assertEqual(sorted(entry['host'] for entry in result), sorted(server.address for server in servers))
+        self.assertEqual([len(server.log) for server in servers], [1, 1, 1])
+        self.assertEqual(len(silent.log), quake3.QUAKE3_RETRIES + 1)
+
+
+class ServerRefreshTests(unittest.TestCase):
+    """Tests for refreshes that requery the known servers instead of the master servers."""
+
+    def _run_query(self, c, queries):
+        from obozrenie import adapters, server_cache
+
+        def stat_master_iter(game, game_info, master_list, token):
+            queries.append('master')
+            yield [{'host': '1.2.3.4:27960', 'name': 'A'}, {'host': '5.6.7.8:27960', 'name': 'B'}]
+
+        def stat_servers_iter(game, game_info, server_list, token):
+            queries.append(sorted(server_list))
+            yield [{'host': '1.2.3.4:27960', 'name': 'A2'}]
+
+        fake_adapter = types.SimpleNamespace(stat_master_iter=stat_master_iter, stat_servers_iter=stat_servers_iter)
+        with tempfile.TemporaryDirectory() as d:
+            with mock.patch.object(server_cache, "CACHE_DIR", d), \
+                    mock.patch.dict(adapters.adapter_table, {c.game_table.get_game_info('q3a')['adapter']: fake_adapter}):
+                c.stat_master_target('q3a')
+        return sorted(entry['name'] for entry in c.game_table.get_servers_data('q3a'))
+
+    def test_known_servers_are_requeried_between_master_refreshes(self):
+        from obozrenie import core
+        c = core.Core()
+        queries = []
+        self.assertEqual(self._run_query(c, queries), ['A', 'B'])
+        self.assertEqual(self._run_query(c, queries), ['A2'])
+        self.assertEqual(queries, ['master', ['1.2.3.4:27960', '5.6.7.8:27960']])
+
+        c.master_refresh_times['q3a'] -= core.MASTER_REFRESH_INTERVAL
+        self._run_query(c, queries)
+        self.assertEqual(queries[-1], 'master')
+
+    def test_full_refresh_asks_masters(self):
+        from obozrenie import core
+        c = core.Core()
+        queries = []
+        self._run_query(c, queries)
+        c.master_refresh_requests.add('q3a')
+        self._run_query(c, queries)
+        self._run_query(c, queries)
+        self.assertEqual(queries, ['master', 'master', ['1.2.3.4:27960', '5.6.7.8:27960']])
+
+    def test_cached_servers_are_not_requeried(self):
+        from obozrenie import core
+        c = core.Core()
+        c.game_table.set_servers_data('q3a', [{'host': '9.9.9.9:27960', 'name': 'Cached'}], stale=True)
+        self.assertIsNone(c.get_known_servers('q3a'))
+        self.assertIsNone(c.get_known_servers('minetest'))
+
+
+class ServerDetailsTests(unittest.TestCase):
+    """Tests for on demand server details."""
+
+    def test_details_are_cached(self):
+        from obozrenie import adapters, core
+        c = core.Core()
+        c.game_table.set_servers_data('q3a', [{'host': '1.2.3.4:27960', 'name': 'A', 'country': 'DE', 'players': []}])
+        queried = []
+
+        def stat_server_details(game, game_info, host, token):
+            queried.append(host)
+            if host == '5.6.7.8:27960':
+                return None
+            return {'host': host, 'name': 'A', 'players': [{'name': 'PlayerA'}]}
+
+        fake_adapter = types.SimpleNamespace(stat_server_details=stat_server_details)
+        with mock.patch.dict(adapters.adapter_table, {c.game_table.get_game_info('q3a')['adapter']: fake_adapter}):
+            first = c.get_server_details('q3a', '1.2.3.4:27960')
+            second = c.get_server_details('q3a', '1.2.3.4:27960')
+            self.assertIsNone(c.get_server_details('q3a', '5.6.7.8:27960'))
+            c.server_details[('q3a', '1.2.3.4:27960')] = (time.monotonic() - core.SERVER_DETAILS_TTL, first)
+            c.get_server_details('q3a', '1.2.3.4:27960')
+        self.assertIs(first, second)
+        self.assertEqual((first['players'], first['country']), ([{'name': 'PlayerA'}], 'DE'))
+        self.assertEqual(queried, ['1.2.3.4:27960', '5.6.7.8:27960', '1.2.3.4:27960'])
+
+    def test_list_entry_without_details_support(self):
+        from obozrenie import core
+        c = core.Core()
+        c.game_table.set_servers_data('minetest', [{'host': '1.2.3.4:30000', 'name': 'A', 'players': [{'name': 'PlayerA'}]}])
+        self.assertEqual(c.get_server_details('minetest', '1.2.3.4:30000')['players'], [{'name': 'PlayerA'}])
+
+
+class FakeEchoResponder(threading.Thread):
+    """Local stand-in for a pinged host. Answers echo requests sent over UDP, first with a reply of a foreign identifier, and can ignore every n-th request."""
+
+    def __init__(self, drop_every=None):
+        super().__init__(daemon=True)
+        self.drop_every = drop_every
+        self.requests = 0
+        self.sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        self.sock.bind(('127.0.0.1', 0))
+        self.port = self.sock.getsockname()[1]
+
+    def run(self):
+        while True:
+            try:
+                data, addr = self.sock.recvfrom(1400)
+            except OSError:
+                return
+            self.requests += 1
+            if self.drop_every is not None and self.requests % self.drop_every == 0:
+                continue
+            packet_type, code, checksum, identifier, sequence = struct.unpack_from('!BBHHH', data)
+            self.sock.sendto(struct.pack('!BBHHH', 0, 0, 0, identifier + 1, sequence), addr)
+            self.sock.sendto(struct.pack('!BBHHH', 0, 0, 0, identifier, sequence) + data[8:], addr)
+
+    def close(self):
+        self.sock.close()
+
+
+class PingTests(unittest.TestCase):
+    """Tests for the server response time measurement."""
+
+    def test_echo_request(self):
+        from obozrenie import ping
+        packet = ping.build_echo_request(0x1234, 7)
+        self.assertEqual(ping.icmp_checksum(packet), 0)
+        self.assertEqual(ping.parse_echo_reply(b'\x00' + packet[1:]), (0x1234, 7))
+        self.assertRaises(ValueError, ping.parse_echo_reply, packet)
+
+    def _echo_service(self, responder, **service_args):
+        from obozrenie import ping
+
+        class UDPPingService(ping.PingService):
+            def open_socket(self):
+                # The socket is set up like an ICMP one, only of the UDP protocol
+                create_socket = socket.socket
+                with mock.patch.object(ping.socket, "socket", lambda family, kind, proto: create_socket(family, kind)):
+                    return ping.open_icmp_socket()
+
+            def get_destination(self, ip):
+                return (ip, responder.port)
+
+        return UDPPingService(**service_args)
+
+    def test_icmp_socket_has_identifier(self):
+        from obozrenie import ping
+        create_socket = socket.socket
+        with mock.patch.object(ping.socket, "socket", lambda family, kind, proto: create_socket(family, kind)):
+            icmp_socket = ping.open_icmp_socket()
+        try:
+            self.assertNotEqual(icmp_socket.getsockname()[1], 0)
+        finally:
+            icmp_socket.close()
+
+    def test_replies_are_matched_to_requests(self):
+        from obozrenie import ping
+        responder = FakeEchoResponder()
+        responder.start()
+        service = self._echo_service(responder, timeout=0.3)
+        try:
+            status = service.ping(['127.0.0.1', 'localhost', '127.0.0.2'])
+            self.assertEqual(service.mode, "icmp")
+        finally:
+            service.close()
+            responder.close()
+        self.assertLess(status['127.0.0.1'].rtt, ping.PING_UNREACHABLE)
+        self.assertLess(status['localhost'].rtt, ping.PING_UNREACHABLE)
+        self.assertEqual(status['127.0.0.1'].loss, 0)
+        self.assertEqual(status['127.0.0.2'], ping.PingStats())
+
+    def test_probes_are_sampled(self):
+        responder = FakeEchoResponder(drop_every=2)
+        responder.start()
+        service = self._echo_service(responder, timeout=0.3, samples=4, sample_interval=0.01)
+        try:
+            stats = service.ping(['127.0.0.1'])['127.0.0.1']
+        finally:
+            service.close()
+            responder.close()
+        self.assertEqual(responder.requests, 4)
+        self.assertEqual(stats.loss, 50)
+        self.assertLessEqual(stats.rtt_min, stats.rtt)
+
+    def test_sampling_takes_no_more_wall_time(self):
+        """Hosts pinged three times each take about as long as with a single echo request: the rate and in-flight limits count hosts."""
+        responder = FakeEchoResponder()
+        responder.start()
+        hosts = ['127.0.0.%i' % i for i in range(2, 42)]
+        elapsed = {}
+        try:
+            for samples in (1, 3):
+                service = self._echo_service(responder, timeout=0.1, rate=100, max_in_flight=10, samples=samples, sample_interval=0.02)
+                try:
+                    start_time = time.monotonic()
+                    self.assertEqual(len(service.ping(hosts)), len(hosts))
+                    elapsed[samples] = time.monotonic() - start_time
+                finally:
+                    service.close()
+        finally:
+            responder.close()
+        self.assertLess(elapsed[3], elapsed[1] * 1.25 + 0.15)
+
+    def test_ping_stats(self):
+        from obozrenie import ping
+        self.assertEqual(ping.PingStats.from_samples([20.4, 30, 10.2, 40], 5), ping.PingStats(25, 10, 20, 20))
+        self.assertEqual(ping.PingStats.from_samples([], 3), ping.PingStats(ping.PING_UNREACHABLE, ping.PING_UNREACHABLE, 0, 100))
+        self.assertEqual(ping.parse_utility_output("64 bytes from 1.2.3.4: icmp_seq=1 ttl=50 time=21.5 ms\n"
+                                                   "64 bytes from 1.2.3.4: icmp_seq=3 ttl=50 time=19.0 ms\n"
+                                                   "3 packets transmitted, 2 received, 33% packet loss\n"), [21.5, 19.0])
+        self.assertEqual(ping.parse_utility_output("Reply from 1.2.3.4: bytes=32 time<1ms TTL=128"), [1.0])
+
+    def _utility_service(self, utility_ping, **service_args):
+        from obozrenie import ping
+        service = ping.PingService(**service_args)
+        service.open_socket = mock.Mock(side_effect=PermissionError("Permission denied"))
+        return service, mock.patch.object(ping, "utility_ping", side_effect=utility_ping)
+
+    def test_ping_utility_without_icmp_sockets(self):
+        from obozrenie import ping
+        servers = [{'host': '1.2.3.4:30000'}, {'host': '1.2.3.4:30001'}, {'host': '5.6.7.8:30000'}]
+        service, utility_patch = self._utility_service(lambda host, samples: [42, 44] if host == '1.2.3.4' else [])
+        with mock.patch.object(ping, "service", service), utility_patch as utility_ping:
+            ping.add_rtt_info(servers)
+        service.close()
+        self.assertEqual([server['ping'] for server in servers], [43, 43, 9999])
+        self.assertEqual([server['ping_loss'] for server in servers], [33, 33, 100])
+        self.assertEqual((servers[0]['ping_min'], servers[0]['ping_jitter']), (42, 2))
+        self.assertEqual(utility_ping.call_count, 2)
+
+    def test_concurrent_callers_share_probes(self):
+        def slow_ping(host, samples):
+            time.sleep(0.2)
+            return [10] * samples
+
+        service, utility_patch = self._utility_service(slow_ping)
+        results = []
+        with utility_patch as utility_ping:
+            callers = [threading.Thread(target=lambda hosts: results.append(service.ping(hosts)), args=(hosts,))
+                       for hosts in (['a', 'b'], ['b', 'c'])]
+            for caller in callers:
+                caller.start()
+            for caller in callers:
+                caller.join()
+        service.close()
+        self.assertEqual(sorted(call[0][0] for call in utility_ping.call_args_list), ['a', 'b', 'c'])
+        self.assertEqual(sorted(sorted(result) for result in results), [['a', 'b'], ['b', 'c']])
+
+    def test_rate_and_token_limit_probes(self):
+        service, utility_patch = self._utility_service(lambda host, samples: [10], rate=20, samples=1)
+        with utility_patch:
+            start_time = time.monotonic()
+            self.assertEqual(len(service.ping(['a', 'b', 'c', 'd', 'e'])), 5)
+            self.assertGreaterEqual(time.monotonic() - start_time, 0.18)
+
+            token = helpers.CancelToken(0.12)
+            status = service.ping(['f%i' % i for i in range(20)], token)
+            self.assertEqual(service.mode, "utility")
+        service.close()
+        self.assertLess(len(status), 5)
+
+    def test_silent_hosts_get_application_probes(self):
+        from obozrenie import ping
+        from obozrenie.adapters import minetest
+        minetest_server = FakeUDPResponder([minetest.MINETEST_PROTOCOL_ID + b'\x00\x01\x00\x03\xff\xdc\x00\x01\x00\x02'])
+        minetest_server.start()
+        rigsofrods_server = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        rigsofrods_server.bind(('127.0.0.1', 0))
+        rigsofrods_server.listen()
+        closed_port = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        closed_port.bind(('127.0.0.1', 0))
+        rigsofrods_address = "127.0.0.1:%i" % rigsofrods_server.getsockname()[1]
+        closed_address = "127.0.0.1:%i" % closed_port.getsockname()[1]
+
+        minetest_servers = [{'host': minetest_server.address}, {'host': closed_address}]
+        rigsofrods_servers = [{'host': rigsofrods_address}, {'host': closed_address}]
+        service, utility_patch = self._utility_service(lambda host, samples: [], timeout=0.3)
+        try:
+            with mock.patch.object(ping, "service", service), utility_patch as utility_ping:
+                ping.add_rtt_info(minetest_servers, probe=minetest.probe_server)
+                ping.add_rtt_info(rigsofrods_servers, probe=ping.tcp_connect_probe)
+            for i in range(50):
+                if len(minetest_server.log) == 2:
+                    break
+                time.sleep(0.01)
+        finally:
+            service.close()
+            minetest_server.close()
+            rigsofrods_server.close()
+            closed_port.close()
+        self.assertEqual(utility_ping.call_count, 1)
+        self.assertEqual(minetest_server.log, [minetest.MINETEST_HELLO, minetest.MINETEST_PROTOCOL_ID + b'\x00\x02\x00\x00\x03'])
+        self.assertEqual([(server['ping'] < 9999, server['ping_loss']) for server in minetest_servers + rigsofrods_servers],
+                         [(True, 0), (False, 100), (True, 0), (False, 100)])
+
+    def test_rtt_cache_expires_and_evicts(self):
+        from obozrenie import ping
+        cache = ping.RTTCache(ttl=60, max_size=3)
+        cache.update({'a': 10, 'b': 20})
+        cache.update({'c': 30}, time.time() - 60)
+        self.assertEqual(cache.get_many(['a', 'b', 'c', 'd']), {'a': 10, 'b': 20})
+        cache.get_many(['a'])
+        cache.update({'d': 40, 'e': 50})
+        self.assertEqual(cache.get_many(['a', 'b', 'd', 'e']), {'a': 10, 'd': 40, 'e': 50})
+
+        cache.load([('f', 60, time.time()), ('g', 70, time.time() - 60)])
+        self.assertEqual([entry[0] for entry in cache.items()], ['a', 'd', 'e'])
+
+    def test_only_uncached_hosts_are_probed(self):
+        from obozrenie import ping
+        service, utility_patch = self._utility_service(lambda host, samples: [10] * samples)
+        with utility_patch as utility_ping:
+            service.ping(['a', 'b'])
+            self.assertEqual(service.ping(['a', 'c']), {'a': ping.PingStats(10, 10, 0, 0), 'c': ping.PingStats(10, 10, 0, 0)})
+        service.close()
+        self.assertEqual(sorted(call[0][0] for call in utility_ping.call_args_list), ['a', 'b', 'c'])
+
+
+class ProxyTests(unittest.TestCase):
+    def test_every_game_proxy_is_registered(self):
+        from obozrenie import proxies
+        from obozrenie.global_settings import GAME_CONFIG_FILE
+        game_table = helpers.load_table(GAME_CONFIG_FILE)
+        for game, entry in game_table.items():
+            if 'proxy' in entry:
+                self.assertIn(entry['proxy'], proxies.proxy_table, game)
+
+
 class CoreGeoIPTests(unittest.TestCase):
     """Tests for Core geolocation lookups."""
 